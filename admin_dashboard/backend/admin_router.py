@@ -7,6 +7,7 @@ from fastapi import APIRouter, Depends, HTTPException, status, Query, Body
 from typing import List, Optional, Dict, Any
 from pydantic import BaseModel, EmailStr
 from datetime import datetime
+import asyncio
 import logging
 import os
 
@@ -20,6 +21,9 @@ from platforms.handler_registry import get_line_handler, get_facebook_handler
 
 logger = logging.getLogger(__name__)
 
+# Recipients fetched per keyset page during a broadcast
+BROADCAST_CHUNK_SIZE = int(os.getenv('BROADCAST_CHUNK_SIZE', 500))
+
 # Create router
 admin_router = APIRouter(prefix="/api/admin", tags=["Admin Dashboard"])
 
@@ -120,44 +124,47 @@ async def get_conversations(
     status: Optional[str] = Query(None),
     limit: int = Query(50, ge=1, le=200),
     offset: int = Query(0, ge=0),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
     current_admin: AdminUserResponse = Depends(get_current_admin)
 ):
-    """Get conversations with optional filters"""
+    """Get conversations with optional filters (keyset-paginated via cursor)"""
     try:
         crud = get_crud()
         
-        conversations = crud.get_conversations(
+        page = crud.list_conversations(
             user_id=user_id,
             platform=platform,
             status=status,
             limit=limit,
+            cursor=cursor,
             offset=offset
         )
         
         conv_list = []
-        for conv in conversations:
-            # get user to attach some details
-            user = crud.get_user_by_id(conv.user_id)
+        for conv in page["items"]:
             conv_list.append({
-                "id": conv.id,
-                "user_id": conv.user_id,
-                "platform": conv.platform,
-                "status": conv.status,
-                "started_at": conv.started_at.isoformat() if conv.started_at else None,
-                "ended_at": conv.ended_at.isoformat() if conv.ended_at else None,
-                "messages_count": conv.messages_count,
-                "intent": conv.intent,
-                "priority": conv.priority,
-                "handled_by": conv.handled_by,
-                "user_display_name": (user.display_name or user.platform_user_id or "Unknown") if user else "Unknown",
-                "user_profile_pic": user.profile_pic_url if user else None,
+                "id": conv["id"],
+                "user_id": conv["user_id"],
+                "platform": conv["platform"],
+                "status": conv["status"],
+                "started_at": conv["started_at"].isoformat() if conv["started_at"] else None,
+                "ended_at": conv["ended_at"].isoformat() if conv["ended_at"] else None,
+                "messages_count": conv["messages_count"],
+                "intent": conv["intent"],
+                "priority": conv["priority"],
+                "handled_by": conv["handled_by"],
+                "user_display_name": conv["display_name"] or conv["platform_user_id"] or "Unknown",
+                "user_profile_pic": conv["profile_pic_url"],
             })
             
         return {
-            "total": len(conv_list),
+            "total": crud.count_conversations(user_id=user_id, platform=platform, status=status),
             "conversations": conv_list,
+            "next_cursor": page["next_cursor"],
         }
     
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error getting conversations: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -476,46 +483,65 @@ async def send_broadcast(
         }
 
         for target_platform in targets:
-            users = crud.get_users_for_broadcast(
-                platform=target_platform,
-                target_tags=broadcast.target_tags,
-                limit=5000
-            )
-
+            target_count = 0
             success_count = 0
             failed_count = 0
 
-            for user in users:
-                try:
-                    if target_platform == "line":
-                        ok = await line_handler.send_message(
-                            user.platform_user_id,
-                            {
-                                "text": broadcast.message,
-                                "image_url": broadcast.image_url
-                            }
-                        )
-                    else:
-                        # Proactive messaging requires MESSAGE_TAG and valid tag
-                        ok = await facebook_handler.send_message(
-                            user.platform_user_id,
+            # Recipients come in keyset pages of (id, platform_user_id) — no cap, constant memory;
+            # each page is a short query in a worker thread, nothing stays open between sends
+            after_id = 0
+            while True:
+                chunk = await asyncio.to_thread(
+                    crud.get_broadcast_recipients,
+                    platform=target_platform,
+                    target_tags=broadcast.target_tags,
+                    after_id=after_id,
+                    limit=BROADCAST_CHUNK_SIZE
+                )
+                if not chunk:
+                    break
+                after_id = chunk[-1][0]
+                recipient_ids = [platform_user_id for _, platform_user_id in chunk]
+                target_count += len(recipient_ids)
+
+                if target_platform == "facebook":
+                    # Graph batch requests: up to 50 sends per HTTP round trip
+                    # Proactive messaging requires MESSAGE_TAG and valid tag
+                    try:
+                        sent = await facebook_handler.send_messages_bulk(
+                            recipient_ids,
                             {
                                 "text": broadcast.message,
                                 "messaging_type": "MESSAGE_TAG",
                                 "tag": os.getenv("FACEBOOK_BROADCAST_TAG", "ACCOUNT_UPDATE")
                             }
                         )
-
-                    if ok:
-                        success_count += 1
-                    else:
-                        failed_count += 1
-                except Exception:
-                    failed_count += 1
+                        delivered = sum(1 for ok in sent.values() if ok)
+                        success_count += delivered
+                        failed_count += len(recipient_ids) - delivered
+                    except Exception:
+                        failed_count += len(recipient_ids)
+                else:
+                    for platform_user_id in recipient_ids:
+                        try:
+                            ok = await line_handler.send_message(
+                                platform_user_id,
+                                {
+                                    "text": broadcast.message,
+                                    "image_url": broadcast.image_url
+                                }
+                            )
+
+                            if ok:
+                                success_count += 1
+                            else:
+                                failed_count += 1
+                        except Exception:
+                            failed_count += 1
 
             crud.create_broadcast_log(
                 platform=target_platform,
-                target_users=len(users),
+                target_users=target_count,
                 successful=success_count,
                 failed=failed_count,
                 metadata={
@@ -526,11 +552,11 @@ async def send_broadcast(
                 }
             )
 
-            summary["total_target_users"] += len(users)
+            summary["total_target_users"] += target_count
             summary["total_successful"] += success_count
             summary["total_failed"] += failed_count
             summary["by_platform"][target_platform] = {
-                "target_users": len(users),
+                "target_users": target_count,
                 "successful": success_count,
                 "failed": failed_count
             }
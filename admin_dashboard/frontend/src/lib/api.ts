@@ -78,7 +78,7 @@ export const usersAPI = {
 }
 
 export const conversationsAPI = {
-  getConversations: (params?: { user_id?: number; platform?: string; limit?: number }) =>
+  getConversations: (params?: { user_id?: number; platform?: string; limit?: number; cursor?: string }) =>
     api.get('/api/admin/conversations', { params }),
   
   getMessages: (conversationId: number, limit?: number) =>
@@ -2,6 +2,7 @@ import os
 import re
 import sys
 import hashlib
+import threading
 import time
 from pathlib import Path
 from typing import List, Dict, Any, Optional, Iterable, Union
@@ -25,17 +26,25 @@ def _get_env(name: str, default: Optional[str] = None) -> Optional[str]:
 
 class AIService:
     _instance = None
+    # Handlers may be constructed concurrently at startup — load the KB only once
+    _init_lock = threading.RLock()
 
     def __new__(cls):
-        if cls._instance is None:
-            cls._instance = super(AIService, cls).__new__(cls)
-            cls._instance.initialized = False
-        return cls._instance
+        with cls._init_lock:
+            if cls._instance is None:
+                cls._instance = super(AIService, cls).__new__(cls)
+                cls._instance.initialized = False
+            return cls._instance
 
     def __init__(self):
         if self.initialized:
             return
-        
+        with self._init_lock:
+            if self.initialized:
+                return
+            self._initialize()
+
+    def _initialize(self):
         # Chatbot Engine: Typhoon v2.5 30B (SCB 10X)
         self.api_key = _get_env("TYPHOON_API_KEY")
         self.base_url = "https://api.opentyphoon.ai/v1"
@@ -209,6 +218,38 @@ class AIService:
         self.knowledge_base = self._load_knowledge_base_from_files()
         print(f"Knowledge Base Loaded: {len(self.knowledge_base)} documents.")
 
+    def upsert_documents(self, documents: List[Dict[str, str]]) -> int:
+        """Add or replace knowledge base documents by source without a full reload.
+        Only documents whose content changed are re-embedded.
+
+        Args:
+            documents: [{"source": ..., "content": ...}]
+
+        Returns:
+            Number of documents added or replaced
+        """
+        by_source = {doc["source"]: doc for doc in self.knowledge_base}
+        changed = 0
+        for document in documents:
+            source, content = document["source"], document.get("content", "")
+            existing = by_source.get(source)
+            if existing is not None and existing["content"] == content:
+                continue
+            by_source[source] = {
+                "source": source,
+                "content": content,
+                "embedding": self._get_embedding(content) if self.client and content.strip() else []
+            }
+            changed += 1
+
+        if changed:
+            # Swap the list in one assignment — readers iterate the old one safely
+            self.knowledge_base = [doc for doc in by_source.values() if doc["content"].strip()]
+            # Cached answers may quote the replaced content
+            self.response_cache.clear()
+            print(f"Knowledge Base: upserted {changed} document(s), {len(self.knowledge_base)} total.")
+        return changed
+
     def _load_knowledge_base_from_files(self) -> List[Dict[str, Any]]:
         """Download data from files /data/text"""
         knowledge = []
@@ -515,6 +556,11 @@ Assistant: ราคา Botox ขึ้นอยู่กับส่วนท
 
         return _get_env("SYSTEM_PROMPT", default_prompt) or default_prompt
 
+    def get_system_prompt_version(self) -> str:
+        """Short content hash of the current system prompt.
+        Sessions store this reference instead of the prompt text itself."""
+        return hashlib.sha1(self.get_system_prompt().encode('utf-8')).hexdigest()[:12]
+
     # -------------------------------------------------------------------------
     # Token budget management (sliding window — same strategy as OpenAI cookbook)
     # Thai text ≈ 1 token per 1.5 chars; English ≈ 1 token per 4 chars.
@@ -0,0 +1,275 @@
+"""
+Graph API Batch Requests
+รวม Graph operation ที่เข้ามาในช่วงสั้นๆ (หรือครบ 50) เป็น batch POST เดียว
+แล้วแจกผลกลับให้ผู้เรียกแต่ละคน — broadcast / profile backfill ลด round trip ได้ 50 เท่า
+
+- Window สั้น (GRAPH_BATCH_WINDOW) หรือครบ GRAPH_BATCH_SIZE (สูงสุด 50 ตาม Meta)
+- Partial failure: item ที่ถูก throttle / ไม่ได้ถูก execute (null) จะ retry เฉพาะ item นั้น
+- ทั้ง batch ล้มเหลว (timeout / 5xx / ผลไม่ครบ): retry เฉพาะ GET — POST อาจถูก execute ไปแล้ว
+  (ยกเว้น error ที่ยืนยันว่ายังไม่ได้ส่ง เช่น ConnectError)
+- ใช้ GraphClient ตัวเดียวกับทั้งระบบ (pool เดียว, retry ระดับ request เหมือนเดิม)
+"""
+
+import asyncio
+import json
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlencode
+import logging
+
+import httpx
+
+from core.graph_client import GraphClient, THROTTLE_ERROR_CODES, get_graph_client
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_SIZE = 50  # Meta's limit per batch call
+
+# Batch call failed before reaching Meta: every operation is safe to re-send
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+@dataclass(slots=True)
+class GraphBatchResult:
+    """Result of one operation inside a batch"""
+    code: int
+    body: Any = None
+
+    @property
+    def is_success(self) -> bool:
+        return 200 <= self.code < 300
+
+    def json(self) -> Any:
+        return self.body
+
+
+@dataclass(slots=True)
+class _BatchOp:
+    method: str
+    relative_url: str
+    access_token: str
+    future: asyncio.Future
+    body: Optional[Dict[str, Any]] = None
+    attempts: int = 0
+
+    def to_request(self) -> Dict[str, Any]:
+        request = {"method": self.method, "relative_url": self.relative_url}
+        if self.body:
+            # Batch bodies are form-encoded; nested objects go as JSON strings
+            request["body"] = urlencode({
+                key: json.dumps(value) if isinstance(value, (dict, list)) else value
+                for key, value in self.body.items()
+            })
+        return request
+
+
+@dataclass(slots=True)
+class _PendingBatch:
+    ops: List[_BatchOp] = field(default_factory=list)
+    timer: Optional[asyncio.TimerHandle] = None
+
+
+class GraphBatcher:
+    """Coalesces Graph operations into batch calls"""
+
+    def __init__(self, client: GraphClient = None, window: float = None, batch_size: int = None):
+        """
+        Initialize batcher
+
+        Args:
+            client: GraphClient used for the batch POST (shared singleton by default)
+            window: Seconds to wait for more operations before sending a partial batch
+            batch_size: Operations per batch call (capped at 50)
+        """
+        self.client = client or get_graph_client()
+        self.window = window if window is not None else float(os.getenv('GRAPH_BATCH_WINDOW', 0.05))
+        self.batch_size = min(batch_size or int(os.getenv('GRAPH_BATCH_SIZE', MAX_BATCH_SIZE)), MAX_BATCH_SIZE)
+        self.max_item_retries = int(os.getenv('GRAPH_BATCH_ITEM_RETRIES', 2))
+        self.max_inflight = int(os.getenv('GRAPH_BATCH_CONCURRENCY', 4))
+
+        # Pending ops per access token (one batch call carries one token)
+        self._pending: Dict[str, _PendingBatch] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._tasks = set()
+
+        self.stats = {
+            "operations": 0,
+            "batches": 0,
+            "item_retries": 0,
+            "item_failures": 0,
+            "batch_failures": 0
+        }
+
+    # ------------------------------------------------------------------
+    # Submitting
+    # ------------------------------------------------------------------
+
+    async def submit(
+        self,
+        method: str,
+        relative_url: str,
+        access_token: str,
+        body: Dict[str, Any] = None
+    ) -> GraphBatchResult:
+        """
+        Queue one Graph operation and wait for its result
+
+        Args:
+            method: 'GET' | 'POST' | 'DELETE'
+            relative_url: Path + query without the version prefix (e.g. '123?fields=id,name')
+            access_token: Token for the operation
+            body: Form fields for POST operations (dict/list values are JSON-encoded)
+
+        Returns:
+            GraphBatchResult (code 0 if the operation could not be sent)
+        """
+        self._bind_loop()
+        op = _BatchOp(
+            method=method.upper(),
+            relative_url=relative_url.lstrip('/'),
+            access_token=access_token,
+            future=self._loop.create_future(),
+            body=body
+        )
+        self.stats["operations"] += 1
+        self._enqueue(op)
+        return await op.future
+
+    async def get(self, relative_url: str, access_token: str) -> GraphBatchResult:
+        return await self.submit("GET", relative_url, access_token)
+
+    async def post(self, relative_url: str, access_token: str, body: Dict[str, Any]) -> GraphBatchResult:
+        return await self.submit("POST", relative_url, access_token, body)
+
+    def _bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # New loop (tests / scripts): timers and futures of the old one are unusable
+            self._loop = loop
+            self._pending = {}
+            self._semaphore = asyncio.Semaphore(self.max_inflight)
+
+    def _enqueue(self, op: _BatchOp):
+        pending = self._pending.setdefault(op.access_token, _PendingBatch())
+        pending.ops.append(op)
+        if len(pending.ops) >= self.batch_size:
+            self._flush(op.access_token)
+        elif pending.timer is None:
+            pending.timer = self._loop.call_later(self.window, self._flush, op.access_token)
+
+    def _flush(self, access_token: str):
+        pending = self._pending.pop(access_token, None)
+        if pending is None:
+            return
+        if pending.timer is not None:
+            pending.timer.cancel()
+        task = self._loop.create_task(self._send(access_token, pending.ops))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    # ------------------------------------------------------------------
+    # Sending
+    # ------------------------------------------------------------------
+
+    async def _send(self, access_token: str, ops: List[_BatchOp]):
+        async with self._semaphore:
+            self.stats["batches"] += 1
+            nothing_sent = False
+            try:
+                response = await self.client.post(
+                    "/",
+                    endpoint="batch",
+                    data={
+                        "access_token": access_token,
+                        "include_headers": "false",
+                        "batch": json.dumps([op.to_request() for op in ops])
+                    }
+                )
+                results = response.json() if response.is_success else None
+                if not isinstance(results, list) or len(results) != len(ops):
+                    # 429 = the whole batch was rejected before any operation ran
+                    nothing_sent = response.status_code == 429
+                    raise ValueError(f"batch call failed: {response.status_code} {response.text[:200]}")
+            except Exception as e:
+                self.stats["batch_failures"] += 1
+                logger.error(f"❌ Graph batch of {len(ops)} failed: {e}")
+                nothing_sent = nothing_sent or isinstance(e, NOT_SENT_ERRORS)
+                failed = GraphBatchResult(code=0, body={"error": {"message": str(e)}})
+                for op in ops:
+                    # Meta may have executed part of the batch: re-sending a POST could DM twice
+                    if nothing_sent or op.method == "GET":
+                        self._retry_or_fail(op, failed)
+                    else:
+                        self._resolve(op, failed)
+                return
+
+        for op, item in zip(ops, results):
+            result = self._parse_item(item)
+            if self._should_retry(op, result):
+                self._retry_or_fail(op, result)
+            else:
+                self._resolve(op, result)
+
+    @staticmethod
+    def _parse_item(item: Optional[Dict[str, Any]]) -> GraphBatchResult:
+        # null = Meta did not execute this operation (e.g. batch timed out)
+        if item is None:
+            return GraphBatchResult(code=0)
+        body = item.get("body")
+        try:
+            body = json.loads(body) if isinstance(body, str) else body
+        except ValueError:
+            pass
+        return GraphBatchResult(code=int(item.get("code") or 0), body=body)
+
+    @staticmethod
+    def _should_retry(op: _BatchOp, result: GraphBatchResult) -> bool:
+        if result.code == 0 or result.code == 429:
+            return True
+        error = result.body.get("error", {}) if isinstance(result.body, dict) else {}
+        if error.get("code") in THROTTLE_ERROR_CODES:
+            return True
+        # Re-sending a POST after a 5xx may duplicate it (see GraphClient.request)
+        return result.code >= 500 and op.method == "GET"
+
+    def _retry_or_fail(self, op: _BatchOp, result: GraphBatchResult):
+        op.attempts += 1
+        if op.attempts <= self.max_item_retries:
+            self.stats["item_retries"] += 1
+            self._loop.call_later(min(2 ** op.attempts * 0.5, 10), self._enqueue, op)
+            return
+        self._resolve(op, result)
+
+    def _resolve(self, op: _BatchOp, result: GraphBatchResult):
+        if not result.is_success:
+            self.stats["item_failures"] += 1
+        if not op.future.done():
+            op.future.set_result(result)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Batching statistics"""
+        batches = self.stats["batches"]
+        return {
+            **self.stats,
+            "batch_size": self.batch_size,
+            "window_seconds": self.window,
+            "avg_ops_per_batch": round(self.stats["operations"] / batches, 2) if batches else 0,
+            "pending": sum(len(pending.ops) for pending in self._pending.values())
+        }
+
+
+# Singleton
+_graph_batcher: Optional[GraphBatcher] = None
+_graph_batcher_lock = threading.Lock()
+
+def get_graph_batcher() -> GraphBatcher:
+    """Get shared Graph batcher singleton"""
+    global _graph_batcher
+    if _graph_batcher is None:
+        with _graph_batcher_lock:
+            if _graph_batcher is None:
+                _graph_batcher = GraphBatcher()
+    return _graph_batcher
@@ -0,0 +1,371 @@
+"""
+Meta Graph API Client
+httpx AsyncClient ตัวเดียวใช้ร่วมกันทุก integration (Messenger / Instagram / Comments / Page scraper)
+
+- Keep-alive connection pool (+ HTTP/2 ถ้าติดตั้ง h2)
+- Timeout แยกตาม endpoint
+- Retry 5xx / 429 / throttling error codes โดยอ่าน Retry-After และ usage headers ของ Meta
+  (X-App-Usage, X-Page-Usage, X-Business-Use-Case-Usage)
+- Metrics ต่อ endpoint: requests, errors, retries, latency
+"""
+
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, Optional
+import logging
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# HTTP/2 needs the optional `h2` package
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+GRAPH_API_URL = os.getenv('GRAPH_API_URL', 'https://graph.facebook.com/v20.0')
+
+# Graph error codes that mean "throttled" (retry after backing off)
+# https://developers.facebook.com/docs/graph-api/overview/rate-limiting
+THROTTLE_ERROR_CODES = {4, 17, 32, 613, 80001, 80002, 80004, 80005, 80006, 80008}
+
+# Default timeouts (seconds) per endpoint, override with GRAPH_TIMEOUT_<ENDPOINT>
+ENDPOINT_TIMEOUTS = {
+    "messages": 10.0,
+    "comments": 10.0,
+    "node": 5.0,       # profile / object lookups
+    "picture": 5.0,
+    "posts": 15.0,
+    "batch": 30.0,
+    "default": 10.0
+}
+
+USAGE_HEADERS = ("x-app-usage", "x-page-usage", "x-business-use-case-usage")
+
+
+class GraphClient:
+    """
+    Pooled async Graph API client
+
+    Must be used from one event loop (the app's). Worker threads call
+    request_sync(), which runs the request on that loop so every caller
+    shares the same connection pool
+    """
+
+    def __init__(self, base_url: str = GRAPH_API_URL):
+        self.base_url = base_url.rstrip('/')
+        self.max_connections = int(os.getenv('GRAPH_HTTP_MAX_CONNECTIONS', 20))
+        self.max_retries = int(os.getenv('GRAPH_MAX_RETRIES', 3))
+        # Never sleep longer than this for one retry; longer waits give up instead
+        self.max_retry_delay = float(os.getenv('GRAPH_MAX_RETRY_DELAY', 30))
+        self.connect_timeout = float(os.getenv('GRAPH_CONNECT_TIMEOUT', 3))
+        self.http2 = HTTP2_AVAILABLE and os.getenv('GRAPH_HTTP2', 'true').lower() == 'true'
+
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._sync_client: Optional[httpx.Client] = None
+        self._lock = threading.Lock()
+
+        self.usage: Dict[str, Any] = {}
+        self.stats: Dict[str, Dict[str, Any]] = {}
+
+    # ------------------------------------------------------------------
+    # Clients
+    # ------------------------------------------------------------------
+
+    def _limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_connections,
+            keepalive_expiry=60
+        )
+
+    def _get_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop or self._client.is_closed:
+            self._client = httpx.AsyncClient(base_url=self.base_url, http2=self.http2, limits=self._limits())
+            self._loop = loop
+            logger.info(f"🔌 Graph API client pool ready (max={self.max_connections}, http2={self.http2})")
+        return self._client
+
+    def open(self):
+        """Create the pool on the running event loop (startup) so worker threads can share it"""
+        self._get_client()
+
+    def _timeout(self, endpoint: str) -> httpx.Timeout:
+        default = ENDPOINT_TIMEOUTS.get(endpoint, ENDPOINT_TIMEOUTS["default"])
+        read = float(os.getenv(f'GRAPH_TIMEOUT_{endpoint.upper()}', default))
+        return httpx.Timeout(read, connect=self.connect_timeout)
+
+    @staticmethod
+    def _endpoint_name(path: str) -> str:
+        """'/me/messages' -> 'messages', '/1234567' -> 'node'"""
+        last = path.split('?')[0].rstrip('/').rsplit('/', 1)[-1]
+        return last if last.isalpha() and last != "me" else "node"
+
+    # ------------------------------------------------------------------
+    # Requests
+    # ------------------------------------------------------------------
+
+    async def request(self, method: str, path: str, endpoint: str = None, **kwargs) -> httpx.Response:
+        """
+        Send a Graph API request with retries
+
+        Args:
+            method: HTTP method
+            path: Path relative to the versioned base URL (e.g. '/me/messages')
+            endpoint: Metrics / timeout label (derived from path if omitted)
+            **kwargs: Passed to httpx (params, json, data, headers)
+
+        Returns:
+            The final httpx.Response (callers check .is_success)
+
+        Raises:
+            httpx.HTTPError when the request could not be sent at all
+        """
+        endpoint = endpoint or self._endpoint_name(path)
+        client = self._get_client()
+        timeout = self._timeout(endpoint)
+        metrics = self._metrics(endpoint)
+        # Re-sending a POST after a 5xx may duplicate a message; only retry
+        # POSTs when Meta says it was throttled or the connection never opened
+        idempotent = method.upper() in ("GET", "HEAD", "DELETE")
+
+        attempt = 0
+        while True:
+            attempt += 1
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, timeout=timeout, **kwargs)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                self._record(metrics, started, None)
+                if attempt > self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                logger.warning(f"⚠️  Graph {endpoint} connect failed ({e}), retry {attempt} in {delay:.1f}s")
+            except httpx.TransportError as e:
+                self._record(metrics, started, None)
+                if not idempotent or attempt > self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                logger.warning(f"⚠️  Graph {endpoint} transport error ({e}), retry {attempt} in {delay:.1f}s")
+            else:
+                self._record(metrics, started, response)
+                self._track_usage(response)
+                throttled = self._is_throttled(response)
+                retryable = throttled or (idempotent and response.status_code >= 500)
+                if not retryable or attempt > self.max_retries:
+                    return response
+                delay = self._retry_delay(response, attempt)
+                if delay is None:
+                    logger.warning(f"⚠️  Graph {endpoint} throttled beyond {self.max_retry_delay}s, giving up")
+                    return response
+                logger.warning(f"⚠️  Graph {endpoint} {response.status_code}, retry {attempt} in {delay:.1f}s")
+
+            metrics["retries"] += 1
+            await asyncio.sleep(delay)
+
+    async def get(self, path: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", path, **kwargs)
+
+    def loop_running(self) -> bool:
+        """True when the pool is bound to a live event loop"""
+        return self._loop is not None and self._loop.is_running()
+
+    def run_sync(self, coro):
+        """
+        Run a coroutine that uses this client from a worker thread and wait for it
+
+        Uses the app's event loop when there is one (shared pool), otherwise
+        runs it on a temporary loop (standalone scripts)
+        """
+        if not self.loop_running():
+            return asyncio.run(coro)
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            coro.close()
+            raise RuntimeError("Blocking Graph call on the event loop thread; await it instead")
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def request_sync(self, method: str, path: str, **kwargs) -> httpx.Response:
+        """
+        Blocking variant for worker threads (profile cache fetchers, scripts)
+
+        Runs on the app's event loop when there is one, so the pool is shared;
+        standalone scripts without a loop get a plain httpx.Client
+        """
+        if self.loop_running():
+            return self.run_sync(self.request(method, path, **kwargs))
+
+        endpoint = kwargs.pop("endpoint", None) or self._endpoint_name(path)
+        with self._lock:
+            if self._sync_client is None:
+                self._sync_client = httpx.Client(base_url=self.base_url, limits=self._limits())
+        started = time.perf_counter()
+        response = self._sync_client.request(method, path, timeout=self._timeout(endpoint), **kwargs)
+        self._record(self._metrics(endpoint), started, response)
+        self._track_usage(response)
+        return response
+
+    # ------------------------------------------------------------------
+    # Throttling
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _is_throttled(response: httpx.Response) -> bool:
+        if response.status_code == 429:
+            return True
+        if response.status_code < 400:
+            return False
+        try:
+            code = response.json().get("error", {}).get("code")
+        except Exception:
+            return False
+        return code in THROTTLE_ERROR_CODES
+
+    def _backoff(self, attempt: int) -> float:
+        return min(self.max_retry_delay, (2 ** (attempt - 1)) + random.uniform(0, 0.5))
+
+    def _retry_delay(self, response: httpx.Response, attempt: int) -> Optional[float]:
+        """Seconds to wait before retrying, None if Meta asks for longer than max_retry_delay"""
+        wait = 0.0
+        retry_after = response.headers.get("retry-after")
+        if retry_after:
+            try:
+                wait = float(retry_after)
+            except ValueError:
+                pass
+
+        # X-Business-Use-Case-Usage: {"<id>": [{"estimated_time_to_regain_access": <minutes>, ...}]}
+        for entries in self._parse_usage(response.headers.get("x-business-use-case-usage")).values():
+            for entry in entries if isinstance(entries, list) else [entries]:
+                minutes = entry.get("estimated_time_to_regain_access") or 0
+                wait = max(wait, float(minutes) * 60)
+
+        if wait > self.max_retry_delay:
+            return None
+        return max(wait, self._backoff(attempt))
+
+    @staticmethod
+    def _parse_usage(raw: Optional[str]) -> Dict[str, Any]:
+        if not raw:
+            return {}
+        try:
+            parsed = json.loads(raw)
+            return parsed if isinstance(parsed, dict) else {}
+        except ValueError:
+            return {}
+
+    def _track_usage(self, response: httpx.Response):
+        """Remember the latest usage headers (percent of quota used)"""
+        for header in USAGE_HEADERS:
+            usage = self._parse_usage(response.headers.get(header))
+            if not usage:
+                continue
+            self.usage[header] = usage
+            peak = self._peak_percent(usage)
+            if peak >= 80:
+                logger.warning(f"⚠️  Graph API {header} at {peak}%")
+
+    @staticmethod
+    def _peak_percent(usage: Dict[str, Any]) -> float:
+        values = []
+        for value in usage.values():
+            if isinstance(value, (int, float)):
+                values.append(value)
+            elif isinstance(value, list):
+                for entry in value:
+                    values.extend(v for k, v in entry.items() if k in ("call_count", "total_time", "total_cputime"))
+            elif isinstance(value, dict):
+                values.extend(v for k, v in value.items() if k in ("call_count", "total_time", "total_cputime"))
+        return max(values) if values else 0
+
+    # ------------------------------------------------------------------
+    # Metrics / lifecycle
+    # ------------------------------------------------------------------
+
+    def _metrics(self, endpoint: str) -> Dict[str, Any]:
+        metrics = self.stats.get(endpoint)
+        if metrics is None:
+            metrics = self.stats.setdefault(endpoint, {
+                "requests": 0,
+                "errors": 0,
+                "retries": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "status": {}
+            })
+        return metrics
+
+    @staticmethod
+    def _record(metrics: Dict[str, Any], started: float, response: Optional[httpx.Response]):
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        metrics["requests"] += 1
+        metrics["total_ms"] += elapsed_ms
+        metrics["max_ms"] = max(metrics["max_ms"], elapsed_ms)
+        status = str(response.status_code) if response is not None else "network_error"
+        metrics["status"][status] = metrics["status"].get(status, 0) + 1
+        if response is None or not response.is_success:
+            metrics["errors"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Per-endpoint request / latency statistics and latest Meta usage"""
+        endpoints = {}
+        for endpoint, metrics in list(self.stats.items()):
+            requests = metrics["requests"]
+            endpoints[endpoint] = {
+                "requests": requests,
+                "errors": metrics["errors"],
+                "retries": metrics["retries"],
+                "avg_ms": round(metrics["total_ms"] / requests, 2) if requests else 0,
+                "max_ms": round(metrics["max_ms"], 2),
+                "status": dict(metrics["status"])
+            }
+        return {
+            "http2": self.http2,
+            "max_connections": self.max_connections,
+            "endpoints": endpoints,
+            "usage": {header: self._peak_percent(usage) for header, usage in self.usage.items()}
+        }
+
+    async def aclose(self):
+        """Close pooled connections (shutdown)"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        if self._sync_client is not None:
+            self._sync_client.close()
+            self._sync_client = None
+
+
+# Singleton
+_graph_client: Optional[GraphClient] = None
+_graph_client_lock = threading.Lock()
+
+def get_graph_client() -> GraphClient:
+    """Get shared Graph API client singleton"""
+    global _graph_client
+    if _graph_client is None:
+        with _graph_client_lock:
+            if _graph_client is None:
+                _graph_client = GraphClient()
+    return _graph_client
+
+
+async def close_graph_client():
+    """Close the shared client if it was created"""
+    if _graph_client is not None:
+        await _graph_client.aclose()
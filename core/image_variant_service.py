@@ -0,0 +1,198 @@
+"""
+Image Variant Service
+แปลงภาพ PNG ใน data/img เป็น JPEG (LINE รองรับแค่ JPEG) ล่วงหน้าครั้งเดียว
+
+Variants:
+- original: JPEG ขนาดเต็ม (original_content_url)
+- preview: thumbnail เล็ก (preview_image_url, LINE แนะนำ 240x240)
+
+Cache เก็บทั้งบน disk และใน memory, key ตาม path ของไฟล์ต้นฉบับ (รวมนามสกุล) + mtime + size
+แก้ไฟล์ต้นฉบับเมื่อไหร่ variant จะถูกสร้างใหม่อัตโนมัติ; promo.png กับ promo.jpg
+(หรือไฟล์ชื่อเดียวกันคนละ directory ที่ใช้ cache dir ร่วมกัน) ไม่ชนกัน
+"""
+
+import glob
+import hashlib
+import os
+import tempfile
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+VARIANT_SPECS = {
+    # variant: (max side in px or None = keep size, JPEG quality)
+    "original": (None, 85),
+    "preview": (240, 75),
+}
+
+SOURCE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+
+
+@dataclass(frozen=True)
+class ImageVariant:
+    """Pre-rendered JPEG variant ready to be served from disk"""
+    path: Path
+    etag: str
+    size: int
+    source: Path
+    source_mtime_ns: int
+    source_size: int
+
+
+class ImageVariantService:
+    """Precompute and cache JPEG variants of clinic images"""
+
+    def __init__(self, source_dir: Path = None, cache_dir: Path = None):
+        self.source_dir = Path(source_dir) if source_dir else Path(__file__).resolve().parents[1] / "data" / "img"
+        default_cache = Path(tempfile.gettempdir()) / "seoulholic_img_cache"
+        self.cache_dir = Path(cache_dir or os.getenv("IMAGE_CACHE_DIR") or default_cache)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        self._variants: Dict[Tuple[str, str], ImageVariant] = {}
+        self._lock = threading.Lock()
+        self.stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "renders": 0
+        }
+
+    def resolve_source(self, image_name: str) -> Optional[Path]:
+        """Map request name → source file (accepts name with or without .png)"""
+        # Reject anything that is not a plain file name (no path traversal)
+        if not image_name or Path(image_name).name != image_name:
+            return None
+
+        candidate = self.source_dir / image_name
+        if candidate.is_file():
+            return candidate
+        stem = Path(image_name).stem if image_name.lower().endswith(".jpg") else image_name
+        for ext in SOURCE_EXTENSIONS:
+            candidate = self.source_dir / f"{stem}{ext}"
+            if candidate.is_file():
+                return candidate
+        return None
+
+    def get_cached(self, image_name: str, variant: str = "original") -> Optional[ImageVariant]:
+        """Memory-only lookup (no disk I/O beyond a stat, no rendering)"""
+        cached = self._variants.get((image_name, variant))
+        if cached is None:
+            return None
+        try:
+            source = self.resolve_source(image_name)
+            if source != cached.source:
+                return None
+            stat = source.stat()
+            if (stat.st_mtime_ns, stat.st_size) != (cached.source_mtime_ns, cached.source_size):
+                return None
+        except OSError:
+            return None
+        self.stats["memory_hits"] += 1
+        return cached
+
+    def get_variant(self, image_name: str, variant: str = "original") -> Optional[ImageVariant]:
+        """
+        Get (or lazily render) a JPEG variant
+
+        Args:
+            image_name: File name inside data/img (e.g. 'Filler.png')
+            variant: 'original' | 'preview'
+
+        Returns:
+            ImageVariant or None if the source image does not exist
+        """
+        if variant not in VARIANT_SPECS:
+            raise ValueError(f"Unknown image variant: {variant}")
+
+        cached = self.get_cached(image_name, variant)
+        if cached:
+            return cached
+
+        source = self.resolve_source(image_name)
+        if source is None:
+            return None
+
+        with self._lock:
+            stat = source.stat()
+            prefix = self._cache_prefix(source, variant)
+            target = self.cache_dir / f"{prefix}.{stat.st_mtime_ns}-{stat.st_size}.jpg"
+
+            if target.exists():
+                self.stats["disk_hits"] += 1
+            else:
+                self._render(source, target, variant)
+                self._remove_stale(prefix, keep=target)
+                self.stats["renders"] += 1
+
+            size = target.stat().st_size
+            entry = ImageVariant(
+                path=target,
+                etag=f'"{stat.st_mtime_ns:x}-{size:x}-{variant}"',
+                size=size,
+                source=source,
+                source_mtime_ns=stat.st_mtime_ns,
+                source_size=stat.st_size
+            )
+            self._variants[(image_name, variant)] = entry
+            return entry
+
+    def precompute_all(self) -> int:
+        """Render every variant of every source image (run at startup)"""
+        if not self.source_dir.exists():
+            return 0
+
+        rendered = 0
+        for source in sorted(self.source_dir.iterdir()):
+            if source.suffix.lower() not in SOURCE_EXTENSIONS:
+                continue
+            for variant in VARIANT_SPECS:
+                try:
+                    if self.get_variant(source.name, variant):
+                        rendered += 1
+                except Exception as e:
+                    logger.warning(f"⚠️  Could not precompute {variant} for {source.name}: {e}")
+        logger.info(f"🖼️  Image variants ready: {rendered} files in {self.cache_dir}")
+        return rendered
+
+    def _render(self, source: Path, target: Path, variant: str):
+        """Convert source → JPEG variant (atomic write via temp file)"""
+        from PIL import Image
+
+        max_side, quality = VARIANT_SPECS[variant]
+        with Image.open(source) as img:
+            img = img.convert("RGB")
+            if max_side:
+                img.thumbnail((max_side, max_side), Image.LANCZOS)
+            tmp_path = target.with_suffix(".tmp")
+            img.save(tmp_path, format="JPEG", quality=quality, optimize=True, progressive=True)
+        os.replace(tmp_path, target)
+
+    @staticmethod
+    def _cache_prefix(source: Path, variant: str) -> str:
+        """Cache file prefix unique per source file (name with extension + path digest)"""
+        digest = hashlib.sha1(str(source.resolve()).encode("utf-8")).hexdigest()[:12]
+        return f"{source.name}.{digest}.{variant}"
+
+    def _remove_stale(self, prefix: str, keep: Path):
+        """Delete variants rendered from older versions of the same source"""
+        for old in self.cache_dir.glob(f"{glob.escape(prefix)}.*.jpg"):
+            if old != keep:
+                try:
+                    old.unlink()
+                except OSError:
+                    pass
+
+
+# Singleton
+_image_variant_service = None
+
+def get_image_variant_service() -> ImageVariantService:
+    """Get Image Variant Service singleton"""
+    global _image_variant_service
+    if _image_variant_service is None:
+        _image_variant_service = ImageVariantService()
+    return _image_variant_service
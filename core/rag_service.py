@@ -218,9 +218,22 @@ class SeoulholicRAG:
         self.index.insert(doc)
         logger.info(f" Added new document: {metadata.get('source', 'unknown')}")
     
+    def remove_post(self, post_id: str) -> bool:
+        """ลบ node ทั้งหมดของโพสต์นี้ออกจาก vector DB (ก่อนใส่เวอร์ชันที่แก้ไขแล้ว)"""
+        if not post_id:
+            return False
+        try:
+            self.collection.delete(where={"post_id": post_id})
+            return True
+        except Exception as e:
+            logger.error(f" Error removing post {post_id}: {e}")
+            return False
+    
     def update_from_facebook(self, posts: List[Dict]):
-        """อัปเดต RAG จาก Facebook posts ใหม่"""
+        """อัปเดต RAG จาก Facebook posts ใหม่/ที่ถูกแก้ไข (แทนที่เวอร์ชันเดิมของโพสต์นั้น)"""
         for post in posts:
+            # An edited post must not stay retrievable next to its new version
+            self.remove_post(post.get('id'))
             message = post.get('message', '')
             if message:
                 self.add_document(
@@ -5,8 +5,11 @@ Vision Service สำหรับ Seoulholic Clinic
 """
 
 import os
+import io
 import base64
+import hashlib
 import json
+import time
 from pathlib import Path
 from typing import Dict, List, Optional, Union
 import logging
@@ -26,6 +29,31 @@ class VisionService:
         self.client = OpenAI(api_key=api_key, base_url=base_url)
         self.model = os.getenv("TYPHOON_MODEL", "typhoon-v2.5-30b-a3b-instruct")
         
+        # Image preparation: ลดขนาดภาพให้เท่ากับความละเอียดที่โมเดลใช้จริง
+        self.max_image_side = int(os.getenv("VISION_MAX_SIDE", 1024))
+        self.jpeg_quality = int(os.getenv("VISION_JPEG_QUALITY", 85))
+        
+        # Analysis cache keyed by image key (ภาพเดิมที่ถูก forward ซ้ำ ไม่ต้องวิเคราะห์ใหม่)
+        # image key = dHash 64-bit (จับภาพใกล้เคียงได้) หรือ exact-content key ("sha256-..." / "url-...")
+        self.analysis_cache = {}  # {cache_key: {"result": dict, "image_key": str, "timestamp": float}}
+        self.cache_ttl = int(os.getenv("VISION_CACHE_TTL", 86400))  # 24 hours
+        self.cache_max_entries = 500
+        self.phash_max_distance = int(os.getenv("VISION_PHASH_DISTANCE", 4))
+        # Near-match (Hamming distance) only for these kinds: skin photos of two customers
+        # can be close in dHash, so a skin analysis is reused only for the exact same image
+        self.near_match_kinds = {"promotion"}
+        
+        self.stats = {
+            "images_prepared": 0,
+            "bytes_before": 0,
+            "bytes_after": 0,
+            "image_tokens_saved": 0,
+            "cache_hits": 0,
+            "cache_misses": 0,
+            "cost_usd": 0.0,
+            "cost_saved_usd": 0.0
+        }
+        
         logger.info(f"Vision Service initialized with Typhoon model: {self.model}")
     
     def encode_image_to_base64(self, image_path: str) -> str:
@@ -41,11 +69,184 @@ class VisionService:
         with open(image_path, 'rb') as image_file:
             return base64.b64encode(image_file.read()).decode('utf-8')
     
+    def prepare_image(self, image_path: str = None, image_bytes: bytes = None) -> Dict:
+        """
+        เตรียมภาพก่อนส่งเข้าโมเดล: ย่อขนาด, re-encode เป็น JPEG และตัด metadata (EXIF/GPS)
+        
+        Args:
+            image_path: Path ของภาพ local
+            image_bytes: หรือ raw bytes ของภาพ (เช่น content จาก LINE)
+        
+        Returns:
+            Dict with base64, image_key, content_key, byte sizes and estimated image tokens before/after
+            (image_key เป็น dHash เมื่อมี Pillow, ไม่มี Pillow เท่ากับ content_key "sha256-...")
+        """
+        if image_bytes is None:
+            with open(image_path, 'rb') as image_file:
+                image_bytes = image_file.read()
+        content_key = "sha256-" + hashlib.sha256(image_bytes).hexdigest()
+        
+        try:
+            from PIL import Image, ImageOps
+        except ImportError:
+            # Pillow ไม่ได้ติดตั้ง: ส่งภาพต้นฉบับ, cache hit ได้เฉพาะภาพที่ bytes ตรงกันทุกไบต์
+            return {
+                "base64": base64.b64encode(image_bytes).decode('utf-8'),
+                "image_key": content_key,
+                "content_key": content_key,
+                "bytes_before": len(image_bytes),
+                "bytes_after": len(image_bytes),
+                "tokens_before": 0,
+                "tokens_after": 0
+            }
+        
+        img = Image.open(io.BytesIO(image_bytes))
+        img = ImageOps.exif_transpose(img)  # Apply orientation before EXIF is dropped
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        
+        size_before = img.size
+        phash = self._perceptual_hash(img)
+        img.thumbnail((self.max_image_side, self.max_image_side), Image.LANCZOS)
+        
+        # Saving a fresh JPEG without exif= drops all metadata
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=self.jpeg_quality, optimize=True)
+        prepared = buf.getvalue()
+        
+        return {
+            "base64": base64.b64encode(prepared).decode('utf-8'),
+            "image_key": phash,
+            "content_key": content_key,
+            "bytes_before": len(image_bytes),
+            "bytes_after": len(prepared),
+            "tokens_before": self._estimate_image_tokens(*size_before),
+            "tokens_after": self._estimate_image_tokens(*img.size)
+        }
+    
+    def _perceptual_hash(self, img) -> str:
+        """
+        dHash 64-bit: ภาพเดียวกันที่ถูกย่อ/บีบอัดใหม่ (เช่น forward ผ่าน LINE) ได้ hash ใกล้เคียงกัน
+        """
+        from PIL import Image
+        
+        gray = img.convert("L").resize((9, 8), Image.LANCZOS)
+        pixels = gray.tobytes()
+        bits = 0
+        for row in range(8):
+            for col in range(8):
+                left = pixels[row * 9 + col]
+                right = pixels[row * 9 + col + 1]
+                bits = (bits << 1) | (1 if left > right else 0)
+        return f"{bits:016x}"
+    
+    def _estimate_image_tokens(self, width: int, height: int) -> int:
+        """
+        ประมาณ image tokens แบบ high-detail (tile 512px): 85 + 170 * tiles
+        ภาพถูก fit ใน 2048x2048 แล้วย่อด้านสั้นเหลือ 768px ก่อนตัด tile
+        """
+        if not width or not height:
+            return 0
+        scale = min(1.0, 2048 / max(width, height))
+        width, height = width * scale, height * scale
+        scale = min(1.0, 768 / min(width, height))
+        width, height = width * scale, height * scale
+        tiles = -(-int(width) // 512) * -(-int(height) // 512)
+        return 85 + 170 * tiles
+    
+    def _is_perceptual_hash(self, image_key: str) -> bool:
+        """dHash เป็น hex 16 ตัว; exact-content key มี prefix ("sha256-" / "url-")"""
+        return len(image_key) == 16 and "-" not in image_key
+    
+    def _get_analysis_cache_key(self, kind: str, image_key: str, question: str = "") -> str:
+        """Cache key: ประเภทการวิเคราะห์ + คำถาม + image key"""
+        question_hash = hashlib.md5(question.lower().strip().encode('utf-8')).hexdigest()[:12]
+        return f"{kind}:{question_hash}:{image_key}"
+    
+    def _get_cached_analysis(self, kind: str, image_key: str, question: str = "") -> Optional[Dict]:
+        """หา analysis เดิมจาก key ตรงกัน หรือ dHash ใกล้เคียง (Hamming distance, เฉพาะ near_match_kinds)"""
+        now = time.time()
+        key = self._get_analysis_cache_key(kind, image_key, question)
+        entry = self.analysis_cache.get(key)
+        
+        if (
+            entry is None
+            and kind in self.near_match_kinds
+            and self.phash_max_distance > 0
+            and self._is_perceptual_hash(image_key)
+        ):
+            prefix = key[: -len(image_key)]
+            target = int(image_key, 16)
+            for cached_key, cached in self.analysis_cache.items():
+                if not cached_key.startswith(prefix) or not self._is_perceptual_hash(cached["image_key"]):
+                    continue
+                if bin(target ^ int(cached["image_key"], 16)).count("1") <= self.phash_max_distance:
+                    key, entry = cached_key, cached
+                    break
+        
+        if entry is not None:
+            if now - entry["timestamp"] < self.cache_ttl:
+                self.stats["cache_hits"] += 1
+                return entry["result"]
+            del self.analysis_cache[key]
+        
+        self.stats["cache_misses"] += 1
+        return None
+    
+    def _set_cached_analysis(self, kind: str, image_key: str, result: Dict, question: str = ""):
+        """เก็บผลวิเคราะห์ที่สำเร็จ (จำกัด cache_max_entries รายการ)"""
+        key = self._get_analysis_cache_key(kind, image_key, question)
+        self.analysis_cache[key] = {
+            "result": result,
+            "image_key": image_key,
+            "timestamp": time.time()
+        }
+        if len(self.analysis_cache) > self.cache_max_entries:
+            # Remove oldest 10%
+            oldest = sorted(self.analysis_cache, key=lambda k: self.analysis_cache[k]["timestamp"])
+            for old_key in oldest[: max(1, self.cache_max_entries // 10)]:
+                del self.analysis_cache[old_key]
+    
+    def _prepare_image_content(
+        self,
+        image_url: str = None,
+        image_path: str = None,
+        image_bytes: bytes = None,
+        exact_key: bool = False
+    ):
+        """
+        สร้าง image content สำหรับ chat.completions + cache identity
+        
+        Args:
+            exact_key: ใช้ exact-content key แทน dHash (ภาพส่วนตัวของลูกค้า เช่น ภาพผิว)
+        
+        Returns:
+            Tuple of (image_content, image_key, prep) หรือ (None, None, None) ถ้าไม่มีภาพ
+        """
+        if image_path or image_bytes:
+            prep = self.prepare_image(image_path=image_path, image_bytes=image_bytes)
+            image_content = {
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:image/jpeg;base64,{prep['base64']}"
+                }
+            }
+            return image_content, prep["content_key" if exact_key else "image_key"], prep
+        if image_url:
+            # Remote URL: โมเดลดึงภาพเอง ใช้ URL เป็น identity ของ cache
+            image_content = {
+                "type": "image_url",
+                "image_url": {"url": image_url}
+            }
+            return image_content, "url-" + hashlib.md5(image_url.encode('utf-8')).hexdigest(), None
+        return None, None, None
+    
     def analyze_skin_image(
         self, 
         image_url: str = None,
         image_path: str = None,
-        customer_question: str = "วิเคราะห์ภาพผิวนี้ให้หน่อยค่ะ"
+        customer_question: str = "วิเคราะห์ภาพผิวนี้ให้หน่อยค่ะ",
+        image_bytes: bytes = None
     ) -> Dict:
         """
         วิเคราะห์ภาพผิวจากลูกค้า
@@ -54,31 +255,31 @@ class VisionService:
             image_url: URL ของภาพ (จาก LINE)
             image_path: หรือ path ของภาพ local
             customer_question: คำถามจากลูกค้า
+            image_bytes: หรือ raw bytes ของภาพ
         
         Returns:
             Dict with analysis and recommendations
         """
         try:
-            # Prepare image content
-            if image_path:
-                base64_image = self.encode_image_to_base64(image_path)
-                image_content = {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/jpeg;base64,{base64_image}"
-                    }
-                }
-            elif image_url:
-                image_content = {
-                    "type": "image_url",
-                    "image_url": {"url": image_url}
-                }
-            else:
+            # Prepare image content (resize + strip metadata); a customer's photo is only
+            # ever matched to the exact same bytes, never to a look-alike photo
+            image_content, image_key, prep = self._prepare_image_content(
+                image_url, image_path, image_bytes, exact_key=True
+            )
+            if image_content is None:
                 return {
                     "error": "ต้องระบุ image_url หรือ image_path",
                     "success": False
                 }
             
+            cached = self._get_cached_analysis("skin", image_key, customer_question)
+            if cached:
+                return {
+                    **cached,
+                    "cache_hit": True,
+                    "total_cost_usd": self._calculate_cost(None, cached_cost=cached.get("total_cost_usd", 0.0))
+                }
+            
             # Call GPT-4o Vision
             response = self.client.chat.completions.create(
                 model=self.model,
@@ -116,14 +317,16 @@ class VisionService:
             
             analysis = response.choices[0].message.content
             
-            return {
+            result = {
                 "success": True,
                 "analysis": analysis,
                 "model_used": self.model,
                 "prompt_tokens": response.usage.prompt_tokens,
                 "completion_tokens": response.usage.completion_tokens,
-                "total_cost_usd": self._calculate_cost(response.usage)
+                "total_cost_usd": self._calculate_cost(response.usage, prep=prep)
             }
+            self._set_cached_analysis("skin", image_key, result, customer_question)
+            return {**result, "cache_hit": False}
             
         except Exception as e:
             logger.error(f" Vision analysis error: {e}")
@@ -218,7 +421,8 @@ class VisionService:
     def analyze_promotion_image(
         self,
         image_url: str = None,
-        image_path: str = None
+        image_path: str = None,
+        image_bytes: bytes = None
     ) -> Dict:
         """
         วิเคราะห์ภาพโปรโมชั่น (ดึงข้อมูลราคา, บริการ, เงื่อนไข)
@@ -226,28 +430,26 @@ class VisionService:
         Args:
             image_url: URL ของภาพโปรโมชั่น
             image_path: Path ของภาพโปรโมชั่น
+            image_bytes: หรือ raw bytes ของภาพโปรโมชั่น
         
         Returns:
             Dict with promotion details
         """
         try:
-            # Prepare image
-            if image_path:
-                base64_image = self.encode_image_to_base64(image_path)
-                image_content = {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/jpeg;base64,{base64_image}"
-                    }
-                }
-            elif image_url:
-                image_content = {
-                    "type": "image_url",
-                    "image_url": {"url": image_url}
-                }
-            else:
+            # Prepare image (resize + strip metadata)
+            image_content, image_key, prep = self._prepare_image_content(image_url, image_path, image_bytes)
+            if image_content is None:
                 return {"error": "ต้องระบุ image_url หรือ image_path"}
             
+            # ภาพโปรเดิมที่ถูก forward ซ้ำ → ใช้ผลเดิม
+            cached = self._get_cached_analysis("promotion", image_key)
+            if cached:
+                return {
+                    **cached,
+                    "cache_hit": True,
+                    "total_cost_usd": self._calculate_cost(None, cached_cost=cached.get("total_cost_usd", 0.0))
+                }
+            
             # Call GPT-4o Vision with OCR focus
             response = self.client.chat.completions.create(
                 model=self.model,
@@ -296,11 +498,14 @@ class VisionService:
             else:
                 promo_data = {"raw_text": content}
             
-            return {
+            result = {
                 "success": True,
                 "promotion": promo_data,
-                "model_used": self.model
+                "model_used": self.model,
+                "total_cost_usd": self._calculate_cost(response.usage, prep=prep)
             }
+            self._set_cached_analysis("promotion", image_key, result)
+            return {**result, "cache_hit": False}
             
         except Exception as e:
             logger.error(f" Promotion image analysis error: {e}")
@@ -309,22 +514,58 @@ class VisionService:
                 "error": str(e)
             }
     
-    def _calculate_cost(self, usage) -> float:
+    def _calculate_cost(self, usage, prep: Dict = None, cached_cost: float = 0.0) -> float:
         """
-        คำนวณต้นทุน GPT-4o Vision
+        คำนวณต้นทุน GPT-4o Vision และบันทึกสิ่งที่ประหยัดได้ลง self.stats
         
         Pricing (as of 2024):
         - gpt-4o: $2.50/1M input tokens, $10/1M output tokens
         - gpt-4o-mini: $0.15/1M input tokens, $0.60/1M output tokens
+        
+        Args:
+            usage: response.usage (None = cache hit, ไม่มีการเรียก API)
+            prep: ผลจาก prepare_image (bytes/tokens ก่อน-หลังย่อภาพ)
+            cached_cost: ต้นทุนของ analysis เดิมที่ cache hit ประหยัดไปได้
         """
         if self.model == "gpt-4o":
-            input_cost = (usage.prompt_tokens / 1_000_000) * 2.50
-            output_cost = (usage.completion_tokens / 1_000_000) * 10.00
+            input_price, output_price = 2.50, 10.00
         else:  # gpt-4o-mini
-            input_cost = (usage.prompt_tokens / 1_000_000) * 0.15
-            output_cost = (usage.completion_tokens / 1_000_000) * 0.60
+            input_price, output_price = 0.15, 0.60
         
-        return round(input_cost + output_cost, 6)
+        if usage is None:
+            self.stats["cost_saved_usd"] += cached_cost
+            return 0.0
+        
+        input_cost = (usage.prompt_tokens / 1_000_000) * input_price
+        output_cost = (usage.completion_tokens / 1_000_000) * output_price
+        
+        if prep:
+            tokens_saved = max(0, prep["tokens_before"] - prep["tokens_after"])
+            self.stats["images_prepared"] += 1
+            self.stats["bytes_before"] += prep["bytes_before"]
+            self.stats["bytes_after"] += prep["bytes_after"]
+            self.stats["image_tokens_saved"] += tokens_saved
+            self.stats["cost_saved_usd"] += (tokens_saved / 1_000_000) * input_price
+        
+        total = round(input_cost + output_cost, 6)
+        self.stats["cost_usd"] += total
+        return total
+    
+    def get_stats(self) -> Dict:
+        """ดูสถิติ image preparation + analysis cache"""
+        total_lookups = self.stats["cache_hits"] + self.stats["cache_misses"]
+        hit_rate = (self.stats["cache_hits"] / total_lookups * 100) if total_lookups > 0 else 0
+        return {
+            "images_prepared": self.stats["images_prepared"],
+            "bytes_saved": self.stats["bytes_before"] - self.stats["bytes_after"],
+            "image_tokens_saved": self.stats["image_tokens_saved"],
+            "cache_size": len(self.analysis_cache),
+            "cache_hits": self.stats["cache_hits"],
+            "cache_misses": self.stats["cache_misses"],
+            "hit_rate_percent": round(hit_rate, 2),
+            "cost_usd": round(self.stats["cost_usd"], 6),
+            "cost_saved_usd": round(self.stats["cost_saved_usd"], 6)
+        }
 
 
 # Singleton
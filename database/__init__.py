@@ -5,6 +5,7 @@ Database Package
 from .models import (
     Base,
     User,
+    UserTag,
     Conversation,
     Message,
     FacebookComment,
@@ -12,12 +13,14 @@ from .models import (
     BroadcastLog,
     AdminUser,
     SystemLog,
-    AutoReplyTemplate
+    AutoReplyTemplate,
+    StatCounter
 )
 
 __all__ = [
     'Base',
     'User',
+    'UserTag',
     'Conversation',
     'Message',
     'FacebookComment',
@@ -25,5 +28,6 @@ __all__ = [
     'BroadcastLog',
     'AdminUser',
     'SystemLog',
-    'AutoReplyTemplate'
+    'AutoReplyTemplate',
+    'StatCounter'
 ]
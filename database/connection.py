@@ -3,9 +3,10 @@ Database Connection Manager
 """
 
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker, scoped_session
-from sqlalchemy.pool import NullPool
+from sqlalchemy.pool import QueuePool, StaticPool
 from contextlib import contextmanager
 import logging
 
@@ -14,6 +15,76 @@ from .models import Base
 logger = logging.getLogger(__name__)
 
 
+def _sqlite_pragmas() -> dict:
+    """SQLite performance profile (overridable via env)"""
+    return {
+        # WAL: readers don't block the writer and vice versa
+        "journal_mode": "WAL" if os.getenv('SQLITE_WAL', 'true').lower() == 'true' else "DELETE",
+        # NORMAL is durable in WAL mode except for the last commits on power loss
+        "synchronous": os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        # Negative = KiB
+        "cache_size": -int(os.getenv('SQLITE_CACHE_SIZE_KB', 65536)),
+        "mmap_size": int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+        "busy_timeout": int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+        "temp_store": "MEMORY",
+    }
+
+
+def create_database_engine(db_url: str) -> Engine:
+    """
+    Create the SQLAlchemy engine for a database URL
+    
+    SQLite URLs get the performance profile: pragmas applied on every new
+    connection and a QueuePool (one connection per thread at a time; the
+    scoped session already keeps a connection on one thread while in use).
+    In-memory SQLite shares one connection (StaticPool) so all sessions see the same data.
+    """
+    if not db_url.startswith('sqlite'):
+        return create_engine(
+            db_url,
+            echo=False,  # Set to True for SQL logging
+            pool_pre_ping=True,  # Verify connections before using
+            pool_recycle=3600  # Recycle connections after 1 hour
+        )
+    
+    in_memory = db_url in ('sqlite://', 'sqlite:///:memory:') or 'mode=memory' in db_url
+    pragmas = _sqlite_pragmas()
+    busy_timeout = pragmas["busy_timeout"]
+    
+    if in_memory:
+        engine = create_engine(
+            db_url,
+            echo=False,
+            poolclass=StaticPool,
+            connect_args={"check_same_thread": False}
+        )
+    else:
+        engine = create_engine(
+            db_url,
+            echo=False,
+            poolclass=QueuePool,
+            pool_size=int(os.getenv('SQLITE_POOL_SIZE', 5)),
+            max_overflow=int(os.getenv('SQLITE_POOL_OVERFLOW', 10)),
+            pool_timeout=30,
+            pool_pre_ping=True,
+            # Pooled connections move between threads (never used by two at once)
+            connect_args={"check_same_thread": False, "timeout": busy_timeout / 1000}
+        )
+    
+    @event.listens_for(engine, "connect")
+    def _apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                if in_memory and name in ("journal_mode", "mmap_size"):
+                    continue
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+    
+    return engine
+
+
 class DatabaseManager:
     """Singleton Database Manager"""
     _instance = None
@@ -35,14 +106,8 @@ class DatabaseManager:
             logger.warning("DATABASE_URL not set, using SQLite fallback")
             db_url = 'sqlite:///./seoulholic.db'
         
-        # Create engine
-        self._engine = create_engine(
-            db_url,
-            poolclass=NullPool if 'sqlite' in db_url else None,
-            echo=False,  # Set to True for SQL logging
-            pool_pre_ping=True,  # Verify connections before using
-            pool_recycle=3600  # Recycle connections after 1 hour
-        )
+        # Create engine (SQLite gets WAL + pragmas + a real pool)
+        self._engine = create_database_engine(db_url)
         
         # Create session factory
         self._session_factory = scoped_session(
@@ -3,26 +3,56 @@ Database CRUD Operations
 Handles all database queries for the multi-platform system
 """
 
+import base64
 import logging
-from typing import Optional, List, Dict, Any
+import os
+import time
+from typing import Optional, List, Dict, Any, Tuple, Iterator
 from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_, or_, desc
+from sqlalchemy import func, and_, or_, desc, insert, select, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
 from database.models import (
-    User, Conversation, Message, FacebookComment, 
+    User, UserTag, Conversation, Message, FacebookComment, 
     Promotion, BroadcastLog, AdminUser, SystemLog, AutoReplyTemplate
 )
 from database.connection import DatabaseManager
+from database.stats_rollup import StatsRollup
 
 logger = logging.getLogger(__name__)
 
 
+def _normalize_tags(tags) -> List[str]:
+    """Tag values as stored in user_tags (stripped, lower-case, unique)"""
+    return sorted({str(tag).strip().lower() for tag in tags or [] if tag and str(tag).strip()})
+
+
+def _encode_conversation_cursor(started_at: datetime, conversation_id: int) -> str:
+    """Opaque keyset cursor for (started_at, id)"""
+    raw = f"{started_at.isoformat()}|{conversation_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_conversation_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        started_at, conversation_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(started_at), int(conversation_id)
+    except Exception:
+        raise ValueError("Invalid conversation cursor")
+
+
 class CRUDManager:
     """Handles all database CRUD operations"""
     
     def __init__(self, db_manager: DatabaseManager):
         self.db_manager = db_manager
+        self.stats_rollup = StatsRollup(db_manager)
+        # (user_id, platform, status) -> (count, cached_at) for the admin inbox total
+        self._conversation_counts: Dict[Any, Any] = {}
+        self.conversation_count_ttl = float(os.getenv('CONVERSATION_COUNT_TTL', 30))
     
     # ==================== USER OPERATIONS ====================
     
@@ -79,6 +109,51 @@ class CRUDManager:
             logger.error(f"❌ Error in get_or_create_user: {e}")
             return None
     
+    def get_user_profile_fields(self, platform: str, platform_user_id: str) -> Optional[Dict[str, Any]]:
+        """Stored display name / picture for a platform user (None if unknown)"""
+        try:
+            with self.db_manager.get_session() as session:
+                row = session.query(User.display_name, User.profile_pic_url).filter(
+                    and_(
+                        User.platform == platform,
+                        User.platform_user_id == platform_user_id
+                    )
+                ).first()
+                if not row or not row.display_name:
+                    return None
+                return {"display_name": row.display_name, "profile_pic": row.profile_pic_url}
+        except Exception as e:
+            logger.error(f"❌ Error getting user profile: {e}")
+            return None
+
+    def update_user_profile(
+        self,
+        platform: str,
+        platform_user_id: str,
+        display_name: str = None,
+        profile_pic_url: str = None
+    ) -> bool:
+        """Overwrite stored profile fields with fresh values from the platform"""
+        try:
+            with self.db_manager.get_session() as session:
+                user = session.query(User).filter(
+                    and_(
+                        User.platform == platform,
+                        User.platform_user_id == platform_user_id
+                    )
+                ).first()
+                if not user:
+                    return False
+                if display_name and user.display_name != display_name:
+                    user.display_name = display_name
+                if profile_pic_url and user.profile_pic_url != profile_pic_url:
+                    user.profile_pic_url = profile_pic_url
+                session.commit()
+                return True
+        except Exception as e:
+            logger.error(f"❌ Error updating user profile: {e}")
+            return False
+
     def get_user_by_id(self, user_id: int) -> Optional[User]:
         """Get user by database ID"""
         try:
@@ -92,12 +167,14 @@ class CRUDManager:
             return None
     
     def update_user_tags(self, user_id: int, tags: List[str]) -> bool:
-        """Update user tags"""
+        """Update user tags (User.tags for display + user_tags index rows)"""
         try:
             with self.db_manager.get_session() as session:
                 user = session.query(User).filter(User.id == user_id).first()
                 if user:
                     user.tags = tags
+                    session.query(UserTag).filter(UserTag.user_id == user_id).delete(synchronize_session=False)
+                    session.add_all(UserTag(user_id=user_id, tag=tag) for tag in _normalize_tags(tags))
                     session.commit()
                     return True
                 return False
@@ -105,6 +182,38 @@ class CRUDManager:
             logger.error(f"❌ Error updating tags: {e}")
             return False
     
+    def backfill_user_tags(self, chunk_size: int = 1000) -> int:
+        """
+        Populate user_tags from User.tags when the index table is still empty
+        (databases created before user_tags existed)
+        
+        Returns:
+            Number of tag rows written
+        """
+        written = 0
+        try:
+            with self.db_manager.get_session() as session:
+                if session.query(UserTag.user_id).first() is not None:
+                    return 0
+                result = session.execute(
+                    select(User.id, User.tags).execution_options(yield_per=chunk_size)
+                )
+                for rows in result.partitions():
+                    tag_rows = [
+                        {"user_id": user_id, "tag": tag}
+                        for user_id, tags in rows
+                        for tag in _normalize_tags(tags)
+                    ]
+                    if tag_rows:
+                        session.execute(insert(UserTag), tag_rows)
+                        written += len(tag_rows)
+            if written:
+                logger.info(f"🏷️  Backfilled {written} user tag row(s)")
+            return written
+        except Exception as e:
+            logger.error(f"❌ Error backfilling user tags: {e}")
+            return 0
+    
     def get_all_users(
         self, 
         platform: Optional[str] = None,
@@ -189,6 +298,45 @@ class CRUDManager:
             logger.error(f"❌ Error getting history: {e}")
             return []
 
+    def get_recent_messages_for_user(
+        self,
+        platform: str,
+        platform_user_id: str,
+        limit: int = 20
+    ) -> List[Dict[str, Any]]:
+        """
+        Last N messages of the user's active conversation, oldest first
+        (single query: users → conversations subquery → messages, all indexed)
+        Used to rehydrate chat sessions after a restart
+        """
+        try:
+            with self.db_manager.get_session() as session:
+                active_conversation = session.query(Conversation.id).join(
+                    User, User.id == Conversation.user_id
+                ).filter(
+                    and_(
+                        User.platform == platform,
+                        User.platform_user_id == platform_user_id,
+                        Conversation.status == 'active'
+                    )
+                ).order_by(desc(Conversation.started_at)).limit(1).scalar_subquery()
+
+                rows = session.query(
+                    Message.role, Message.content, Message.created_at
+                ).filter(
+                    Message.conversation_id == active_conversation
+                ).order_by(
+                    desc(Message.created_at), desc(Message.id)
+                ).limit(limit).all()
+
+                return [
+                    {"role": row.role, "content": row.content, "created_at": row.created_at}
+                    for row in reversed(rows)
+                ]
+        except Exception as e:
+            logger.error(f"❌ Error getting recent messages: {e}")
+            return []
+
     def get_conversations(
         self,
         user_id: Optional[int] = None,
@@ -217,6 +365,107 @@ class CRUDManager:
             logger.error(f"❌ Error getting conversations: {e}")
             return []
     
+    def list_conversations(
+        self,
+        user_id: Optional[int] = None,
+        platform: Optional[str] = None,
+        status: Optional[str] = None,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        offset: int = 0
+    ) -> Dict[str, Any]:
+        """
+        Admin inbox page: conversations joined with their user in one query,
+        newest first, keyset-paginated on (started_at, id)
+        
+        Args:
+            user_id / platform / status: Optional filters
+            limit: Page size
+            cursor: next_cursor of the previous page (takes precedence over offset)
+            offset: Legacy OFFSET pagination when no cursor is given
+            
+        Returns:
+            {"items": [...], "next_cursor": str | None}
+            
+        Raises:
+            ValueError: Malformed cursor
+        """
+        keyset = _decode_conversation_cursor(cursor) if cursor else None
+        try:
+            with self.db_manager.get_session() as session:
+                query = session.query(
+                    Conversation.id, Conversation.user_id, Conversation.platform, Conversation.status,
+                    Conversation.started_at, Conversation.ended_at, Conversation.messages_count,
+                    Conversation.intent, Conversation.priority, Conversation.handled_by,
+                    User.display_name, User.platform_user_id, User.profile_pic_url
+                ).outerjoin(User, User.id == Conversation.user_id)
+                query = self._filter_conversations(query, user_id, platform, status)
+                
+                if keyset:
+                    started_at, conversation_id = keyset
+                    query = query.filter(or_(
+                        Conversation.started_at < started_at,
+                        and_(Conversation.started_at == started_at, Conversation.id < conversation_id)
+                    ))
+                elif offset:
+                    query = query.offset(offset)
+                
+                # One extra row tells whether there is a next page
+                rows = query.order_by(
+                    desc(Conversation.started_at), desc(Conversation.id)
+                ).limit(limit + 1).all()
+                
+                has_more = len(rows) > limit
+                rows = rows[:limit]
+                next_cursor = None
+                if has_more and rows and rows[-1].started_at is not None:
+                    next_cursor = _encode_conversation_cursor(rows[-1].started_at, rows[-1].id)
+                return {"items": [row._asdict() for row in rows], "next_cursor": next_cursor}
+        except Exception as e:
+            logger.error(f"❌ Error listing conversations: {e}")
+            return {"items": [], "next_cursor": None}
+    
+    def count_conversations(
+        self,
+        user_id: Optional[int] = None,
+        platform: Optional[str] = None,
+        status: Optional[str] = None
+    ) -> int:
+        """
+        Total conversations for the given filters
+        (unfiltered: stats rollup counter; filtered: COUNT cached for CONVERSATION_COUNT_TTL)
+        """
+        if user_id is None and not platform and not status:
+            total = self.get_stats().get("total_conversations")
+            if total is not None:
+                return total
+        
+        key = (user_id, platform, status)
+        cached = self._conversation_counts.get(key)
+        if cached and time.monotonic() - cached[1] < self.conversation_count_ttl:
+            return cached[0]
+        try:
+            with self.db_manager.get_session() as session:
+                query = self._filter_conversations(session.query(func.count(Conversation.id)), user_id, platform, status)
+                total = query.scalar() or 0
+        except Exception as e:
+            logger.error(f"❌ Error counting conversations: {e}")
+            return cached[0] if cached else 0
+        if len(self._conversation_counts) > 1000:
+            self._conversation_counts.clear()
+        self._conversation_counts[key] = (total, time.monotonic())
+        return total
+    
+    @staticmethod
+    def _filter_conversations(query, user_id: Optional[int], platform: Optional[str], status: Optional[str]):
+        if user_id:
+            query = query.filter(Conversation.user_id == user_id)
+        if platform:
+            query = query.filter(Conversation.platform == platform)
+        if status:
+            query = query.filter(Conversation.status == status)
+        return query
+    
     # ==================== MESSAGE OPERATIONS ====================
     
     def save_message(
@@ -256,6 +505,193 @@ class CRUDManager:
             logger.error(f"❌ Error saving message: {e}")
             return None
     
+    def record_turn(
+        self,
+        platform: str,
+        user_key: str,
+        user_msg: Optional[str],
+        bot_msg: Optional[str],
+        metadata: Dict[str, Any] = None,
+        display_name: str = None,
+        profile_pic_url: str = None
+    ) -> Optional[Dict[str, int]]:
+        """
+        Record one chat turn (user message + bot reply) in a single transaction
+        
+        Upserts the user, finds-or-creates the active conversation, inserts both
+        messages and bumps messages_count / total_messages / last_interaction.
+        On SQLite / PostgreSQL this is 3 statements (4 for a new conversation)
+        instead of ~16 separate sessions via get_or_create_user + save_message.
+        
+        Chat handlers persist through the write-behind MessageWriter, which
+        writes each sender's messages with the same write_turn() inside its
+        batch transaction; use this method when the ids are needed right away.
+        
+        Args:
+            platform: 'line' | 'facebook' | 'instagram'
+            user_key: Platform user ID
+            user_msg: User's message (None to skip)
+            bot_msg: Bot's reply (None to skip)
+            metadata: Stored on the bot message (latency, model, cache_hit, ...)
+            display_name: Profile name (only fills an empty stored value)
+            profile_pic_url: Profile picture (only fills an empty stored value)
+            
+        Returns:
+            {"user_id", "conversation_id", "messages"} or None on error
+        """
+        now = datetime.utcnow()
+        messages = [
+            {"role": role, "content": content, "created_at": now, "message_metadata": meta}
+            for role, content, meta in (("user", user_msg, {}), ("assistant", bot_msg, metadata or {}))
+            if content
+        ]
+        try:
+            with self.db_manager.get_session() as session:
+                return self.write_turn(session, platform, user_key, messages, display_name, profile_pic_url, now)
+        except Exception as e:
+            logger.error(f"❌ Error recording turn: {e}")
+            return None
+    
+    def write_turn(
+        self,
+        session: Session,
+        platform: str,
+        user_key: str,
+        messages: List[Dict[str, Any]],
+        display_name: str = None,
+        profile_pic_url: str = None,
+        now: datetime = None
+    ) -> Dict[str, int]:
+        """
+        Persist one user's messages inside the caller's transaction
+        (shared by record_turn and the write-behind MessageWriter, so both
+        maintain users / conversations counters the same way)
+        
+        Args:
+            messages: Rows for the messages table (role, content, created_at, message_metadata)
+            
+        Returns:
+            {"user_id", "conversation_id", "messages"}
+        """
+        now = now or datetime.utcnow()
+        count = len(messages)
+        user_id = self._upsert_turn_user(session, platform, user_key, display_name, profile_pic_url, count, now)
+        conversation_id = self._bump_active_conversation(session, user_id, platform, count, now)
+        if messages:
+            session.execute(insert(Message), [{"conversation_id": conversation_id, **row} for row in messages])
+        return {"user_id": user_id, "conversation_id": conversation_id, "messages": count}
+    
+    def _upsert_turn_user(
+        self,
+        session: Session,
+        platform: str,
+        platform_user_id: str,
+        display_name: Optional[str],
+        profile_pic_url: Optional[str],
+        count: int,
+        now: datetime
+    ) -> int:
+        """Insert-or-update the user in one statement where the dialect supports it"""
+        dialect_insert = {
+            "sqlite": sqlite_insert,
+            "postgresql": postgresql_insert
+        }.get(session.get_bind().dialect.name)
+        
+        if dialect_insert is not None:
+            stmt = dialect_insert(User).values(
+                platform=platform,
+                platform_user_id=platform_user_id,
+                display_name=display_name,
+                profile_pic_url=profile_pic_url,
+                first_interaction=now,
+                last_interaction=now,
+                total_messages=count,
+                tags=[],
+                user_metadata={}
+            )
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[User.platform, User.platform_user_id],
+                set_={
+                    "last_interaction": now,
+                    "total_messages": func.coalesce(User.total_messages, 0) + count,
+                    "display_name": func.coalesce(User.display_name, stmt.excluded.display_name),
+                    "profile_pic_url": func.coalesce(User.profile_pic_url, stmt.excluded.profile_pic_url)
+                }
+            ).returning(User.id)
+            return session.execute(stmt).scalar_one()
+        
+        # Generic path: select, then update or insert
+        user = session.query(User).filter(
+            and_(User.platform == platform, User.platform_user_id == platform_user_id)
+        ).first()
+        if user is None:
+            user = User(
+                platform=platform,
+                platform_user_id=platform_user_id,
+                display_name=display_name,
+                profile_pic_url=profile_pic_url,
+                first_interaction=now,
+                last_interaction=now,
+                total_messages=count,
+                tags=[],
+                user_metadata={}
+            )
+            session.add(user)
+        else:
+            user.last_interaction = now
+            user.total_messages = (user.total_messages or 0) + count
+            if display_name and not user.display_name:
+                user.display_name = display_name
+            if profile_pic_url and not user.profile_pic_url:
+                user.profile_pic_url = profile_pic_url
+        session.flush()
+        return user.id
+    
+    def _bump_active_conversation(
+        self,
+        session: Session,
+        user_id: int,
+        platform: str,
+        count: int,
+        now: datetime
+    ) -> int:
+        """Add `count` to the active conversation's messages_count (creating it if needed)"""
+        active = select(Conversation.id).where(
+            and_(
+                Conversation.user_id == user_id,
+                Conversation.platform == platform,
+                Conversation.status == 'active'
+            )
+        ).order_by(desc(Conversation.started_at)).limit(1)
+        
+        if session.get_bind().dialect.update_returning:
+            conversation_id = session.execute(
+                update(Conversation)
+                .where(Conversation.id == active.scalar_subquery())
+                .values(messages_count=func.coalesce(Conversation.messages_count, 0) + count)
+                .returning(Conversation.id)
+            ).scalar()
+        else:
+            conversation_id = session.execute(active).scalar()
+            if conversation_id is not None:
+                session.execute(
+                    update(Conversation)
+                    .where(Conversation.id == conversation_id)
+                    .values(messages_count=func.coalesce(Conversation.messages_count, 0) + count)
+                )
+        
+        if conversation_id is None:
+            conversation_id = session.execute(
+                insert(Conversation).values(
+                    user_id=user_id,
+                    platform=platform,
+                    started_at=now,
+                    status='active',
+                    messages_count=count
+                )
+            ).inserted_primary_key[0]
+        return conversation_id
+    
     # ==================== FACEBOOK COMMENT OPERATIONS ====================
     
     def save_facebook_comment(
@@ -373,44 +809,9 @@ class CRUDManager:
     # ==================== ANALYTICS ====================
     
     def get_stats(self) -> Dict[str, Any]:
-        """Get system statistics"""
+        """Get system statistics (served from the stat_counters rollup, not COUNT(*) scans)"""
         try:
-            with self.db_manager.get_session() as session:
-                # Basic counts
-                total_users = session.query(func.count(User.id)).scalar()
-                total_conversations = session.query(func.count(Conversation.id)).scalar()
-                total_messages = session.query(func.count(Message.id)).scalar()
-                total_comments = session.query(func.count(FacebookComment.id)).scalar()
-                
-                # Platform breakdown
-                line_users = session.query(func.count(User.id)).filter(
-                    User.platform == 'line'
-                ).scalar()
-                fb_users = session.query(func.count(User.id)).filter(
-                    User.platform == 'facebook'
-                ).scalar()
-                
-                # Today's activity
-                today_start = datetime.utcnow().replace(
-                    hour=0, minute=0, second=0, microsecond=0
-                )
-                today_messages = session.query(func.count(Message.id)).filter(
-                    Message.created_at >= today_start
-                ).scalar()
-                today_comments = session.query(func.count(FacebookComment.id)).filter(
-                    FacebookComment.created_at >= today_start
-                ).scalar()
-                
-                return {
-                    "total_users": total_users or 0,
-                    "total_conversations": total_conversations or 0,
-                    "total_messages": total_messages or 0,
-                    "total_facebook_comments": total_comments or 0,
-                    "line_users": line_users or 0,
-                    "facebook_users": fb_users or 0,
-                    "today_messages": today_messages or 0,
-                    "today_comments": today_comments or 0
-                }
+            return self.stats_rollup.get_stats()
         except Exception as e:
             logger.error(f"❌ Error getting stats: {e}")
             return {}
@@ -456,38 +857,56 @@ class CRUDManager:
 
     # ==================== BROADCAST OPERATIONS ====================
 
-    def get_users_for_broadcast(
+    def get_broadcast_recipients(
         self,
         platform: Optional[str] = None,
         target_tags: Optional[List[str]] = None,
-        limit: int = 5000
-    ) -> List[User]:
-        """Get users eligible for broadcast with optional platform/tag filtering"""
-        try:
-            with self.db_manager.get_session() as session:
-                query = session.query(User)
-                if platform:
-                    query = query.filter(User.platform == platform)
-
-                users = query.order_by(desc(User.last_interaction)).limit(limit).all()
-                if not target_tags:
-                    return users
-
-                wanted = {tag.strip().lower() for tag in target_tags if tag and tag.strip()}
-                if not wanted:
-                    return users
-
-                filtered = []
-                for user in users:
-                    user_tags = user.tags or []
-                    normalized = {str(tag).strip().lower() for tag in user_tags}
-                    if normalized.intersection(wanted):
-                        filtered.append(user)
-                return filtered
-        except Exception as e:
-            logger.error(f"❌ Error getting users for broadcast: {e}")
-            return []
-
+        after_id: int = 0,
+        limit: int = 500
+    ) -> List[Tuple[int, str]]:
+        """
+        One keyset page of broadcast recipients as (id, platform_user_id)
+        
+        Tag filtering runs in SQL against user_tags (idx_tag_user); each page
+        is a short query of its own (users.id > after_id), so no transaction
+        stays open while the messages are being sent.
+        
+        Args:
+            platform: Optional platform filter
+            target_tags: Users having any of these tags (case-insensitive)
+            after_id: Last users.id of the previous page (0 for the first)
+            limit: Page size
+        """
+        query = select(User.id, User.platform_user_id).where(User.id > after_id)
+        if platform:
+            query = query.where(User.platform == platform)
+        wanted = _normalize_tags(target_tags)
+        if wanted:
+            query = query.where(
+                select(UserTag.user_id)
+                .where(and_(UserTag.user_id == User.id, UserTag.tag.in_(wanted)))
+                .exists()
+            )
+        
+        with self.db_manager.get_session() as session:
+            rows = session.execute(query.order_by(User.id).limit(limit)).all()
+            return [(row.id, row.platform_user_id) for row in rows]
+    
+    def iter_broadcast_recipients(
+        self,
+        platform: Optional[str] = None,
+        target_tags: Optional[List[str]] = None,
+        chunk_size: int = 500
+    ) -> Iterator[List[Tuple[int, str]]]:
+        """Walk every recipient page by page (see get_broadcast_recipients)"""
+        after_id = 0
+        while True:
+            chunk = self.get_broadcast_recipients(platform, target_tags, after_id, chunk_size)
+            if not chunk:
+                return
+            yield chunk
+            after_id = chunk[-1][0]
+    
     def create_broadcast_log(
         self,
         platform: str,
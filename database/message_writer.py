@@ -0,0 +1,378 @@
+"""
+Write-Behind Message Writer
+บันทึกข้อความแชทลง DB แบบ background — handler แค่ enqueue แล้วตอบลูกค้าได้ทันที
+
+- Bounded queue (memory จำกัด)
+- Background thread flush เป็น batch: 1 transaction ต่อ batch, แต่ละ user เขียนผ่าน
+  CRUDManager.write_turn (upsert user + bump conversation + insert messages) — เส้นทางหลักของการบันทึกแชท
+- แต่ละ user อยู่ใน savepoint ของตัวเอง: record ที่เสียทำให้ล้มเฉพาะ turn ของ user นั้น
+- Profile ของ user ใหม่ถูกดึงก่อนเปิด transaction (ไม่ถือ write lock ระหว่างรอ LINE/Graph API)
+- Record ที่เขียนไม่สำเร็จ (เช่น "database is locked") ถูก retry จำกัดจำนวนครั้ง
+- flush() ตอน shutdown
+"""
+
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+
+from sqlalchemy import and_
+
+from database.models import User
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class MessageRecord:
+    """One chat message waiting to be persisted"""
+    platform: str
+    platform_user_id: str
+    role: str  # 'user' | 'assistant'
+    content: str
+    created_at: datetime
+    enqueued_at: float
+    display_name: Optional[str] = None
+    profile_pic_url: Optional[str] = None
+    metadata: Dict[str, Any] = field(default_factory=dict)
+    attempts: int = 0
+
+
+class MessageWriter:
+    """Background batched persistence for chat messages"""
+
+    def __init__(
+        self,
+        max_queue: int = None,
+        batch_size: int = None,
+        flush_interval: float = None,
+        db_manager=None
+    ):
+        """
+        Initialize writer
+
+        Args:
+            max_queue: Max records buffered in memory (new records are dropped when full)
+            batch_size: Max records per transaction
+            flush_interval: Max seconds a record waits before its batch is flushed
+            db_manager: Database to write to (the global DatabaseManager by default)
+        """
+        self.max_queue = max_queue or int(os.getenv('MESSAGE_WRITER_MAX_QUEUE', 10000))
+        self.batch_size = batch_size or int(os.getenv('MESSAGE_WRITER_BATCH_SIZE', 200))
+        self.flush_interval = flush_interval or float(os.getenv('MESSAGE_WRITER_FLUSH_INTERVAL', 0.5))
+
+        self._queue: "queue.Queue[MessageRecord]" = queue.Queue(maxsize=self.max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+
+        self.db_manager = db_manager
+        self._crud = None
+        self.max_retries = int(os.getenv('MESSAGE_WRITER_MAX_RETRIES', 3))
+        # Failed records waiting to be written again (ahead of newer messages)
+        self._retry: List[MessageRecord] = []
+
+        # (platform, platform_user_id) of users known to exist — skips the new-user profile check
+        self._known_users: Dict[Tuple[str, str], bool] = {}
+        self.known_users_max = int(os.getenv('MESSAGE_WRITER_ID_CACHE', 50000))
+
+        self.stats = {
+            "enqueued": 0,
+            "written": 0,
+            "dropped": 0,
+            "failed": 0,
+            "retried": 0,
+            "batches": 0,
+            "total_lag_ms": 0.0,
+            "max_lag_ms": 0.0,
+            "last_batch_size": 0,
+            "last_flush_ms": 0.0
+        }
+
+    # ------------------------------------------------------------------
+    # Producer side (request / worker threads)
+    # ------------------------------------------------------------------
+
+    def enqueue(
+        self,
+        platform: str,
+        platform_user_id: str,
+        sender_type: str,
+        content: str,
+        display_name: Optional[str] = None,
+        profile_pic_url: Optional[str] = None,
+        metadata: Dict[str, Any] = None
+    ) -> bool:
+        """
+        Queue a message for persistence (never blocks)
+
+        Args:
+            sender_type: 'user' or 'bot' (same as CRUDManager.save_message)
+
+        Returns:
+            False if the buffer is full and the record was dropped
+        """
+        self._ensure_started()
+        record = MessageRecord(
+            platform=platform,
+            platform_user_id=platform_user_id,
+            role='user' if sender_type == 'user' else 'assistant',
+            content=content,
+            created_at=datetime.utcnow(),
+            enqueued_at=time.monotonic(),
+            display_name=display_name,
+            profile_pic_url=profile_pic_url,
+            metadata=metadata or {}
+        )
+        try:
+            self._queue.put_nowait(record)
+            self.stats["enqueued"] += 1
+            return True
+        except queue.Full:
+            self.stats["dropped"] += 1
+            logger.error(f"❌ Message writer buffer full ({self.max_queue}), dropping {platform} message")
+            return False
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="message-writer", daemon=True)
+                self._thread.start()
+                logger.info(f"📝 Message writer started (batch={self.batch_size}, interval={self.flush_interval}s)")
+
+    # ------------------------------------------------------------------
+    # Consumer side (background thread)
+    # ------------------------------------------------------------------
+
+    def _run(self):
+        while not self._stop.is_set() or not self._queue.empty() or self._retry:
+            batch = self._collect_batch()
+            if batch:
+                self._write_batch(batch)
+
+    def _collect_batch(self) -> List[MessageRecord]:
+        """Block for the first record, then gather more until batch_size or flush_interval"""
+        if self._retry:
+            batch, self._retry = self._retry, []
+            return batch
+        try:
+            first = self._queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write_batch(self, batch: List[MessageRecord]):
+        started = time.perf_counter()
+        crud = self._get_crud()
+        if crud is None:
+            # Database not configured — nothing to persist to
+            return
+
+        try:
+            turns = self._group_by_user(batch)
+            self._fill_new_user_profiles(crud.db_manager, turns)
+
+            failed: Dict[Tuple[str, str], List[MessageRecord]] = {}
+            error = None
+            with crud.db_manager.get_session() as session:
+                for (platform, platform_user_id), records in turns.items():
+                    # One savepoint per sender: a bad record only fails its own user's turn
+                    try:
+                        with session.begin_nested():
+                            crud.write_turn(
+                                session,
+                                platform,
+                                platform_user_id,
+                                [
+                                    {
+                                        "role": record.role,
+                                        "content": record.content,
+                                        "created_at": record.created_at,
+                                        "message_metadata": record.metadata
+                                    }
+                                    for record in records
+                                ],
+                                display_name=next((r.display_name for r in reversed(records) if r.display_name), None),
+                                profile_pic_url=next((r.profile_pic_url for r in reversed(records) if r.profile_pic_url), None),
+                                now=records[-1].created_at
+                            )
+                    except Exception as e:
+                        failed[(platform, platform_user_id)] = records
+                        error = e
+        except Exception as e:
+            # Whole transaction failed (e.g. "database is locked" on commit)
+            self._retry_or_fail(batch, e)
+            return
+
+        written = [record for key, records in turns.items() if key not in failed for record in records]
+        for key in turns:
+            if key not in failed:
+                self._remember_user(key)
+
+        now = time.monotonic()
+        for record in written:
+            lag_ms = (now - record.enqueued_at) * 1000
+            self.stats["total_lag_ms"] += lag_ms
+            self.stats["max_lag_ms"] = max(self.stats["max_lag_ms"], lag_ms)
+        self.stats["written"] += len(written)
+        self.stats["batches"] += 1
+        self.stats["last_batch_size"] = len(batch)
+        self.stats["last_flush_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+        if failed:
+            self._retry_or_fail([record for records in failed.values() for record in records], error)
+
+    def _retry_or_fail(self, batch: List[MessageRecord], error: Exception):
+        """Put failed records back in front of the queue (bounded attempts, with backoff)"""
+        retry = []
+        for record in batch:
+            record.attempts += 1
+            if record.attempts <= self.max_retries:
+                retry.append(record)
+        failed = len(batch) - len(retry)
+        if failed:
+            self.stats["failed"] += failed
+            logger.error(f"❌ Message writer gave up on {failed} messages after {self.max_retries} retries: {error}")
+        if retry:
+            self.stats["retried"] += len(retry)
+            attempt = max(record.attempts for record in retry)
+            logger.warning(f"⚠️  Message writer failed to persist {len(retry)} messages ({error}), retry {attempt}")
+            self._retry = retry + self._retry
+            time.sleep(min(0.5 * 2 ** (attempt - 1), 5))
+
+    def _get_crud(self):
+        if self._crud is None:
+            db_manager = self.db_manager
+            if db_manager is None:
+                from database.connection import db_manager
+                if not db_manager or not db_manager._engine:
+                    return None
+            from database.crud import CRUDManager
+            self._crud = CRUDManager(db_manager)
+        return self._crud
+
+    @staticmethod
+    def _group_by_user(batch: List[MessageRecord]) -> Dict[Tuple[str, str], List[MessageRecord]]:
+        """Records per sender, in arrival order"""
+        turns: Dict[Tuple[str, str], List[MessageRecord]] = {}
+        for record in batch:
+            turns.setdefault((record.platform, record.platform_user_id), []).append(record)
+        return turns
+
+    def _fill_new_user_profiles(self, db_manager, turns: Dict[Tuple[str, str], List[MessageRecord]]):
+        """
+        Look up the profile of senders that don't exist yet — before the write
+        transaction, so a slow LINE/Graph call never holds the database write lock
+        """
+        unknown: Dict[str, List[str]] = {}
+        for (platform, platform_user_id), records in turns.items():
+            if (platform, platform_user_id) in self._known_users:
+                continue
+            if any(record.display_name for record in records):
+                continue
+            unknown.setdefault(platform, []).append(platform_user_id)
+        if not unknown:
+            return
+
+        with db_manager.get_session() as session:
+            for platform, platform_user_ids in unknown.items():
+                for row in session.query(User.platform_user_id).filter(
+                    and_(User.platform == platform, User.platform_user_id.in_(platform_user_ids))
+                ):
+                    self._remember_user((platform, row.platform_user_id))
+
+        for platform, platform_user_ids in unknown.items():
+            for platform_user_id in platform_user_ids:
+                if (platform, platform_user_id) in self._known_users:
+                    continue
+                profile = _lookup_profile(platform, platform_user_id)
+                last = turns[(platform, platform_user_id)][-1]
+                last.display_name = profile.get("display_name")
+                last.profile_pic_url = last.profile_pic_url or profile.get("profile_pic")
+
+    def _remember_user(self, key: Tuple[str, str]):
+        if len(self._known_users) >= self.known_users_max:
+            self._known_users.clear()
+        self._known_users[key] = True
+
+    # ------------------------------------------------------------------
+    # Lifecycle / metrics
+    # ------------------------------------------------------------------
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Stop the writer after draining everything queued (shutdown)"""
+        if self._thread is None or not self._thread.is_alive():
+            return self._queue.empty()
+        self._stop.set()
+        self._thread.join(timeout)
+        drained = not self._thread.is_alive()
+        if not drained:
+            logger.warning(f"⚠️  Message writer shutdown with {self._queue.qsize()} messages unsaved")
+        return drained
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Queue depth / lag / throughput statistics"""
+        written = self.stats["written"]
+        oldest_lag_ms = 0.0
+        try:
+            oldest = self._queue.queue[0]
+            oldest_lag_ms = (time.monotonic() - oldest.enqueued_at) * 1000
+        except IndexError:
+            pass
+        return {
+            "queue_depth": self._queue.qsize(),
+            "max_queue": self.max_queue,
+            "oldest_pending_ms": round(oldest_lag_ms, 2),
+            "enqueued": self.stats["enqueued"],
+            "written": written,
+            "dropped": self.stats["dropped"],
+            "failed": self.stats["failed"],
+            "retried": self.stats["retried"],
+            "pending_retry": len(self._retry),
+            "batches": self.stats["batches"],
+            "avg_batch_size": round(written / self.stats["batches"], 2) if self.stats["batches"] else 0,
+            "avg_lag_ms": round(self.stats["total_lag_ms"] / written, 2) if written else 0,
+            "max_lag_ms": round(self.stats["max_lag_ms"], 2),
+            "last_flush_ms": self.stats["last_flush_ms"],
+            "known_users": len(self._known_users),
+            "running": bool(self._thread and self._thread.is_alive())
+        }
+
+
+def _lookup_profile(platform: str, platform_user_id: str) -> Dict[str, Any]:
+    try:
+        from platforms.profile_cache import get_profile_cache
+        return get_profile_cache().get(platform, platform_user_id) or {}
+    except Exception:
+        return {}
+
+
+# Singleton
+_message_writer = None
+_message_writer_lock = threading.Lock()
+
+def get_message_writer() -> MessageWriter:
+    """Get Message Writer singleton"""
+    global _message_writer
+    if _message_writer is None:
+        with _message_writer_lock:
+            if _message_writer is None:
+                _message_writer = MessageWriter()
+    return _message_writer
@@ -4,7 +4,7 @@ SQLAlchemy ORM Models
 """
 
 from sqlalchemy import (
-    Column, Integer, String, Text, Boolean, TIMESTAMP, 
+    Column, Integer, BigInteger, String, Text, Boolean, TIMESTAMP, 
     ForeignKey, JSON, Index, func
 )
 from sqlalchemy.ext.declarative import declarative_base
@@ -43,6 +43,22 @@ class User(Base):
         return f"<User {self.platform}:{self.display_name}>"
 
 
+class UserTag(Base):
+    """Normalized user tags (one row per user/tag) for indexed broadcast targeting"""
+    __tablename__ = 'user_tags'
+    
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    tag = Column(String(100), primary_key=True)  # strip().lower() of a User.tags entry
+    
+    # Indexes
+    __table_args__ = (
+        Index('idx_tag_user', 'tag', 'user_id'),
+    )
+    
+    def __repr__(self):
+        return f"<UserTag {self.user_id}:{self.tag}>"
+
+
 class Conversation(Base):
     """Conversation threads across all platforms"""
     __tablename__ = 'conversations'
@@ -240,3 +256,16 @@ class AutoReplyTemplate(Base):
     
     def __repr__(self):
         return f"<AutoReplyTemplate {self.name}>"
+
+
+class StatCounter(Base):
+    """Pre-aggregated dashboard counters (totals, daily buckets, rollup watermarks)"""
+    __tablename__ = 'stat_counters'
+    
+    # 'messages' | 'users:line' | 'messages:day:2026-01-15' | '_hwm:messages'
+    name = Column(String(100), primary_key=True)
+    value = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(TIMESTAMP, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<StatCounter {self.name}={self.value}>"
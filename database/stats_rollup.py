@@ -0,0 +1,294 @@
+"""
+Stats Rollup
+ตัวนับสำเร็จรูปสำหรับ dashboard (ตาราง stat_counters) แทน COUNT(*) ทั้งตารางทุกครั้งที่ poll
+
+- Delta job: นับเฉพาะแถวใหม่ตั้งแต่ watermark (id ล่าสุดที่นับแล้ว) — ใช้ primary key index, O(แถวใหม่)
+- Daily buckets: messages / facebook_comments แยกตามวัน (UTC)
+- อ่าน stats = 1 query ของ counters + cache ใน process (STATS_CACHE_TTL)
+- Reconcile job: นับใหม่ทั้งหมดเป็นระยะ แก้ drift (แถวที่ถูกลบ, id ที่ commit ไม่เรียงลำดับ)
+"""
+
+import asyncio
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+import logging
+
+from sqlalchemy import and_, func, select, update
+
+from database.models import User, Conversation, Message, FacebookComment, StatCounter
+
+logger = logging.getLogger(__name__)
+
+# counter name -> (model, group-by column, day-bucket column)
+ROLLUP_TABLES = {
+    "users": (User, User.platform, None),
+    "conversations": (Conversation, None, None),
+    "messages": (Message, None, Message.created_at),
+    "facebook_comments": (FacebookComment, None, FacebookComment.created_at),
+}
+
+
+def _day_key(name: str, day) -> str:
+    # SQLite returns 'YYYY-MM-DD', PostgreSQL a date
+    return f"{name}:day:{str(day)[:10]}"
+
+
+class StatsRollup:
+    """Maintains stat_counters and serves dashboard stats from it"""
+
+    def __init__(self, db_manager):
+        """
+        Initialize rollup
+
+        Args:
+            db_manager: DatabaseManager (anything with get_session())
+        """
+        self.db_manager = db_manager
+        self.cache_ttl = float(os.getenv('STATS_CACHE_TTL', 10))
+        self.reconcile_interval = float(os.getenv('STATS_RECONCILE_INTERVAL_HOURS', 6)) * 3600
+        self.reconcile_days = int(os.getenv('STATS_RECONCILE_DAYS', 7))
+        self.retention_days = int(os.getenv('STATS_BUCKET_RETENTION_DAYS', 90))
+
+        self._lock = threading.Lock()
+        self._cache: Optional[Dict[str, Any]] = None
+        self._cache_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+        self.stats = {
+            "reads": 0,
+            "cache_hits": 0,
+            "delta_runs": 0,
+            "delta_rows": 0,
+            "delta_conflicts": 0,
+            "reconciles": 0,
+            "last_drift": {}
+        }
+
+    # ------------------------------------------------------------------
+    # Reading
+    # ------------------------------------------------------------------
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Dashboard statistics (same keys as the old COUNT(*) version)"""
+        self.stats["reads"] += 1
+        if self._cache is not None and time.monotonic() - self._cache_at < self.cache_ttl:
+            self.stats["cache_hits"] += 1
+            return self._cache
+
+        with self._lock:
+            if self._cache is not None and time.monotonic() - self._cache_at < self.cache_ttl:
+                self.stats["cache_hits"] += 1
+                return self._cache
+            self.apply_deltas()
+
+            today = datetime.utcnow().date()
+            names = [
+                "users", "users:line", "users:facebook", "conversations",
+                "messages", "facebook_comments",
+                _day_key("messages", today), _day_key("facebook_comments", today)
+            ]
+            with self.db_manager.get_session() as session:
+                counters = dict(session.execute(
+                    select(StatCounter.name, StatCounter.value).where(StatCounter.name.in_(names))
+                ).all())
+
+            self._cache = {
+                "total_users": counters.get("users", 0),
+                "total_conversations": counters.get("conversations", 0),
+                "total_messages": counters.get("messages", 0),
+                "total_facebook_comments": counters.get("facebook_comments", 0),
+                "line_users": counters.get("users:line", 0),
+                "facebook_users": counters.get("users:facebook", 0),
+                "today_messages": counters.get(_day_key("messages", today), 0),
+                "today_comments": counters.get(_day_key("facebook_comments", today), 0)
+            }
+            self._cache_at = time.monotonic()
+            return self._cache
+
+    # ------------------------------------------------------------------
+    # Delta job
+    # ------------------------------------------------------------------
+
+    def apply_deltas(self) -> int:
+        """
+        Count rows added since each table's watermark and add them to the counters
+        (counters + watermark commit together; a concurrent run loses the CAS and rolls back)
+
+        Returns:
+            Number of new rows rolled up
+        """
+        total = 0
+        for name, (model, group_column, day_column) in ROLLUP_TABLES.items():
+            try:
+                with self.db_manager.get_session() as session:
+                    watermark_name = f"_hwm:{name}"
+                    watermark = session.execute(
+                        select(StatCounter.value).where(StatCounter.name == watermark_name)
+                    ).scalar()
+                    max_id = session.execute(select(func.max(model.id))).scalar() or 0
+                    if watermark is not None and max_id <= watermark:
+                        continue
+
+                    window = and_(model.id > (watermark or 0), model.id <= max_id)
+                    columns = []
+                    if group_column is not None:
+                        columns.append(group_column)
+                    if day_column is not None:
+                        columns.append(func.date(day_column))
+                    query = select(*columns, func.count()).select_from(model).where(window)
+                    rows = session.execute(query.group_by(*columns) if columns else query).all()
+
+                    deltas: Dict[str, int] = {}
+                    for row in rows:
+                        count = row[-1]
+                        deltas[name] = deltas.get(name, 0) + count
+                        if group_column is not None:
+                            key = f"{name}:{row[0]}"
+                            deltas[key] = deltas.get(key, 0) + count
+                        if day_column is not None:
+                            key = _day_key(name, row[-2])
+                            deltas[key] = deltas.get(key, 0) + count
+
+                    if not self._advance_watermark(session, watermark_name, watermark, max_id):
+                        self.stats["delta_conflicts"] += 1
+                        session.rollback()
+                        continue
+                    self._increment(session, deltas)
+                    total += deltas.get(name, 0)
+            except Exception as e:
+                logger.error(f"❌ Stats rollup delta failed for {name}: {e}")
+
+        self.stats["delta_runs"] += 1
+        self.stats["delta_rows"] += total
+        return total
+
+    def _advance_watermark(self, session, watermark_name: str, expected: Optional[int], value: int) -> bool:
+        if expected is None:
+            if session.get(StatCounter, watermark_name) is not None:
+                return False
+            session.add(StatCounter(name=watermark_name, value=value, updated_at=datetime.utcnow()))
+            session.flush()
+            return True
+        result = session.execute(
+            update(StatCounter)
+            .where(and_(StatCounter.name == watermark_name, StatCounter.value == expected))
+            .values(value=value, updated_at=datetime.utcnow())
+        )
+        return result.rowcount == 1
+
+    def _increment(self, session, deltas: Dict[str, int]):
+        if not deltas:
+            return
+        existing = set(session.execute(
+            select(StatCounter.name).where(StatCounter.name.in_(list(deltas)))
+        ).scalars())
+        now = datetime.utcnow()
+        for name, delta in deltas.items():
+            if name in existing:
+                session.execute(
+                    update(StatCounter)
+                    .where(StatCounter.name == name)
+                    .values(value=StatCounter.value + delta, updated_at=now)
+                )
+            else:
+                session.add(StatCounter(name=name, value=delta, updated_at=now))
+
+    # ------------------------------------------------------------------
+    # Reconcile job
+    # ------------------------------------------------------------------
+
+    def reconcile(self) -> Dict[str, int]:
+        """
+        Recount totals (and the last STATS_RECONCILE_DAYS daily buckets) from the source
+        tables and overwrite the counters; drops buckets older than the retention
+
+        Returns:
+            Drift per counter that had to be corrected
+        """
+        with self._lock:
+            drift: Dict[str, int] = {}
+            since = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=self.reconcile_days - 1)
+            with self.db_manager.get_session() as session:
+                values: Dict[str, int] = {}
+                for name, (model, group_column, day_column) in ROLLUP_TABLES.items():
+                    max_id = session.execute(select(func.max(model.id))).scalar() or 0
+                    values[f"_hwm:{name}"] = max_id
+                    bounded = model.id <= max_id
+                    values[name] = session.execute(select(func.count()).select_from(model).where(bounded)).scalar()
+                    if group_column is not None:
+                        for group, count in session.execute(
+                            select(group_column, func.count()).where(bounded).group_by(group_column)
+                        ):
+                            values[f"{name}:{group}"] = count
+                    if day_column is not None:
+                        day = func.date(day_column)
+                        for bucket_day in range(self.reconcile_days):
+                            values[_day_key(name, (since + timedelta(days=bucket_day)).date())] = 0
+                        for bucket, count in session.execute(
+                            select(day, func.count()).where(and_(bounded, day_column >= since)).group_by(day)
+                        ):
+                            values[_day_key(name, bucket)] = count
+
+                current = dict(session.execute(
+                    select(StatCounter.name, StatCounter.value).where(StatCounter.name.in_(list(values)))
+                ).all())
+                now = datetime.utcnow()
+                for name, value in values.items():
+                    if current.get(name) == value:
+                        continue
+                    if not name.startswith("_hwm:") and name in current:
+                        drift[name] = value - current[name]
+                    session.merge(StatCounter(name=name, value=value, updated_at=now))
+
+                cutoff = (datetime.utcnow() - timedelta(days=self.retention_days)).date()
+                for name in ("messages", "facebook_comments"):
+                    session.query(StatCounter).filter(
+                        and_(StatCounter.name.like(f"{name}:day:%"), StatCounter.name < _day_key(name, cutoff))
+                    ).delete(synchronize_session=False)
+
+            self._cache = None
+            self.stats["reconciles"] += 1
+            self.stats["last_drift"] = drift
+            if drift:
+                logger.warning(f"⚠️  Stats rollup drift corrected: {drift}")
+            return drift
+
+    # ------------------------------------------------------------------
+    # Scheduling
+    # ------------------------------------------------------------------
+
+    async def run_reconcile_loop(self):
+        """Reconcile once at startup, then every STATS_RECONCILE_INTERVAL_HOURS"""
+        while True:
+            try:
+                await asyncio.to_thread(self.reconcile)
+            except Exception as e:
+                logger.error(f"❌ Stats reconcile failed: {e}")
+            await asyncio.sleep(self.reconcile_interval)
+
+    def start(self) -> asyncio.Task:
+        """Start the background reconcile task on the running loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run_reconcile_loop())
+        return self._task
+
+    async def stop(self):
+        """Cancel the background reconcile task"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+
+    def get_rollup_stats(self) -> Dict[str, Any]:
+        """Rollup job statistics"""
+        return {
+            **self.stats,
+            "cache_ttl_seconds": self.cache_ttl,
+            "running": self._task is not None and not self._task.done()
+        }
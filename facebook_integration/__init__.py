@@ -1,23 +1,36 @@
 """
 Facebook Integration Module for Seoulholic Clinic Chatbot
 Includes: Scraper, Auto-Updater, Comment Webhook, Intent Detector, Auto-Reply
+
+Submodules are imported lazily on first attribute access so that importing
+one piece (e.g. comment_webhook) does not pull in the scraper/scheduler
 """
 
-from .fb_scraper import FacebookPageScraper, format_posts_for_chatbot
-from .auto_updater import FacebookAutoUpdater
+import importlib
+
+_LAZY_ATTRS = {
+    'FacebookPageScraper': '.fb_scraper',
+    'format_posts_for_chatbot': '.fb_scraper',
+    'FacebookAutoUpdater': '.auto_updater',
+    'FacebookCommentWebhook': '.comment_webhook',
+    'IntentDetector': '.intent_detector',
+    'AutoReplyEngine': '.auto_reply_engine',
+    'RateLimiter': '.rate_limiter',
+}
+
+
+def __getattr__(name):
+    module_name = _LAZY_ATTRS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    try:
+        value = getattr(importlib.import_module(module_name, __name__), name)
+    except ImportError:
+        # Optional module not available
+        value = None
+    globals()[name] = value
+    return value
 
-# New modules
-try:
-    from .comment_webhook import FacebookCommentWebhook
-    from .intent_detector import IntentDetector
-    from .auto_reply_engine import AutoReplyEngine
-    from .rate_limiter import RateLimiter
-except ImportError:
-    # Modules not yet created
-    FacebookCommentWebhook = None
-    IntentDetector = None
-    AutoReplyEngine = None
-    RateLimiter = None
 
 __all__ = [
     'FacebookPageScraper', 
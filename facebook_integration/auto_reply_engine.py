@@ -6,12 +6,13 @@ Generates 2-tier replies: Short (for comment) + Full (for DM)
 import os
 import sys
 from pathlib import Path
-from typing import Dict, Tuple
+from typing import Dict, Optional, Tuple
 import logging
 
 # Add parent directory
 sys.path.append(str(Path(__file__).resolve().parents[1]))
 from core.ai_service import AIService
+from facebook_integration.comment_clusterer import CommentClusterer
 
 logger = logging.getLogger(__name__)
 
@@ -33,13 +34,17 @@ class AutoReplyEngine:
             'สวัสดีค่ะ! 💖 กำลังส่งข้อมูลให้ในแชทนะคะ รบกวนเช็คข้อความที่ส่งไปให้ด้วยค่ะ'
         )
         
+        # Near-identical comments on one post share a single generated DM
+        self.clusterer = CommentClusterer()
+        
         logger.info("✅ Auto-Reply Engine initialized")
     
     def generate_replies(
         self, 
         user_comment: str, 
         intent: str, 
-        user_name: str = None
+        user_name: str = None,
+        post_id: str = None
     ) -> Tuple[str, str]:
         """
         Generate both short and full replies
@@ -48,6 +53,7 @@ class AutoReplyEngine:
             user_comment: User's comment text
             intent: Detected intent (booking/pricing/inquiry)
             user_name: User's display name (optional)
+            post_id: Post the comment is on — enables reply reuse across similar comments
             
         Returns:
             Tuple of (short_reply, full_reply)
@@ -55,11 +61,38 @@ class AutoReplyEngine:
         # Generate short reply (for comment)
         short_reply = self._generate_short_reply(user_name, intent)
         
-        # Generate full reply (for DM)
-        full_reply = self._generate_full_reply(user_comment, user_name, intent)
+        # Generate full reply (for DM) — one LLM call per cluster of similar comments,
+        # personalized afterwards with the commenter's name
+        if post_id:
+            body = self.clusterer.get_or_generate(
+                post_id, intent, user_comment,
+                lambda: self._generate_full_reply_body(user_comment, intent)
+            )
+            full_reply = self._personalize(body, user_name)
+        else:
+            full_reply = self._generate_full_reply(user_comment, user_name, intent)
         
         return (short_reply, full_reply)
-    
+
+    def generate_template_replies(self, intent: str, user_name: str = None) -> Tuple[str, Optional[str]]:
+        """
+        Template-only replies (no LLM call) — used when the reply queue is overloaded
+
+        Args:
+            intent: Detected intent
+            user_name: User's display name (optional)
+
+        Returns:
+            Tuple of (short_reply, full_reply); full_reply is None when no DM should be sent
+        """
+        if intent == 'praise':
+            greeting = f"คุณ{user_name} " if user_name else ""
+            return (f"ขอบคุณ{greeting}มากๆ เลยนะคะ 💖", None)
+
+        template = self.get_template(intent)
+        full_reply = f"{template['greeting']}\n\n📞 ติดต่อจองคิว: 099-989-2893\n💬 LINE: @seoulholicclinic"
+        return (self._generate_short_reply(user_name, intent), full_reply)
+
     def _generate_short_reply(self, user_name: str = None, intent: str = None) -> str:
         """
         Generate short reply for public comment
@@ -94,9 +127,19 @@ class AutoReplyEngine:
         Returns:
             Full reply text
         """
-        # Personalized greeting
-        greeting = f"สวัสดีค่ะคุณ{user_name}! " if user_name else "สวัสดีค่ะ! "
+        return self._personalize(self._generate_full_reply_body(user_comment, intent), user_name)
+    
+    def _generate_full_reply_body(self, user_comment: str, intent: str = None) -> str:
+        """
+        Generate the name-agnostic part of the DM with the LLM (shareable across users)
         
+        Args:
+            user_comment: User's comment
+            intent: Detected intent
+            
+        Returns:
+            Reply text without personalization
+        """
         # Get relevant context from RAG
         relevant_info = self.ai_service.find_relevant_info(user_comment)
         
@@ -128,10 +171,6 @@ class AutoReplyEngine:
         # Clean markdown
         cleaned = self.ai_service._clean_markdown(response_text)
         
-        # Add greeting if AI didn't include one
-        if not any(word in cleaned[:50] for word in ['สวัสดี', 'ขอบคุณ', 'Hello']):
-            cleaned = greeting + cleaned
-        
         # Add contact info at the end if booking/pricing
         if intent in ['booking', 'pricing']:
             if 'ติดต่อ' not in cleaned and '099-989-2893' not in cleaned:
@@ -141,6 +180,26 @@ class AutoReplyEngine:
         
         return cleaned
     
+    def _personalize(self, reply: str, user_name: str = None) -> str:
+        """
+        Add the user's name to a generated reply (cheap, no LLM call)
+        
+        Args:
+            reply: Name-agnostic reply
+            user_name: User's name
+            
+        Returns:
+            Personalized reply text
+        """
+        greeting = f"สวัสดีค่ะคุณ{user_name}! " if user_name else "สวัสดีค่ะ! "
+        
+        # Add greeting if AI didn't include one
+        if not any(word in reply[:50] for word in ['สวัสดี', 'ขอบคุณ', 'Hello']):
+            return greeting + reply
+        if user_name and reply.startswith('สวัสดีค่ะ'):
+            return f"สวัสดีค่ะคุณ{user_name}" + reply[len('สวัสดีค่ะ'):]
+        return reply
+    
     def get_template(self, intent: str = None) -> Dict[str, str]:
         """
         Get reply templates
@@ -169,5 +228,12 @@ class AutoReplyEngine:
         return templates.get(intent, templates['inquiry'])
 
 
-# Global instance
-auto_reply_engine = AutoReplyEngine()
+# Global instance (created on first use — constructing it loads the AI knowledge base)
+_auto_reply_engine = None
+
+def get_auto_reply_engine() -> AutoReplyEngine:
+    """Get Auto Reply Engine singleton"""
+    global _auto_reply_engine
+    if _auto_reply_engine is None:
+        _auto_reply_engine = AutoReplyEngine()
+    return _auto_reply_engine
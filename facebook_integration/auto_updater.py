@@ -1,10 +1,12 @@
 """
 Auto-update Service for Facebook Posts
-ระบบอัปเดตโพสต์จาก Facebook อัตโนมัติ
+ระบบอัปเดตโพสต์จาก Facebook อัตโนมัติ (CLI)
+
+ในแอปหลัก การซิงก์รันเป็น asyncio task ผ่าน PageSyncEngine อยู่แล้ว —
+สคริปต์นี้ใช้ engine ตัวเดียวกันสำหรับรันแยก / ทดสอบ
 """
 
-import schedule
-import time
+import asyncio
 import os
 from datetime import datetime
 from pathlib import Path
@@ -12,7 +14,9 @@ import sys
 
 # เพิ่ม path เพื่อ import fb_scraper
 sys.path.append(str(Path(__file__).resolve().parent))
-from fb_scraper import FacebookPageScraper, format_posts_for_chatbot
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from fb_scraper import FacebookPageScraper
+from facebook_integration.page_sync import PageSyncEngine
 
 
 class FacebookAutoUpdater:
@@ -27,69 +31,30 @@ class FacebookAutoUpdater:
         """
         self.scraper = FacebookPageScraper()
         self.update_interval = update_interval_minutes
+        self.sync_engine = PageSyncEngine(scraper=self.scraper, interval_minutes=update_interval_minutes)
         self.last_update = None
         
     def update_posts(self):
-        """อัปเดตโพสต์จาก Facebook"""
+        """อัปเดตโพสต์จาก Facebook (เฉพาะโพสต์ที่เปลี่ยนตั้งแต่รอบก่อน)"""
         try:
             print(f"\n⏰ [{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] กำลังอัปเดตข้อมูล...")
             
-            # ดึงโพสต์ล่าสุด
-            posts = self.scraper.get_latest_posts(limit=10)
-            promotions = self.scraper.get_promotions()
-            
-            # บันทึกลงไฟล์
-            self.scraper.save_to_file(posts, "fb_posts.json")
-            self.scraper.save_to_file(promotions, "fb_promotions.json")
-            
-            # สร้างไฟล์ text สำหรับ chatbot
-            self._create_chatbot_context(promotions)
-            
+            changed = self.sync_engine.sync_once()
             self.last_update = datetime.now()
             
-            print(f"[OK] อัปเดตสำเร็จ! พบ {len(posts)} โพสต์, {len(promotions)} โปรโมชั่น")
-            print(f"🕐 อัปเดตครั้งถัดไปในอีก {self.update_interval} นาที\n")
+            print(f"[OK] อัปเดตสำเร็จ! โพสต์ใหม่/แก้ไข {len(changed)} โพสต์")
             
         except Exception as e:
             print(f"[ERROR] Error: {e}")
     
-    def _create_chatbot_context(self, promotions: list):
-        """
-        สร้างไฟล์ text สำหรับให้ chatbot อ่าน
-        
-        Args:
-            promotions: รายการโปรโมชั่น
-        """
-        # สร้างโฟลเดอร์ data/text ถ้ายังไม่มี
-        data_dir = Path(__file__).resolve().parents[1] / "data" / "text"
-        data_dir.mkdir(parents=True, exist_ok=True)
-        
-        # สร้างไฟล์ FacebookPromotions.txt
-        filepath = data_dir / "FacebookPromotions.txt"
-        
-        content = format_posts_for_chatbot(promotions)
-        
-        with open(filepath, "w", encoding="utf-8") as f:
-            f.write(content)
-        
-        print(f"📄 สร้างไฟล์ {filepath} สำเร็จ")
-    
     def start_scheduled_updates(self):
         """เริ่มระบบอัปเดตอัตโนมัติ"""
         print("[START] เริ่มระบบอัปเดตอัตโนมัติ")
         print(f"⏱️  จะอัปเดตทุก {self.update_interval} นาที")
         print("=" * 60)
         
-        # อัปเดตทันทีครั้งแรก
-        self.update_posts()
-        
-        # ตั้งเวลาอัปเดตอัตโนมัติ
-        schedule.every(self.update_interval).minutes.do(self.update_posts)
-        
-        # รันตลอดเวลา
-        while True:
-            schedule.run_pending()
-            time.sleep(1)
+        # อัปเดตทันทีครั้งแรก แล้ววนตามรอบ (มี jitter)
+        asyncio.run(self.sync_engine.run())
     
     def update_once(self):
         """อัปเดตครั้งเดียวแล้วจบ (สำหรับทดสอบ)"""
@@ -0,0 +1,196 @@
+"""
+Comment Clusterer
+รวมคอมเมนต์ที่แทบเหมือนกัน ("สนใจค่ะ", "สนใจ", "สนใจคะ") ในโพสต์เดียวกันเป็นกลุ่ม
+แล้วใช้ full reply (DM) ที่ LLM สร้างครั้งเดียวร่วมกันทั้งกลุ่ม
+
+- Normalize: ตัด emoji / เครื่องหมาย / คำลงท้าย (ค่ะ คะ ครับ นะ ...) / ตัวอักษรซ้ำ,
+  รวมคำถามราคาที่สะกดต่างกัน (เท่าไร / เท่าไหร่ / กี่บาท)
+- Similarity: คอมเมนต์สั้นต้องเหมือนกันหลัง normalize; คอมเมนต์ยาวใช้ Jaccard ของ
+  character 3-gram ≥ COMMENT_CLUSTER_SIMILARITY (ค่าเริ่มต้น 0.8 — "ฟิลเลอร์ใต้ตา" กับ
+  "ฟิลเลอร์คาง" ถามคนละเรื่อง แต่ 3-gram ซ้ำกันถึง 0.6)
+- กลุ่มแยกตาม (post, intent) และหมดอายุตาม COMMENT_CLUSTER_WINDOW
+- คอมเมนต์ที่มาพร้อมกันในกลุ่มเดียวกันจะรอผลจาก LLM call เดียว
+"""
+
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Sentence-final particles that don't change the question
+_PARTICLES = re.compile(r"(ค่ะ|คะ|ครับ|คับ|ค่า|คร่า|จ้า|จ้ะ|จ๊ะ|นะ|น้า|ฮะ|ฮับ|งับ)+$")
+_NON_WORD = re.compile(r"[^\w฀-๿]+")
+_REPEATS = re.compile(r"(.)\1{2,}")
+_PRICE_QUESTION = re.compile(r"เท่าไหร่|เท่าไร|เท่าไหร|เท่าหร่าย|กี่บาท")
+
+
+def normalize_comment(text: str) -> str:
+    """Reduce a comment to the part that decides what the reply says"""
+    text = (text or "").lower()
+    text = _NON_WORD.sub("", text)          # spaces, punctuation, emoji
+    text = _REPEATS.sub(r"\1", text)        # สนใจจจจ -> สนใจ, 555555 -> 5
+    text = _PRICE_QUESTION.sub("เท่าไหร่", text)
+    stripped = _PARTICLES.sub("", text)
+    return stripped or text
+
+
+def shingles(text: str, n: int = 3) -> FrozenSet[str]:
+    """Character n-grams (padded so 1-2 character comments still get some)"""
+    padded = f"^{text}$"
+    if len(padded) <= n:
+        return frozenset([padded])
+    return frozenset(padded[i:i + n] for i in range(len(padded) - n + 1))
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+@dataclass(slots=True, eq=False)
+class _Cluster:
+    text: str
+    shingles: FrozenSet[str]
+    created_at: float
+    ready: threading.Event = field(default_factory=threading.Event)
+    reply: Optional[str] = None
+    members: int = 1
+
+
+class CommentClusterer:
+    """
+    Reuses one generated reply per (post, intent, cluster of similar comments)
+
+    Thread-safe: generation runs in worker threads (asyncio.to_thread)
+    """
+
+    def __init__(self, window_seconds: float = None, threshold: float = None, max_groups: int = None):
+        """
+        Initialize clusterer
+
+        Args:
+            window_seconds: How long a generated reply can be reused
+            threshold: Minimum 3-gram Jaccard similarity to join a cluster (long comments)
+            max_groups: (post, intent) groups kept in memory (LRU)
+        """
+        self.window = window_seconds or float(os.getenv('COMMENT_CLUSTER_WINDOW', 900))
+        self.threshold = threshold or float(os.getenv('COMMENT_CLUSTER_SIMILARITY', 0.8))
+        # Normalized comments shorter than this only cluster on an exact match
+        self.min_fuzzy_length = int(os.getenv('COMMENT_CLUSTER_MIN_FUZZY_LENGTH', 12))
+        self.max_groups = max_groups or int(os.getenv('COMMENT_CLUSTER_MAX_GROUPS', 500))
+        self.max_clusters_per_group = 100
+
+        self._groups: "OrderedDict[Tuple[str, str], List[_Cluster]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.stats = {
+            "generated": 0,
+            "reused": 0,
+            "waited": 0,
+            "generation_failures": 0
+        }
+
+    def get_or_generate(self, post_id: str, intent: str, comment: str, generate: Callable[[], str]) -> str:
+        """
+        Return the cluster's reply, calling `generate` only for the first comment of a cluster
+
+        Args:
+            post_id: Facebook post ID
+            intent: Detected intent
+            comment: Raw comment text
+            generate: Produces a name-agnostic reply (blocking LLM call)
+
+        Returns:
+            Reply text
+        """
+        text = normalize_comment(comment)
+        grams = shingles(text)
+        now = time.time()
+
+        with self._lock:
+            cluster = self._find(post_id, intent, text, grams, now)
+            owner = cluster is None
+            if owner:
+                cluster = _Cluster(text=text, shingles=grams, created_at=now)
+                self._add(post_id, intent, cluster)
+            else:
+                cluster.members += 1
+
+        if owner:
+            try:
+                cluster.reply = generate()
+                self.stats["generated"] += 1
+                return cluster.reply
+            except Exception:
+                self.stats["generation_failures"] += 1
+                self._remove(post_id, intent, cluster)
+                raise
+            finally:
+                cluster.ready.set()
+
+        # Another thread is generating this cluster's reply — wait for it
+        if not cluster.ready.is_set():
+            self.stats["waited"] += 1
+            cluster.ready.wait(timeout=120)
+        if cluster.reply is None:
+            return generate()
+        self.stats["reused"] += 1
+        return cluster.reply
+
+    def _find(self, post_id: str, intent: str, text: str, grams: FrozenSet[str], now: float) -> Optional[_Cluster]:
+        key = (post_id, intent)
+        clusters = self._groups.get(key)
+        if not clusters:
+            return None
+        self._groups.move_to_end(key)
+        clusters[:] = [c for c in clusters if now - c.created_at < self.window]
+
+        fuzzy = len(text) >= self.min_fuzzy_length
+        best, best_score = None, self.threshold
+        for cluster in clusters:
+            if cluster.text == text:
+                return cluster
+            if not fuzzy or len(cluster.text) < self.min_fuzzy_length:
+                continue
+            score = jaccard(grams, cluster.shingles)
+            if score >= best_score:
+                best, best_score = cluster, score
+        return best
+
+    def _add(self, post_id: str, intent: str, cluster: _Cluster):
+        key = (post_id, intent)
+        clusters = self._groups.setdefault(key, [])
+        self._groups.move_to_end(key)
+        clusters.append(cluster)
+        if len(clusters) > self.max_clusters_per_group:
+            del clusters[0]
+        while len(self._groups) > self.max_groups:
+            self._groups.popitem(last=False)
+
+    def _remove(self, post_id: str, intent: str, cluster: _Cluster):
+        with self._lock:
+            clusters = self._groups.get((post_id, intent), [])
+            if cluster in clusters:
+                clusters.remove(cluster)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Clustering statistics"""
+        with self._lock:
+            clusters = sum(len(c) for c in self._groups.values())
+        handled = self.stats["generated"] + self.stats["reused"]
+        return {
+            **self.stats,
+            "groups": len(self._groups),
+            "clusters": clusters,
+            "llm_calls_saved_rate": round(self.stats["reused"] / handled, 3) if handled else 0,
+            "window_seconds": self.window,
+            "similarity_threshold": self.threshold,
+            "min_fuzzy_length": self.min_fuzzy_length
+        }
@@ -4,8 +4,9 @@ Receives comment events from Facebook and triggers auto-reply
 """
 
 import os
-import requests
-from typing import Dict, Any, Optional
+import asyncio
+import functools
+from typing import Dict, Any, List, Optional
 from datetime import datetime
 import logging
 import hashlib
@@ -13,7 +14,11 @@ import hmac
 
 from .intent_detector import IntentDetector
 from .auto_reply_engine import AutoReplyEngine
-from .rate_limiter import RateLimiter
+from .rate_limiter import get_rate_limiter
+from .reply_scheduler import PriorityReplyScheduler
+from platforms.event_dedup import get_event_deduplicator
+from platforms.work_queue import create_work_queue
+from core.graph_client import get_graph_client
 
 logger = logging.getLogger(__name__)
 
@@ -23,8 +28,8 @@ class FacebookCommentWebhook:
     Handle Facebook Comment Webhooks
     1. Receive comment event
     2. Detect intent
-    3. Generate replies (comment + DM)
-    4. Send both
+    3. Queue by intent priority (PriorityReplyScheduler)
+    4. Generate replies (comment + DM) and send both
     5. Log to database
     """
     
@@ -40,7 +45,7 @@ class FacebookCommentWebhook:
         # Initialize services
         self.intent_detector = IntentDetector()
         self.auto_reply_engine = AutoReplyEngine()
-        self.rate_limiter = RateLimiter()
+        self.rate_limiter = get_rate_limiter()
         
         # Facebook Graph API (use v20.0 for better compatibility)
         self.graph_api_url = "https://graph.facebook.com/v20.0"
@@ -48,6 +53,11 @@ class FacebookCommentWebhook:
         # Settings
         self.auto_reply_enabled = os.getenv('AUTO_REPLY_ENABLED', 'true').lower() == 'true'
         
+        # Comments are processed in the background: per-commenter FIFO, cross-user parallel
+        self.work_queue = create_work_queue("facebook_comments", "FACEBOOK_COMMENT", concurrency=8, max_depth=1000)
+        # Classified comments wait here for an LLM worker, highest intent priority first
+        self.reply_scheduler = PriorityReplyScheduler()
+        
         logger.info(f"✅ Facebook Comment Webhook initialized (auto-reply: {self.auto_reply_enabled})")
     
     async def handle_verification(self, mode: str, token: str, challenge: str) -> Dict[str, Any]:
@@ -95,24 +105,47 @@ class FacebookCommentWebhook:
             logger.warning(f"⚠️  Received non-page event: {body.get('object')}")
             return {"status": "ignored"}
         
-        # Process entries
-        for entry in body.get("entry", []):
-            await self._process_entry(entry)
+        # Split into feed changes (one unit each) and acknowledge right away
+        values = self._collect_feed_changes(body)
+        # Same comment can arrive more than once (redelivery) — drop it before it takes a queue slot
+        dedup = get_event_deduplicator()
+        received = len(values)
+        values = [value for value in values if dedup.check_and_mark("facebook_comment", self._dedup_id(value))]
+        if not self.work_queue.has_capacity(len(values)):
+            # Nothing was scheduled: let Meta's redelivery through
+            for value in values:
+                dedup.unmark("facebook_comment", self._dedup_id(value))
+            self.work_queue.stats["rejected"] += len(values)
+            logger.warning(f"⚠️  Comment queue full ({self.work_queue.depth}), rejecting {len(values)} changes")
+            return {"status": "busy"}
         
-        return {"status": "ok"}
+        for value in values:
+            key = (value.get("from") or {}).get("id") or value.get("comment_id") or "unknown"
+            self.work_queue.submit(key, functools.partial(self._handle_comment, value))
+        
+        return {"status": "ok", "queued": len(values), "duplicates": received - len(values)}
+    
+    @staticmethod
+    def _dedup_id(value: Dict[str, Any]) -> Optional[str]:
+        """Comment ID of a new comment (edits / removals reuse it, so they are not deduped)"""
+        if value.get("item") == "comment" and value.get("verb") == "add":
+            return value.get("comment_id")
+        return None
     
-    async def _process_entry(self, entry: Dict[str, Any]):
-        """Process a single webhook entry"""
-        changes = entry.get("changes", [])
-        messaging = entry.get("messaging", [])
-        logger.info(f"📋 Comment entry: changes={len(changes)}, messaging={len(messaging)}")
-        # Handle comment changes
-        for change in changes:
-            field = change.get("field")
-            value = change.get("value", {})
-            logger.info(f"🔄 Feed change: field={field}, item={value.get('item','?')}, verb={value.get('verb','?')}")
-            if field == "feed":
-                await self._handle_comment(value)
+    def _collect_feed_changes(self, body: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Feed change values from every entry of a webhook payload"""
+        values = []
+        for entry in body.get("entry", []):
+            changes = entry.get("changes", [])
+            messaging = entry.get("messaging", [])
+            logger.info(f"📋 Comment entry: changes={len(changes)}, messaging={len(messaging)}")
+            for change in changes:
+                field = change.get("field")
+                value = change.get("value", {})
+                logger.info(f"🔄 Feed change: field={field}, item={value.get('item','?')}, verb={value.get('verb','?')}")
+                if field == "feed":
+                    values.append(value)
+        return values
     
     async def _handle_comment(self, value: Dict[str, Any]):
         """
@@ -171,36 +204,14 @@ class FacebookCommentWebhook:
                 logger.info(f"⏩ Not replying to intent: {intent}")
                 return
             
-            # Check rate limit
-            if not self.rate_limiter.can_reply(user_psid):
+            # Reserve the rate-limit slot now: replies are sent later by a scheduler worker,
+            # so a burst of comments must not all pass the check before any is recorded
+            if not self.rate_limiter.try_acquire(user_psid):
                 logger.warning(f"⚠️  Rate limited for user {user_psid}")
                 return
             
-            # Generate replies
-            short_reply, full_reply = self.auto_reply_engine.generate_replies(
-                user_comment=message,
-                intent=intent,
-                user_name=user_name
-            )
-            
-            # Try to send comment reply first
-            comment_replied = await self._reply_to_comment(comment_id, short_reply)
-            
-            # If comment reply failed (e.g., permission issue), send DM instead
-            dm_sent = False
-            if not comment_replied:
-                logger.info(f"💬 Comment reply failed, sending DM instead")
-                dm_sent = await self._send_dm(user_psid, full_reply)
-            elif comment_replied:
-                # If comment replied successfully, also send full details via DM
-                dm_sent = await self._send_dm(user_psid, full_reply)
-            
-            # Record rate limit if any reply was successful
-            if comment_replied or dm_sent:
-                self.rate_limiter.record_reply(user_psid)
-            
-            # Save to database
-            await self._log_to_database({
+            # Hand over to the priority scheduler: booking/pricing jump ahead of praise
+            comment = {
                 "comment_id": comment_id,
                 "post_id": post_id,
                 "user_psid": user_psid,
@@ -208,18 +219,75 @@ class FacebookCommentWebhook:
                 "message": message,
                 "intent": intent,
                 "priority": self.intent_detector.get_priority_level(priority_score),
-                "confidence": confidence,
-                "short_reply": short_reply,
-                "full_reply": full_reply,
-                "comment_replied": comment_replied,
-                "dm_sent": dm_sent
-            })
-            
-            logger.info(f"✅ Handled comment {comment_id} (replied: {comment_replied}, DM: {dm_sent})")
+                "confidence": confidence
+            }
+            accepted = await self.reply_scheduler.submit(
+                priority_score,
+                comment["priority"],
+                functools.partial(self._reply_to_classified_comment, comment)
+            )
+            if not accepted:
+                self.rate_limiter.release(user_psid)
+                logger.warning(f"⚠️  Dropped {intent} comment {comment_id} (reply queue overloaded)")
             
         except Exception as e:
             logger.error(f"❌ Error handling comment: {e}", exc_info=True)
     
+    async def _reply_to_classified_comment(self, comment: Dict[str, Any], degraded: bool = False):
+        """
+        Generate + send replies for a classified comment (runs on a scheduler worker)
+        
+        Args:
+            comment: Comment data + detected intent
+            degraded: Queue overloaded — answer from templates without calling the LLM
+        """
+        comment_id = comment["comment_id"]
+        user_psid = comment["user_psid"]
+        
+        # Generate replies
+        try:
+            if degraded:
+                short_reply, full_reply = self.auto_reply_engine.generate_template_replies(
+                    comment["intent"], comment["user_name"]
+                )
+            else:
+                # LLM call is blocking — run it off the event loop
+                short_reply, full_reply = await asyncio.to_thread(
+                    self.auto_reply_engine.generate_replies,
+                    user_comment=comment["message"],
+                    intent=comment["intent"],
+                    user_name=comment["user_name"],
+                    post_id=comment["post_id"]
+                )
+        except Exception:
+            self.rate_limiter.release(user_psid)
+            raise
+        
+        # Try to send comment reply first
+        comment_replied = await self._reply_to_comment(comment_id, short_reply)
+        
+        # DM the full details (also the fallback when the comment reply failed, e.g. permission issue)
+        dm_sent = False
+        if full_reply:
+            if not comment_replied:
+                logger.info(f"💬 Comment reply failed, sending DM instead")
+            dm_sent = await self._send_dm(user_psid, full_reply)
+        
+        # The rate-limit slot was reserved at submit — give it back if nothing reached the user
+        if not (comment_replied or dm_sent):
+            self.rate_limiter.release(user_psid)
+        
+        # Save to database
+        await asyncio.to_thread(self._log_to_database, {
+            **comment,
+            "short_reply": short_reply,
+            "full_reply": full_reply,
+            "comment_replied": comment_replied,
+            "dm_sent": dm_sent
+        })
+        
+        logger.info(f"✅ Handled comment {comment_id} (replied: {comment_replied}, DM: {dm_sent}, template: {degraded})")
+    
     async def _reply_to_comment(self, comment_id: str, message: str) -> bool:
         """
         Reply to a Facebook comment
@@ -232,7 +300,7 @@ class FacebookCommentWebhook:
             Success status
         """
         try:
-            url = f"{self.graph_api_url}/{comment_id}/comments"
+            path = f"/{comment_id}/comments"
             
             # Use POST with JSON body instead of params
             data = {
@@ -245,10 +313,10 @@ class FacebookCommentWebhook:
                 "access_token": self.page_access_token
             }
             
-            response = requests.post(url, data=data, params=params, headers=headers, timeout=10)
-            if not response.ok:
+            response = await get_graph_client().post(path, data=data, params=params, headers=headers)
+            if not response.is_success:
                 logger.error(f"❌ Reply to comment failed: {response.status_code} {response.text}")
-                logger.error(f"   URL: {url}")
+                logger.error(f"   Path: {path}")
                 logger.error(f"   Token length: {len(self.page_access_token) if self.page_access_token else 0}")
                 return False
             
@@ -271,7 +339,7 @@ class FacebookCommentWebhook:
             Success status
         """
         try:
-            url = f"{self.graph_api_url}/me/messages"
+            graph = get_graph_client()
             params = {"access_token": self.page_access_token}
             json_data = {
                 "recipient": {"id": user_psid},
@@ -282,14 +350,14 @@ class FacebookCommentWebhook:
                 "tag": "CONFIRMED_EVENT_UPDATE"
             }
             
-            response = requests.post(url, params=params, json=json_data, timeout=10)
-            if not response.ok:
+            response = await graph.post("/me/messages", params=params, json=json_data)
+            if not response.is_success:
                 logger.error(f"❌ DM failed: {response.status_code} {response.text}")
                 # Fallback: try RESPONSE type (works if user messaged page within 24h)
                 json_data["messaging_type"] = "RESPONSE"
                 del json_data["tag"]
-                response2 = requests.post(url, params=params, json=json_data, timeout=10)
-                if not response2.ok:
+                response2 = await graph.post("/me/messages", params=params, json=json_data)
+                if not response2.is_success:
                     logger.error(f"❌ DM fallback also failed: {response2.status_code} {response2.text}")
                     return False
             
@@ -337,7 +405,7 @@ class FacebookCommentWebhook:
             logger.error(f"❌ HMAC mismatch: expected={expected_signature[:20]}..., got={signature[:20]}...")
         return is_valid
     
-    async def _log_to_database(self, data: Dict[str, Any]):
+    def _log_to_database(self, data: Dict[str, Any]):
         """
         Log comment handling to database
         
@@ -386,5 +454,12 @@ class FacebookCommentWebhook:
             logger.error(f"❌ Error logging to database: {e}")
 
 
-# Global instance
-facebook_comment_webhook = FacebookCommentWebhook()
+# Global instance (created on first use, not at import)
+_facebook_comment_webhook = None
+
+def get_facebook_comment_webhook() -> FacebookCommentWebhook:
+    """Get Facebook Comment Webhook singleton"""
+    global _facebook_comment_webhook
+    if _facebook_comment_webhook is None:
+        _facebook_comment_webhook = FacebookCommentWebhook()
+    return _facebook_comment_webhook
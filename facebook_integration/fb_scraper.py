@@ -5,11 +5,15 @@ Facebook Page Scraper Module
 
 import os
 import json
-import requests
+import sys
 from datetime import datetime, timedelta
 from typing import List, Dict, Any, Optional
 from pathlib import Path
 
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from core.graph_client import get_graph_client
+
 
 class FacebookPageScraper:
     """Class สำหรับดึงข้อมูลจาก Facebook Page"""
@@ -42,38 +46,87 @@ class FacebookPageScraper:
         
         try:
             # API endpoint สำหรับดึงโพสต์
-            url = f"{self.base_url}/{self.page_id}/posts"
+            path = f"/{self.page_id}/posts"
             
             params = {
                 "access_token": self.access_token,
-                "fields": "id,message,created_time,full_picture,permalink_url,attachments{media,url}",
+                "fields": "id,message,created_time,updated_time,full_picture,permalink_url,attachments{media,url}",
                 "limit": limit
             }
             
-            response = requests.get(url, params=params)
+            response = get_graph_client().request_sync("GET", path, params=params)
             response.raise_for_status()
             
             data = response.json()
             posts = data.get("data", [])
             
             # ปรับโครงสร้างข้อมูล
-            formatted_posts = []
-            for post in posts:
-                formatted_posts.append({
-                    "id": post.get("id", ""),
-                    "message": post.get("message", ""),
-                    "created_time": post.get("created_time", ""),
-                    "image_url": post.get("full_picture", ""),
-                    "post_url": post.get("permalink_url", ""),
-                    "type": self._detect_post_type(post.get("message", ""))
-                })
-            
-            return formatted_posts
+            return [self._format_post(post) for post in posts]
             
         except Exception as e:
             print(f"[ERROR] Error fetching posts: {e}")
             return self._get_demo_posts()
     
+    def fetch_posts_page(
+        self,
+        since: Optional[int] = None,
+        after: Optional[str] = None,
+        etag: Optional[str] = None,
+        limit: int = 25
+    ) -> Dict[str, Any]:
+        """
+        ดึงโพสต์ 1 หน้า สำหรับ incremental sync (ใช้ since= / paging cursor / ETag)
+        
+        Args:
+            since: Unix timestamp — ดึงเฉพาะโพสต์ที่ใหม่กว่านี้
+            after: Paging cursor ของหน้าถัดไป
+            etag: ETag ของ response ก่อนหน้า (If-None-Match)
+            limit: จำนวนโพสต์ต่อหน้า
+            
+        Returns:
+            Dict: {"posts", "next_cursor", "etag", "not_modified"}
+        
+        Raises:
+            httpx.HTTPStatusError: Graph API error (caller keeps its cursor and retries later)
+        """
+        params = {
+            "access_token": self.access_token,
+            "fields": "id,message,created_time,updated_time,full_picture,permalink_url",
+            "limit": limit
+        }
+        if since:
+            params["since"] = since
+        if after:
+            params["after"] = after
+        headers = {"If-None-Match": etag} if etag else None
+        
+        response = get_graph_client().request_sync("GET", f"/{self.page_id}/posts", params=params, headers=headers)
+        if response.status_code == 304:
+            return {"posts": [], "next_cursor": None, "etag": etag, "not_modified": True}
+        response.raise_for_status()
+        
+        data = response.json()
+        paging = data.get("paging", {})
+        return {
+            "posts": [self._format_post(post) for post in data.get("data", [])],
+            # Only follow the cursor when Graph says there is a next page
+            "next_cursor": paging.get("cursors", {}).get("after") if paging.get("next") else None,
+            "etag": response.headers.get("ETag"),
+            "not_modified": False
+        }
+    
+    def _format_post(self, post: Dict[str, Any]) -> Dict[str, Any]:
+        """แปลงโพสต์จาก Graph API เป็นโครงสร้างที่ระบบใช้"""
+        return {
+            "id": post.get("id", ""),
+            "message": post.get("message", ""),
+            "created_time": post.get("created_time", ""),
+            "updated_time": post.get("updated_time", post.get("created_time", "")),
+            "image_url": post.get("full_picture", ""),
+            "post_url": post.get("permalink_url", ""),
+            "type": self._detect_post_type(post.get("message", ""))
+        }
+    
     def get_promotions(self) -> List[Dict[str, Any]]:
         """
         ดึงเฉพาะโพสต์ที่เป็นโปรโมชั่น
@@ -81,8 +134,18 @@ class FacebookPageScraper:
         Returns:
             List[Dict]: รายการโปรโมชั่น
         """
-        posts = self.get_latest_posts(limit=20)
+        return self.filter_promotions(self.get_latest_posts(limit=20))
+    
+    def filter_promotions(self, posts: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        กรองเฉพาะโพสต์ที่เป็นโปรโมชั่น
         
+        Args:
+            posts: รายการโพสต์
+            
+        Returns:
+            List[Dict]: รายการโปรโมชั่น
+        """
         # กรองเฉพาะโพสต์ที่เป็นโปรโมชั่น
         promotions = []
         promo_keywords = [
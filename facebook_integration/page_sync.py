@@ -0,0 +1,339 @@
+"""
+Incremental Facebook Page Sync
+ซิงก์โพสต์จาก Facebook Page แบบ incremental ภายในแอป (asyncio task)
+
+- เก็บ updated_time ล่าสุด + paging cursor + ETag ไว้ใน data/fb_sync_state.json
+- ดึงเฉพาะส่วนที่เปลี่ยน (since=) และตามหน้าถัดไปด้วย cursor
+- Graph กรอง since= ด้วย created_time: โพสต์เก่าที่ถูกแก้ไขทีหลังจะไม่กลับมาใน delta walk
+  จึงเดินแบบเต็ม (ไม่มี since=) ทุก FB_SYNC_FULL_INTERVAL ชั่วโมง (ค่าเริ่มต้น 24)
+- เทียบ hash ของแต่ละโพสต์ — push เฉพาะโพสต์ที่เปลี่ยนเข้า retrieval index
+  (AIService.upsert_documents / SeoulholicRAG.update_from_facebook) ไม่ reload ทั้งหมด
+- โพสต์ที่เปลี่ยนถูกจดไว้ใน pending_ids (persist) จนกว่า RAG update จะสำเร็จ
+  ไม่หายแม้ walk ล้มกลางทางหรือ apply ล้มแล้วค่อย re-apply รอบหลัง
+- รอบการซิงก์มี jitter กันหลาย instance ยิง Graph API พร้อมกัน
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import logging
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from facebook_integration.fb_scraper import FacebookPageScraper, format_posts_for_chatbot
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = Path(__file__).resolve().parents[1] / "data"
+PROMOTIONS_SOURCE = "FacebookPromotions"
+
+
+def _parse_fb_time(value: str) -> int:
+    """Graph API time ('2026-01-15T10:00:00+0000') -> unix timestamp"""
+    try:
+        return int(datetime.strptime(value, "%Y-%m-%dT%H:%M:%S%z").timestamp())
+    except (TypeError, ValueError):
+        try:
+            return int(datetime.fromisoformat(value).timestamp())
+        except (TypeError, ValueError):
+            return 0
+
+
+def _post_hash(post: Dict[str, Any]) -> str:
+    return hashlib.sha1(
+        f"{post.get('message', '')}|{post.get('image_url', '')}|{post.get('post_url', '')}".encode("utf-8")
+    ).hexdigest()
+
+
+class PageSyncEngine:
+    """Delta sync of page posts into the chatbot's knowledge"""
+
+    def __init__(
+        self,
+        scraper: FacebookPageScraper = None,
+        interval_minutes: float = None,
+        state_path: Path = None
+    ):
+        """
+        Initialize sync engine
+
+        Args:
+            scraper: Graph API page scraper
+            interval_minutes: Minutes between syncs (FB_UPDATE_INTERVAL)
+            state_path: Where cursors / post hashes are persisted
+        """
+        self.scraper = scraper or FacebookPageScraper()
+        self.interval = (interval_minutes or float(os.getenv("FB_UPDATE_INTERVAL", 60))) * 60
+        self.jitter = float(os.getenv("FB_SYNC_JITTER", 0.2))
+        self.max_pages = int(os.getenv("FB_SYNC_MAX_PAGES", 10))
+        self.max_posts = int(os.getenv("FB_SYNC_MAX_POSTS", 100))
+        self.full_sync_interval = float(os.getenv("FB_SYNC_FULL_INTERVAL", 24)) * 3600
+        self.state_path = state_path or DATA_DIR / "fb_sync_state.json"
+
+        self.state = self._load_state()
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+        self.stats = {
+            "syncs": 0,
+            "failures": 0,
+            "pages_fetched": 0,
+            "not_modified": 0,
+            "posts_changed": 0,
+            "documents_upserted": 0,
+            "full_walks": 0,
+            "rag_posts_pushed": 0,
+            "last_sync_at": None,
+            "last_duration_ms": 0.0
+        }
+
+    # ------------------------------------------------------------------
+    # State
+    # ------------------------------------------------------------------
+
+    def _load_state(self) -> Dict[str, Any]:
+        empty = {
+            "last_updated_time": 0, "last_full_sync": 0, "cursor": None, "cursor_since": None,
+            "etag": None, "dirty": False, "posts": {}, "pending_ids": []
+        }
+        try:
+            if self.state_path.exists():
+                with open(self.state_path, "r", encoding="utf-8") as f:
+                    return {**empty, **json.load(f)}
+        except Exception as e:
+            logger.warning(f"⚠️  Could not read page sync state, starting fresh: {e}")
+        return empty
+
+    def _save_state(self):
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.state_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    # ------------------------------------------------------------------
+    # Sync
+    # ------------------------------------------------------------------
+
+    def sync_once(self) -> List[Dict[str, Any]]:
+        """
+        Fetch posts changed since the last sync and push them into the knowledge base
+        (blocking — run in a worker thread)
+
+        Returns:
+            Posts that were new or changed
+        """
+        if not self.scraper.access_token:
+            return []
+
+        with self._lock:
+            started = time.perf_counter()
+            try:
+                changed = self._fetch_changes()
+                # "dirty": an earlier walk stored changes but failed before applying them
+                if changed or self.state.get("dirty"):
+                    self._apply()
+                    self.state["dirty"] = False
+                    self._save_state()
+                if self.state["pending_ids"] and self._push_to_rag():
+                    self._save_state()
+                self.stats["syncs"] += 1
+                self.stats["posts_changed"] += len(changed)
+                self.stats["last_sync_at"] = datetime.now().isoformat()
+                if changed:
+                    logger.info(f"📥 Page sync: {len(changed)} new/updated post(s)")
+                return changed
+            except Exception as e:
+                self.stats["failures"] += 1
+                logger.error(f"❌ Page sync failed (will resume from saved cursor): {e}")
+                return []
+            finally:
+                self.stats["last_duration_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+    def _fetch_changes(self) -> List[Dict[str, Any]]:
+        state = self.state
+        known = state["posts"]
+        cursor = state.get("cursor")
+        if cursor:
+            # Resume an interrupted walk with the query its cursor belongs to
+            since = state.get("cursor_since")
+        elif time.time() - state["last_full_sync"] >= self.full_sync_interval:
+            # since= filters on created_time: a full walk picks up edits to older posts
+            since = None
+        else:
+            # One second of overlap: posts on the boundary are filtered by hash below
+            since = max(state["last_updated_time"] - 1, 0) or None
+        full_walk = since is None
+        pending = set(state["pending_ids"])
+        changed = []
+
+        for _ in range(self.max_pages):
+            # ETag only applies to the first page of a delta walk
+            page = self.scraper.fetch_posts_page(
+                since=since,
+                after=cursor,
+                etag=None if cursor or full_walk else state.get("etag")
+            )
+            self.stats["pages_fetched"] += 1
+            if page["not_modified"]:
+                self.stats["not_modified"] += 1
+                break
+            if not cursor:
+                state["etag"] = page["etag"]
+
+            for post in page["posts"]:
+                digest = _post_hash(post)
+                if known.get(post["id"], {}).get("hash") != digest:
+                    changed.append(post)
+                    known[post["id"]] = {**post, "hash": digest}
+                    pending.add(post["id"])
+                    state["pending_ids"] = sorted(pending)
+                    state["dirty"] = True
+                state["last_updated_time"] = max(state["last_updated_time"], _parse_fb_time(post["updated_time"]))
+
+            cursor = page["next_cursor"]
+            # Persist progress so an interrupted walk resumes from this page
+            state["cursor"] = cursor
+            state["cursor_since"] = since if cursor else None
+            self._save_state()
+            if not cursor:
+                if full_walk:
+                    state["last_full_sync"] = time.time()
+                    self.stats["full_walks"] += 1
+                    self._save_state()
+                break
+
+        if len(known) > self.max_posts:
+            newest = sorted(known.values(), key=lambda p: p.get("created_time", ""), reverse=True)
+            state["posts"] = {p["id"]: p for p in newest[:self.max_posts]}
+            state["pending_ids"] = [post_id for post_id in state["pending_ids"] if post_id in state["posts"]]
+            self._save_state()
+        return changed
+
+    def _apply(self):
+        """Write the derived files and re-embed the promotions document"""
+        posts = sorted(
+            ({k: v for k, v in p.items() if k != "hash"} for p in self.state["posts"].values()),
+            key=lambda p: p.get("created_time", ""),
+            reverse=True
+        )
+        promotions = self.scraper.filter_promotions(posts)
+        self.scraper.save_to_file(posts, "fb_posts.json")
+        self.scraper.save_to_file(promotions, "fb_promotions.json")
+
+        promotions_text = format_posts_for_chatbot(promotions)
+        text_dir = DATA_DIR / "text"
+        text_dir.mkdir(parents=True, exist_ok=True)
+        with open(text_dir / f"{PROMOTIONS_SOURCE}.txt", "w", encoding="utf-8") as f:
+            f.write(promotions_text)
+
+        # Retrieval indexes living in this process: only the changed documents are updated
+        # (standalone runs don't load them — the app picks up the files on start)
+        ai_module = sys.modules.get("core.ai_service")
+        ai_service = getattr(getattr(ai_module, "AIService", None), "_instance", None)
+        if ai_service is not None and getattr(ai_service, "initialized", False):
+            try:
+                # Only the promotions document is re-embedded
+                self.stats["documents_upserted"] += ai_service.upsert_documents(
+                    [{"source": PROMOTIONS_SOURCE, "content": promotions_text}]
+                )
+            except Exception as e:
+                logger.warning(f"⚠️  Could not update AI knowledge base: {e}")
+
+    def _push_to_rag(self) -> bool:
+        """
+        Push every pending post into SeoulholicRAG (if loaded in this process)
+
+        Returns:
+            True when the pending set was cleared
+        """
+        rag_module = sys.modules.get("core.rag_service")
+        rag = getattr(rag_module, "_rag_instance", None)
+        if rag is None:
+            return False
+        pending = set(self.state["pending_ids"])
+        posts = [
+            {k: v for k, v in p.items() if k != "hash"}
+            for post_id, p in self.state["posts"].items() if post_id in pending
+        ]
+        try:
+            rag.update_from_facebook(posts)
+        except Exception as e:
+            logger.warning(f"⚠️  Could not update RAG index (will retry next sync): {e}")
+            return False
+        self.stats["rag_posts_pushed"] += len(posts)
+        self.state["pending_ids"] = []
+        return True
+
+    # ------------------------------------------------------------------
+    # Scheduling
+    # ------------------------------------------------------------------
+
+    def next_delay(self) -> float:
+        """Sync interval with ±jitter"""
+        return self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    async def run(self, initial_delay: float = 0):
+        """Sync forever on the current event loop"""
+        if initial_delay:
+            await asyncio.sleep(initial_delay)
+        while True:
+            await asyncio.to_thread(self.sync_once)
+            await asyncio.sleep(self.next_delay())
+
+    def start(self) -> Optional[asyncio.Task]:
+        """Start the background sync task (no-op without FB_ACCESS_TOKEN)"""
+        if not self.scraper.access_token:
+            logger.info("⏩ Page sync disabled (FB_ACCESS_TOKEN not set)")
+            return None
+        if self._task is None or self._task.done():
+            # Spread the first sync too, so restarts don't all hit Graph at once
+            self._task = asyncio.get_running_loop().create_task(
+                self.run(initial_delay=random.uniform(0, min(self.interval, 60)))
+            )
+            logger.info(f"🔄 Page sync started (every ~{self.interval / 60:.0f} min)")
+        return self._task
+
+    async def stop(self):
+        """Cancel the background sync task"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Sync statistics"""
+        return {
+            **self.stats,
+            "running": self._task is not None and not self._task.done(),
+            "interval_seconds": self.interval,
+            "known_posts": len(self.state["posts"]),
+            "last_updated_time": self.state["last_updated_time"],
+            "resuming_cursor": bool(self.state.get("cursor")),
+            "pending_rag_posts": len(self.state["pending_ids"])
+        }
+
+
+# Singleton
+_page_sync_engine: Optional[PageSyncEngine] = None
+_page_sync_lock = threading.Lock()
+
+def get_page_sync_engine() -> PageSyncEngine:
+    """Get page sync engine singleton"""
+    global _page_sync_engine
+    if _page_sync_engine is None:
+        with _page_sync_lock:
+            if _page_sync_engine is None:
+                _page_sync_engine = PageSyncEngine()
+    return _page_sync_engine
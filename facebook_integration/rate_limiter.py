@@ -1,146 +1,441 @@
 """
 Rate Limiter - Prevent spam by limiting replies per user
+
+Sliding window แบบ bucket (ค่าเริ่มต้น 24 bucket × 1 ชั่วโมง):
+- In-memory: ตัวนับขนาดคงที่ต่อ user (array 24 ช่อง) — check/record เป็น O(1), stats อัปเดตทีละน้อย
+- Redis (optional): Lua script แบบ atomic ใช้ร่วมกันได้หลาย worker
+ใช้ได้ทั้ง auto-reply คอมเมนต์ Facebook และ LLM budget ต่อ user ของ LINE
 """
 
+import os
+import threading
 import time
-from typing import Dict, Optional
-from datetime import datetime, timedelta
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
 import logging
-import os
 
 logger = logging.getLogger(__name__)
 
 
+@dataclass(slots=True)
+class _Ring:
+    """Fixed-size ring of per-bucket counts with a running total"""
+    buckets: array
+    epoch: int = 0
+    total: int = 0
+
+    @classmethod
+    def create(cls, size: int, typecode: str = 'I') -> "_Ring":
+        return cls(array(typecode, bytes(array(typecode).itemsize * size)))
+
+    def advance(self, epoch: int):
+        """Expire buckets that fell out of the window (at most len(buckets) steps)"""
+        if epoch <= self.epoch:
+            return
+        size = len(self.buckets)
+        if epoch - self.epoch >= size:
+            for i in range(size):
+                self.buckets[i] = 0
+            self.total = 0
+        else:
+            for e in range(self.epoch + 1, epoch + 1):
+                i = e % size
+                self.total -= self.buckets[i]
+                self.buckets[i] = 0
+        self.epoch = epoch
+
+    def add(self, epoch: int, delta: int = 1):
+        self.advance(epoch)
+        self.buckets[epoch % len(self.buckets)] += delta
+        self.total += delta
+
+    def remove(self, epoch: int, delta: int = 1):
+        """Undo an earlier add() if that bucket is still inside the window"""
+        if self.epoch - len(self.buckets) < epoch <= self.epoch:
+            self.buckets[epoch % len(self.buckets)] -= delta
+            self.total -= delta
+
+
+@dataclass(slots=True)
+class _UserCounter:
+    ring: _Ring
+    last_hit: int = 0
+
+
+class MemoryRateLimitBackend:
+    """Per-process bucketed counters (bounded memory, O(1) per operation)"""
+
+    name = "memory"
+
+    def __init__(self, bucket_seconds: int, buckets: int, max_keys: int):
+        self.bucket_seconds = bucket_seconds
+        self.buckets = buckets
+        self.max_keys = max_keys
+
+        # key -> counter, ordered by last hit (stale keys sit at the front)
+        self._counters: "OrderedDict[str, _UserCounter]" = OrderedDict()
+        # Window totals maintained incrementally for stats
+        self._hits = _Ring.create(buckets, 'q')
+        self._active = _Ring.create(buckets, 'q')  # users by bucket of their last hit
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    def _epoch(self) -> int:
+        return int(time.time() // self.bucket_seconds)
+
+    def count(self, key: str) -> int:
+        epoch = self._epoch()
+        with self._lock:
+            counter = self._counters.get(key)
+            if counter is None:
+                return 0
+            counter.ring.advance(epoch)
+            return counter.ring.total
+
+    def hit(self, key: str, limit: int = 0) -> Tuple[bool, int]:
+        """Record one hit unless `limit` (>0) is already reached. Returns (allowed, count)"""
+        epoch = self._epoch()
+        with self._lock:
+            counter = self._counters.get(key)
+            if counter is None:
+                counter = _UserCounter(_Ring.create(self.buckets, 'I'))
+                counter.ring.epoch = epoch
+                self._counters[key] = counter
+            counter.ring.advance(epoch)
+            if limit and counter.ring.total >= limit:
+                return False, counter.ring.total
+
+            counter.ring.add(epoch)
+            self._hits.add(epoch)
+            # Move the user from the bucket of their previous hit to this one
+            self._active.advance(epoch)
+            self._active.remove(counter.last_hit)
+            self._active.add(epoch)
+            counter.last_hit = epoch
+            self._counters.move_to_end(key)
+            self._purge(epoch)
+            return True, counter.ring.total
+
+    def release(self, key: str) -> bool:
+        """Undo the most recent hit still inside the window (False if there was none)"""
+        epoch = self._epoch()
+        with self._lock:
+            counter = self._counters.get(key)
+            if counter is None:
+                return False
+            counter.ring.advance(epoch)
+            for hit_epoch in range(epoch, epoch - self.buckets, -1):
+                if counter.ring.buckets[hit_epoch % self.buckets]:
+                    counter.ring.remove(hit_epoch)
+                    self._hits.advance(epoch)
+                    self._hits.remove(hit_epoch)
+                    return True
+            return False
+
+    def reset(self, key: str):
+        with self._lock:
+            counter = self._counters.pop(key, None)
+            if counter is not None:
+                self._active.advance(self._epoch())
+                self._active.remove(counter.last_hit)
+
+    def _purge(self, epoch: int):
+        """Drop users with no hits left in the window, then enforce max_keys"""
+        oldest = epoch - self.buckets
+        while self._counters:
+            key, counter = next(iter(self._counters.items()))
+            if counter.last_hit > oldest and len(self._counters) <= self.max_keys:
+                break
+            self._counters.popitem(last=False)
+            if counter.last_hit > oldest:
+                self.evicted += 1
+                self._active.remove(counter.last_hit)
+
+    def get_stats(self) -> Dict[str, int]:
+        epoch = self._epoch()
+        with self._lock:
+            self._hits.advance(epoch)
+            self._active.advance(epoch)
+            return {
+                "tracked_keys": len(self._counters),
+                "active_keys": self._active.total,
+                "hits_in_window": self._hits.total,
+                "evicted_keys": self.evicted
+            }
+
+
+# KEYS: user hash, window hits hash, active-users HLL for this bucket
+# ARGV: epoch, buckets, limit (0 = none), ttl, user key
+_HIT_SCRIPT = """
+local epoch = tonumber(ARGV[1])
+local oldest = epoch - tonumber(ARGV[2]) + 1
+local limit = tonumber(ARGV[3])
+local data = redis.call('HGETALL', KEYS[1])
+local total = 0
+for i = 1, #data, 2 do
+  if tonumber(data[i]) < oldest then
+    redis.call('HDEL', KEYS[1], data[i])
+  else
+    total = total + tonumber(data[i + 1])
+  end
+end
+if limit > 0 and total >= limit then
+  return {0, total}
+end
+redis.call('HINCRBY', KEYS[1], ARGV[1], 1)
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('HINCRBY', KEYS[2], ARGV[1], 1)
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+redis.call('PFADD', KEYS[3], ARGV[5])
+redis.call('EXPIRE', KEYS[3], ARGV[4])
+return {1, total + 1}
+"""
+
+# KEYS: user hash / ARGV: epoch, buckets
+_COUNT_SCRIPT = """
+local oldest = tonumber(ARGV[1]) - tonumber(ARGV[2]) + 1
+local data = redis.call('HGETALL', KEYS[1])
+local total = 0
+for i = 1, #data, 2 do
+  if tonumber(data[i]) >= oldest then
+    total = total + tonumber(data[i + 1])
+  end
+end
+return total
+"""
+
+
+# KEYS: user hash, window hits hash / ARGV: epoch, buckets
+_RELEASE_SCRIPT = """
+local oldest = tonumber(ARGV[1]) - tonumber(ARGV[2]) + 1
+local data = redis.call('HGETALL', KEYS[1])
+local latest = nil
+for i = 1, #data, 2 do
+  local e = tonumber(data[i])
+  if e >= oldest and tonumber(data[i + 1]) > 0 and (latest == nil or e > latest) then
+    latest = e
+  end
+end
+if latest == nil then
+  return 0
+end
+redis.call('HINCRBY', KEYS[1], latest, -1)
+redis.call('HINCRBY', KEYS[2], latest, -1)
+return 1
+"""
+
+
+class RedisRateLimitBackend:
+    """Shared counters for multi-worker deployments (one hash of ≤ `buckets` fields per user)"""
+
+    name = "redis"
+
+    def __init__(self, redis_client, namespace: str, bucket_seconds: int, buckets: int):
+        self.redis_client = redis_client
+        self.prefix = f"ratelimit:{namespace}"
+        self.bucket_seconds = bucket_seconds
+        self.buckets = buckets
+        self.ttl = bucket_seconds * buckets
+        self._hit = redis_client.register_script(_HIT_SCRIPT)
+        self._count = redis_client.register_script(_COUNT_SCRIPT)
+        self._release = redis_client.register_script(_RELEASE_SCRIPT)
+
+    def _epoch(self) -> int:
+        return int(time.time() // self.bucket_seconds)
+
+    def count(self, key: str) -> int:
+        return int(self._count(keys=[f"{self.prefix}:user:{key}"], args=[self._epoch(), self.buckets]))
+
+    def hit(self, key: str, limit: int = 0) -> Tuple[bool, int]:
+        epoch = self._epoch()
+        allowed, total = self._hit(
+            keys=[f"{self.prefix}:user:{key}", f"{self.prefix}:hits", f"{self.prefix}:active:{epoch}"],
+            args=[epoch, self.buckets, limit, self.ttl, key]
+        )
+        return bool(allowed), int(total)
+
+    def release(self, key: str) -> bool:
+        released = self._release(keys=[f"{self.prefix}:user:{key}", f"{self.prefix}:hits"], args=[self._epoch(), self.buckets])
+        return bool(int(released))
+
+    def reset(self, key: str):
+        self.redis_client.delete(f"{self.prefix}:user:{key}")
+
+    def get_stats(self) -> Dict[str, int]:
+        epoch = self._epoch()
+        epochs = [str(e) for e in range(epoch - self.buckets + 1, epoch + 1)]
+        hits = self.redis_client.hmget(f"{self.prefix}:hits", epochs)
+        return {
+            "active_keys": self.redis_client.pfcount(*[f"{self.prefix}:active:{e}" for e in epochs]),
+            "hits_in_window": sum(int(h) for h in hits if h)
+        }
+
+
 class RateLimiter:
     """
     Rate limiter to prevent spam
-    Limits: X replies per user per day
+    Limits: X replies per user per window (default: per day, hourly buckets)
     """
-    
-    def __init__(self, limit_per_day: int = None):
+
+    def __init__(
+        self,
+        limit_per_day: int = None,
+        name: str = "facebook_comment",
+        window_seconds: int = 24 * 3600,
+        buckets: int = 24,
+        use_redis: bool = True
+    ):
         """
         Initialize Rate Limiter
-        
+
         Args:
-            limit_per_day: Max replies per user per day (default from ENV)
+            limit_per_day: Max replies per user per window (default from ENV)
+            name: Namespace (separate limits share one Redis without clashing)
+            window_seconds: Sliding window length
+            buckets: Window resolution (window_seconds / buckets per bucket)
+            use_redis: Use Redis if available (shared across workers)
         """
         self.limit_per_day = limit_per_day or int(os.getenv('RATE_LIMIT_PER_USER_PER_DAY', 3))
-        self.reply_counts: Dict[str, list] = {}  # {user_id: [timestamp1, timestamp2, ...]}
-        self.cleanup_interval = 3600  # Clean up every hour
-        self.last_cleanup = time.time()
-        
-        logger.info(f"🚦 Rate Limiter initialized (limit: {self.limit_per_day}/day)")
-    
+        self.name = name
+        bucket_seconds = max(1, window_seconds // buckets)
+
+        self.backend = None
+        if use_redis and os.getenv('RATE_LIMIT_REDIS', 'true').lower() == 'true':
+            try:
+                import redis
+                client = redis.Redis(
+                    host=os.getenv('REDIS_HOST', 'localhost'),
+                    port=int(os.getenv('REDIS_PORT', 6379)),
+                    db=int(os.getenv('REDIS_DB', 0)),
+                    decode_responses=True,
+                    socket_timeout=1,
+                    socket_connect_timeout=1
+                )
+                client.ping()
+                self.backend = RedisRateLimitBackend(client, name, bucket_seconds, buckets)
+            except Exception as e:
+                logger.warning(f"⚠️  Rate limiter Redis not available: {e}. Using in-memory counters.")
+
+        # In-memory counters are also the fallback when Redis errors at runtime
+        self.memory = MemoryRateLimitBackend(
+            bucket_seconds, buckets, max_keys=int(os.getenv('RATE_LIMIT_MAX_USERS', 100000))
+        )
+        if self.backend is None:
+            self.backend = self.memory
+
+        self.stats = {"allowed": 0, "limited": 0, "redis_errors": 0}
+
+        logger.info(f"🚦 Rate Limiter '{name}' initialized (limit: {self.limit_per_day}/{window_seconds}s, backend={self.backend.name})")
+
+    def _call(self, method: str, *args):
+        try:
+            return getattr(self.backend, method)(*args)
+        except Exception as e:
+            if self.backend is self.memory:
+                raise
+            self.stats["redis_errors"] += 1
+            logger.warning(f"⚠️  Rate limiter Redis error: {e}. Falling back to memory.")
+            return getattr(self.memory, method)(*args)
+
     def can_reply(self, user_id: str) -> bool:
         """
         Check if we can reply to this user
-        
+
         Args:
             user_id: Platform-specific user ID
-            
+
         Returns:
             True if allowed, False if rate limited
         """
-        # Cleanup old entries
-        self._cleanup_if_needed()
-        
-        # Get user's reply history
-        if user_id not in self.reply_counts:
-            return True
-        
-        # Remove timestamps older than 24 hours
-        cutoff = time.time() - (24 * 3600)
-        recent_replies = [ts for ts in self.reply_counts[user_id] if ts > cutoff]
-        self.reply_counts[user_id] = recent_replies
-        
-        # Check limit
-        if len(recent_replies) >= self.limit_per_day:
-            logger.warning(f"⚠️  Rate limit exceeded for user {user_id} ({len(recent_replies)}/{self.limit_per_day})")
+        count = self._call("count", user_id)
+        if count >= self.limit_per_day:
+            self.stats["limited"] += 1
+            logger.warning(f"⚠️  Rate limit exceeded for user {user_id} ({count}/{self.limit_per_day})")
             return False
-        
+
         return True
-    
+
     def record_reply(self, user_id: str):
         """
         Record that we replied to this user
-        
+
         Args:
             user_id: Platform-specific user ID
         """
-        if user_id not in self.reply_counts:
-            self.reply_counts[user_id] = []
-        
-        self.reply_counts[user_id].append(time.time())
-        logger.info(f"✅ Reply recorded for {user_id} ({len(self.reply_counts[user_id])}/{self.limit_per_day} today)")
-    
+        _, count = self._call("hit", user_id, 0)
+        self.stats["allowed"] += 1
+        logger.info(f"✅ Reply recorded for {user_id} ({count}/{self.limit_per_day} today)")
+
+    def try_acquire(self, user_id: str) -> bool:
+        """
+        Atomic check-and-record (use when the action is counted up front, e.g. an LLM call)
+
+        Returns:
+            True if allowed (and recorded), False if rate limited
+        """
+        allowed, count = self._call("hit", user_id, self.limit_per_day)
+        if allowed:
+            self.stats["allowed"] += 1
+        else:
+            self.stats["limited"] += 1
+            logger.warning(f"⚠️  Rate limit '{self.name}' exceeded for user {user_id} ({count}/{self.limit_per_day})")
+        return allowed
+
+    def release(self, user_id: str) -> bool:
+        """
+        Give back a slot taken by try_acquire() when the action did not happen
+        (e.g. the queued reply was dropped or could not be sent)
+
+        Returns:
+            True if a hit was given back (False if none is left in the window)
+        """
+        released = self._call("release", user_id)
+        if released:
+            self.stats["allowed"] -= 1
+        return released
+
     def get_remaining_replies(self, user_id: str) -> int:
         """
         Get remaining replies for user today
-        
+
         Args:
             user_id: Platform-specific user ID
-            
+
         Returns:
             Number of remaining replies
         """
-        if user_id not in self.reply_counts:
-            return self.limit_per_day
-        
-        # Count recent replies (last 24h)
-        cutoff = time.time() - (24 * 3600)
-        recent_count = sum(1 for ts in self.reply_counts[user_id] if ts > cutoff)
-        
-        return max(0, self.limit_per_day - recent_count)
-    
+        return max(0, self.limit_per_day - self._call("count", user_id))
+
     def reset_user(self, user_id: str):
         """Reset rate limit for specific user"""
-        if user_id in self.reply_counts:
-            del self.reply_counts[user_id]
-            logger.info(f"Rate limit reset for {user_id}")
-    
-    def _cleanup_if_needed(self):
-        """Clean up old entries periodically"""
-        if time.time() - self.last_cleanup < self.cleanup_interval:
-            return
-        
-        cutoff = time.time() - (24 * 3600)
-        total_before = len(self.reply_counts)
-        
-        # Remove expired entries
-        self.reply_counts = {
-            uid: [ts for ts in timestamps if ts > cutoff]
-            for uid, timestamps in self.reply_counts.items()
-            if any(ts > cutoff for ts in timestamps)
-        }
-        
-        total_after = len(self.reply_counts)
-        if total_before != total_after:
-            logger.info(f"🧹 Cleaned up rate limiter: {total_before} → {total_after} users")
-        
-        self.last_cleanup = time.time()
-    
+        self._call("reset", user_id)
+        logger.info(f"Rate limit reset for {user_id}")
+
     def get_stats(self) -> Dict:
-        """Get rate limiter statistics"""
-        total_users = len(self.reply_counts)
-        cutoff = time.time() - (24 * 3600)
-        
-        active_users = sum(
-            1 for timestamps in self.reply_counts.values()
-            if any(ts > cutoff for ts in timestamps)
-        )
-        
-        total_replies_24h = sum(
-            sum(1 for ts in timestamps if ts > cutoff)
-            for timestamps in self.reply_counts.values()
-        )
-        
+        """Get rate limiter statistics (maintained incrementally — no per-user scan)"""
+        backend_stats = self._call("get_stats")
         return {
+            "name": self.name,
+            "backend": self.backend.name,
             "limit_per_day": self.limit_per_day,
-            "total_users_tracked": total_users,
-            "active_users_24h": active_users,
-            "total_replies_24h": total_replies_24h
+            "total_users_tracked": backend_stats.get("tracked_keys"),
+            "active_users_24h": backend_stats["active_keys"],
+            "total_replies_24h": backend_stats["hits_in_window"],
+            **self.stats
         }
 
 
-# Global instance
-rate_limiter = RateLimiter()
+# Singleton (shared by the comment webhook and /api/stats)
+_rate_limiter: Optional[RateLimiter] = None
+_rate_limiter_lock = threading.Lock()
+
+def get_rate_limiter() -> RateLimiter:
+    """Get Facebook comment reply rate limiter singleton"""
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _rate_limiter_lock:
+            if _rate_limiter is None:
+                _rate_limiter = RateLimiter()
+    return _rate_limiter
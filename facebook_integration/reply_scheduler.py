@@ -0,0 +1,204 @@
+"""
+Priority Reply Scheduler
+คิวระหว่าง "จำแนก intent" กับ "สร้างคำตอบด้วย LLM" ของคอมเมนต์ Facebook
+
+- เรียงตาม priority score ของ intent + aging (รอนานแล้วค่อยๆ ขยับขึ้น กัน starvation)
+- LLM worker pool จำกัดจำนวน (COMMENT_LLM_WORKERS)
+- Overload: งาน priority ต่ำถูก downgrade เป็น template (ไม่เรียก LLM) หรือถูก drop
+- Metrics แยกตาม priority class: depth, wait time, degraded, dropped
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# job(degraded) — degraded=True means "answer without the LLM"
+ReplyJob = Callable[[bool], Awaitable[Any]]
+
+PRIORITY_CLASSES = ("high", "medium", "low")
+
+
+@dataclass(order=True, slots=True)
+class _ScheduledReply:
+    sort_key: float
+    seq: int
+    priority_class: str = field(compare=False)
+    enqueued_at: float = field(compare=False)
+    job: ReplyJob = field(compare=False)
+
+
+class PriorityReplyScheduler:
+    """
+    Async priority queue + worker pool
+
+    Effective priority = score + aging_rate × seconds waited. Since every
+    waiting item ages at the same rate, ordering by (enqueued_at - score / aging_rate)
+    is the same ordering and never changes, so a plain heap works
+    """
+
+    def __init__(
+        self,
+        workers: int = None,
+        max_depth: int = None,
+        degrade_depth: int = None,
+        aging_per_minute: float = None
+    ):
+        """
+        Initialize scheduler
+
+        Args:
+            workers: Concurrent LLM generations
+            max_depth: Above this, low-priority work is dropped (and nothing is accepted at 2×)
+            degrade_depth: Above this, low-priority work is answered from templates
+            aging_per_minute: Priority points gained per minute of waiting
+        """
+        self.workers = workers or int(os.getenv('COMMENT_LLM_WORKERS', 4))
+        self.max_depth = max_depth or int(os.getenv('COMMENT_QUEUE_MAX_DEPTH', 500))
+        self.degrade_depth = degrade_depth or int(os.getenv('COMMENT_QUEUE_DEGRADE_DEPTH', 50))
+        aging = aging_per_minute or float(os.getenv('COMMENT_PRIORITY_AGING_PER_MINUTE', 2))
+        self.aging_per_second = aging / 60
+
+        self._heap: List[_ScheduledReply] = []
+        self._seq = itertools.count()
+        self._available: Optional[asyncio.Condition] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        self._running = 0
+
+        self.class_stats: Dict[str, Dict[str, Any]] = {
+            name: {
+                "depth": 0,
+                "submitted": 0,
+                "completed": 0,
+                "failed": 0,
+                "degraded": 0,
+                "dropped": 0,
+                "total_wait_ms": 0.0,
+                "max_wait_ms": 0.0
+            }
+            for name in PRIORITY_CLASSES
+        }
+
+        logger.info(
+            f"🎯 Reply scheduler ready (workers={self.workers}, degrade>{self.degrade_depth}, max={self.max_depth})"
+        )
+
+    @property
+    def depth(self) -> int:
+        return len(self._heap)
+
+    def _ensure_workers(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._available = asyncio.Condition()
+            self._worker_tasks = []
+        if not self._worker_tasks:
+            self._worker_tasks = [loop.create_task(self._worker(i)) for i in range(self.workers)]
+
+    async def submit(self, score: int, priority_class: str, job: ReplyJob) -> bool:
+        """
+        Queue a reply job
+
+        Args:
+            score: Intent priority score (IntentDetector.priority_scores)
+            priority_class: 'high' | 'medium' | 'low'
+            job: Coroutine function taking `degraded`
+
+        Returns:
+            False if the job was dropped because of overload
+        """
+        self._ensure_workers()
+        if priority_class not in self.class_stats:
+            priority_class = "low"
+        stats = self.class_stats[priority_class]
+
+        if self.depth >= self.max_depth * 2 or (self.depth >= self.max_depth and priority_class == "low"):
+            stats["dropped"] += 1
+            logger.warning(f"⚠️  Reply queue overloaded ({self.depth}), dropping {priority_class}-priority comment")
+            return False
+
+        now = time.monotonic()
+        item = _ScheduledReply(
+            sort_key=now - score / self.aging_per_second if self.aging_per_second else -score,
+            seq=next(self._seq),
+            priority_class=priority_class,
+            enqueued_at=now,
+            job=job
+        )
+        async with self._available:
+            heapq.heappush(self._heap, item)
+            stats["depth"] += 1
+            stats["submitted"] += 1
+            self._available.notify()
+        return True
+
+    async def _worker(self, index: int):
+        while True:
+            async with self._available:
+                while not self._heap:
+                    await self._available.wait()
+                item = heapq.heappop(self._heap)
+                # Decide with the backlog that is still waiting behind this item
+                degraded = item.priority_class == "low" and self.depth >= self.degrade_depth
+
+            stats = self.class_stats[item.priority_class]
+            stats["depth"] -= 1
+            wait_ms = (time.monotonic() - item.enqueued_at) * 1000
+            stats["total_wait_ms"] += wait_ms
+            stats["max_wait_ms"] = max(stats["max_wait_ms"], wait_ms)
+            if degraded:
+                stats["degraded"] += 1
+
+            self._running += 1
+            try:
+                await item.job(degraded)
+                stats["completed"] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                stats["failed"] += 1
+                logger.error(f"❌ Reply job failed ({item.priority_class}): {e}", exc_info=True)
+            finally:
+                self._running -= 1
+
+    async def join(self, timeout: float = None) -> bool:
+        """Wait until queued + running jobs finish, then stop workers (shutdown)"""
+        deadline = time.monotonic() + timeout if timeout else None
+        while self._heap or self._running:
+            if deadline and time.monotonic() > deadline:
+                logger.warning(f"⚠️  Reply scheduler shutdown with {self.depth} comments unanswered")
+                break
+            await asyncio.sleep(0.05)
+        drained = not self._heap and not self._running
+        for task in self._worker_tasks:
+            task.cancel()
+        self._worker_tasks = []
+        return drained
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Queue depth / wait time per priority class"""
+        classes = {}
+        for name, stats in self.class_stats.items():
+            started = stats["completed"] + stats["failed"]
+            classes[name] = {
+                **{k: v for k, v in stats.items() if k not in ("total_wait_ms", "max_wait_ms")},
+                "avg_wait_ms": round(stats["total_wait_ms"] / started, 2) if started else 0,
+                "max_wait_ms": round(stats["max_wait_ms"], 2)
+            }
+        return {
+            "depth": self.depth,
+            "running": self._running,
+            "workers": self.workers,
+            "degrade_depth": self.degrade_depth,
+            "max_depth": self.max_depth,
+            "classes": classes
+        }
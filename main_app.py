@@ -5,10 +5,11 @@ Handles webhooks from LINE, Facebook, and Admin APIs
 
 import os
 import sys
-import io
+import time
+import asyncio
 from pathlib import Path
 from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, FileResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 import logging
@@ -28,18 +29,11 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Import handlers
-from platforms.line_handler import LineHandler
-from platforms.facebook_handler import FacebookHandler
+# Platform handlers (LINE SDK, AI knowledge base, ...) are imported and
+# constructed lazily in the startup warm-up, not at module import
 from platforms.handler_registry import set_handlers
-from facebook_integration.comment_webhook import FacebookCommentWebhook
 from admin_dashboard.backend.admin_router import admin_router
 
-try:
-    from platforms.instagram_handler import InstagramHandler
-except Exception:
-    InstagramHandler = None
-
 # Initialize FastAPI
 app = FastAPI(
     title="Seoulholic Multi-Platform Chatbot",
@@ -62,114 +56,273 @@ if static_path.exists():
     app.mount("/static/img", StaticFiles(directory=str(static_path)), name="static_images")
     logger.info(f"✅ Static files mounted: {static_path}")
 
-# JPEG conversion endpoint for LINE (LINE only supports JPEG, not PNG)
-@app.get("/img-jpeg/{image_name}")
-async def serve_image_as_jpeg(image_name: str):
-    """Serve PNG images converted to JPEG — required by LINE Messaging API"""
+# JPEG variants for LINE (LINE only supports JPEG, not PNG)
+# Variants are rendered once (startup or first request) and served from disk cache
+IMAGE_CACHE_CONTROL = "public, max-age=86400"
+
+
+async def _serve_image_variant(request: Request, image_name: str, variant: str):
+    """Serve a pre-rendered JPEG variant with ETag / Cache-Control / Range support"""
+    from core.image_variant_service import get_image_variant_service
+
+    service = get_image_variant_service()
     try:
-        from PIL import Image
-        img_path = Path(__file__).resolve().parent / "data" / "img" / image_name
-        # Also try with .png extension if no extension given
-        if not img_path.exists() and not image_name.endswith('.png'):
-            img_path = Path(__file__).resolve().parent / "data" / "img" / (image_name + '.png')
-        if not img_path.exists():
-            raise HTTPException(status_code=404, detail=f"Image not found: {image_name}")
-        img = Image.open(img_path).convert('RGB')
-        buf = io.BytesIO()
-        img.save(buf, format='JPEG', quality=85)
-        buf.seek(0)
-        return StreamingResponse(buf, media_type='image/jpeg')
-    except HTTPException:
-        raise
+        image = service.get_cached(image_name, variant)
+        if image is None:
+            image = await asyncio.to_thread(service.get_variant, image_name, variant)
     except Exception as e:
         logger.error(f"Image conversion error: {e}")
         raise HTTPException(status_code=500, detail="Image conversion failed")
 
+    if image is None:
+        raise HTTPException(status_code=404, detail=f"Image not found: {image_name}")
+
+    headers = {"ETag": image.etag, "Cache-Control": IMAGE_CACHE_CONTROL}
+    if request.headers.get("if-none-match") == image.etag:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(image.path, media_type="image/jpeg", headers=headers)
+
+
+@app.get("/img-jpeg/preview/{image_name}")
+async def serve_image_preview(image_name: str, request: Request):
+    """Serve small JPEG preview (LINE preview_image_url)"""
+    return await _serve_image_variant(request, image_name, "preview")
+
+
+@app.get("/img-jpeg/{image_name}")
+async def serve_image_as_jpeg(image_name: str, request: Request):
+    """Serve PNG images converted to JPEG — required by LINE Messaging API"""
+    return await _serve_image_variant(request, image_name, "original")
+
 # Mount Admin Router
 app.include_router(admin_router)
 logger.info("✅ Admin Dashboard APIs mounted")
 
-# Initialize handlers
-try:
-    line_handler = LineHandler()
-    logger.info("✅ LINE Handler ready")
-except Exception as e:
-    logger.error(f"❌ LINE Handler failed: {e}")
-    line_handler = None
-
-try:
-    fb_comment_handler = FacebookCommentWebhook()
-    logger.info("✅ Facebook Comment Handler ready")
-except Exception as e:
-    logger.error(f"❌ Facebook Comment Handler failed: {e}")
-    fb_comment_handler = None
-
-try:
-    fb_messenger_handler = FacebookHandler()
-    logger.info("✅ Facebook Messenger Handler ready")
-except Exception as e:
-    logger.error(f"❌ Facebook Messenger Handler failed: {e}")
-    fb_messenger_handler = None
-
-try:
-    if InstagramHandler is None:
-        raise ImportError("platforms.instagram_handler not found")
-    instagram_handler = InstagramHandler()
-    logger.info("✅ Instagram Handler ready")
-except Exception as e:
-    logger.error(f"❌ Instagram Handler failed: {e}")
-    instagram_handler = None
-
-# Register handlers for cross-module usage (e.g. admin broadcast)
-try:
-    set_handlers(line=line_handler, facebook=fb_messenger_handler, instagram=instagram_handler)
-except TypeError:
-    # Backward compatibility: older handler_registry accepts only line/facebook
-    set_handlers(line=line_handler, facebook=fb_messenger_handler)
-
-# Initialize database (if available)
-try:
+# Handlers are created by the startup warm-up (None until ready)
+line_handler = None
+fb_comment_handler = None
+fb_messenger_handler = None
+instagram_handler = None
+
+# Startup state: webhooks are gated (503) until the warm-up has finished
+startup_state = {
+    "ready": False,
+    "degraded": False,
+    "started_at": None,
+    "total_seconds": None,
+    "components": {}
+}
+
+
+def _create_line_handler():
+    from platforms.line_handler import LineHandler
+    return LineHandler()
+
+
+def _create_fb_comment_handler():
+    from facebook_integration.comment_webhook import FacebookCommentWebhook
+    return FacebookCommentWebhook()
+
+
+def _create_fb_messenger_handler():
+    from platforms.facebook_handler import FacebookHandler
+    return FacebookHandler()
+
+
+def _create_instagram_handler():
+    from platforms.instagram_handler import InstagramHandler
+    return InstagramHandler()
+
+
+def _load_ai_service():
+    """Load the shared AI knowledge base (handlers reuse this singleton)"""
+    from core.ai_service import AIService
+    return AIService()
+
+
+def _load_session_store():
+    """Connect session storage (Redis probe can take seconds when it is down)"""
+    from platforms.session_manager import session_manager
+    session_manager.start_sweeper()
+    return session_manager
+
+
+def _load_event_dedup():
+    from platforms.event_dedup import get_event_deduplicator
+    return get_event_deduplicator()
+
+
+def _import_line_sdk():
+    """Import the (large) LINE SDK ahead of handler construction"""
+    import linebot.v3.messaging
+    import linebot.v3.webhooks
+    return True
+
+
+def _init_database():
+    """Initialize database (if available) + bootstrap admin user"""
     from database.connection import init_db, db_manager
     from database.crud import init_crud_manager, get_crud
     
     init_db(create_tables=True)
     
     # Initialize CRUD manager
-    if db_manager:
-        init_crud_manager(db_manager)
-        logger.info("✅ Database and CRUD Manager initialized")
-
-        # Bootstrap admin user: prefer env vars, fall back to safe defaults
-        admin_username = os.getenv("ADMIN_USERNAME", "admin")
-        admin_password = os.getenv("ADMIN_PASSWORD", "admin123")
-        admin_email = os.getenv("ADMIN_EMAIL", "admin@seoulholic.com")
-        admin_role = os.getenv("ADMIN_ROLE", "superadmin")
-
-        try:
-            from admin_dashboard.backend.auth import get_password_hash
-
-            crud = get_crud()
-            existing_admin = crud.get_admin_by_username(admin_username)
-            if not existing_admin:
-                created_admin = crud.create_admin_user(
-                    username=admin_username,
-                    email=admin_email,
-                    password_hash=get_password_hash(admin_password),
-                    role=admin_role,
-                )
-                if created_admin:
-                    logger.info(f"✅ Bootstrap admin created: {admin_username} / {admin_password}")
-                else:
-                    logger.warning("⚠️  Bootstrap admin creation failed")
-            else:
-                logger.info(f"ℹ️  Bootstrap admin already exists: {admin_username}")
-        except Exception as bootstrap_error:
-            logger.warning(f"⚠️  Bootstrap admin setup skipped: {bootstrap_error}")
-    else:
+    if not db_manager:
         logger.warning("⚠️  Database manager not available")
-        
-except Exception as e:
-    logger.warning(f"⚠️  Database initialization skipped: {e}")
+        return None
+    
+    init_crud_manager(db_manager)
+    logger.info("✅ Database and CRUD Manager initialized")
+
+    # Bootstrap admin user: prefer env vars, fall back to safe defaults
+    admin_username = os.getenv("ADMIN_USERNAME", "admin")
+    admin_password = os.getenv("ADMIN_PASSWORD", "admin123")
+    admin_email = os.getenv("ADMIN_EMAIL", "admin@seoulholic.com")
+    admin_role = os.getenv("ADMIN_ROLE", "superadmin")
+
+    try:
+        from admin_dashboard.backend.auth import get_password_hash
+
+        crud = get_crud()
+        existing_admin = crud.get_admin_by_username(admin_username)
+        if not existing_admin:
+            created_admin = crud.create_admin_user(
+                username=admin_username,
+                email=admin_email,
+                password_hash=get_password_hash(admin_password),
+                role=admin_role,
+            )
+            if created_admin:
+                logger.info(f"✅ Bootstrap admin created: {admin_username} / {admin_password}")
+            else:
+                logger.warning("⚠️  Bootstrap admin creation failed")
+        else:
+            logger.info(f"ℹ️  Bootstrap admin already exists: {admin_username}")
+    except Exception as bootstrap_error:
+        logger.warning(f"⚠️  Bootstrap admin setup skipped: {bootstrap_error}")
+    return db_manager
+
+
+async def _timed_component(name: str, init_fn):
+    """Run a blocking initializer in a worker thread and record its cost"""
+    started = time.perf_counter()
+    try:
+        result = await asyncio.to_thread(init_fn)
+        startup_state["components"][name] = {"ok": True, "seconds": round(time.perf_counter() - started, 3)}
+        logger.info(f"✅ {name} ready ({time.perf_counter() - started:.2f}s)")
+        return result
+    except Exception as e:
+        startup_state["components"][name] = {"ok": False, "seconds": round(time.perf_counter() - started, 3), "error": str(e)}
+        logger.error(f"❌ {name} failed: {e}")
+        return None
+
+
+def _guarded_step(name: str, step_fn):
+    """Run an optional step on the event loop; a failure is recorded, never fatal"""
+    started = time.perf_counter()
+    try:
+        step_fn()
+        startup_state["components"][name] = {"ok": True, "seconds": round(time.perf_counter() - started, 3)}
+    except Exception as e:
+        startup_state["components"][name] = {"ok": False, "seconds": round(time.perf_counter() - started, 3), "error": str(e)}
+        logger.error(f"❌ {name} failed: {e}", exc_info=True)
+
+
+def _start_stats_rollup():
+    from database.crud import crud_manager
+    if crud_manager is not None:
+        crud_manager.stats_rollup.start()
+
+
+def _backfill_user_tags():
+    """user_tags index for databases created before the table existed (no-op once populated)"""
+    from database.crud import crud_manager
+    if crud_manager is not None:
+        crud_manager.backfill_user_tags()
+
+
+async def warm_up():
+    """
+    Structured startup phase
+    1. Independent shared services + heavy imports, concurrently
+    2. Platform handlers (cheap once their dependencies are warm), concurrently
+    3. Optional subsystems (handler registry, dashboard counters), each guarded
+    Always marks the app ready once everything has settled ("degraded" if a component failed)
+    """
+    started = time.perf_counter()
+    startup_state["started_at"] = time.time()
+    try:
+        await _warm_up_components()
+    except Exception as e:
+        logger.error(f"❌ Warm-up aborted: {e}", exc_info=True)
+        startup_state["components"]["warm_up"] = {"ok": False, "seconds": round(time.perf_counter() - started, 3), "error": str(e)}
+    finally:
+        # Never leave webhooks gated for the life of the process
+        startup_state["total_seconds"] = round(time.perf_counter() - started, 3)
+        startup_state["degraded"] = not all(info["ok"] for info in startup_state["components"].values())
+        startup_state["ready"] = True
+
+    logger.info("=" * 80)
+    logger.info(f"🚀 Startup complete in {startup_state['total_seconds']:.2f}s" + (" (degraded)" if startup_state["degraded"] else ""))
+    for name, info in startup_state["components"].items():
+        status = "✅" if info["ok"] else "❌"
+        logger.info(f"   {status} {name:<28} {info['seconds']:>7.2f}s")
+    logger.info("=" * 80)
+
+
+async def _warm_up_components():
+    global line_handler, fb_comment_handler, fb_messenger_handler, instagram_handler
+
+    await asyncio.gather(
+        _timed_component("ai_knowledge_base", _load_ai_service),
+        _timed_component("database", _init_database),
+        _timed_component("session_store", _load_session_store),
+        _timed_component("event_dedup", _load_event_dedup),
+        _timed_component("line_sdk_import", _import_line_sdk),
+    )
+
+    (
+        line_handler,
+        fb_comment_handler,
+        fb_messenger_handler,
+        instagram_handler,
+    ) = await asyncio.gather(
+        _timed_component("line_handler", _create_line_handler),
+        _timed_component("facebook_comment_handler", _create_fb_comment_handler),
+        _timed_component("facebook_messenger_handler", _create_fb_messenger_handler),
+        _timed_component("instagram_handler", _create_instagram_handler),
+    )
+
+    # Register handlers for cross-module usage (e.g. admin broadcast)
+    _guarded_step(
+        "handler_registry",
+        lambda: set_handlers(line=line_handler, facebook=fb_messenger_handler, instagram=instagram_handler)
+    )
+
+    # Dashboard counters: periodic reconcile against the source tables; broadcast tag index
+    if startup_state["components"].get("database", {}).get("ok"):
+        _guarded_step("stats_rollup", _start_stats_rollup)
+        await _timed_component("user_tags_backfill", _backfill_user_tags)
+
+
+# Webhook deliveries are refused until warm so LINE/Meta retry them later
+GATED_PATH_PREFIXES = ("/webhook/",)
+
+
+@app.middleware("http")
+async def readiness_gate(request: Request, call_next):
+    """Return 503 for gated paths while the app is still warming up"""
+    if (
+        not startup_state["ready"]
+        and request.method == "POST"
+        and request.url.path.startswith(GATED_PATH_PREFIXES)
+    ):
+        return JSONResponse(
+            status_code=503,
+            content={"status": "starting", "detail": "Service warming up, retry later"},
+            headers={"Retry-After": "5"}
+        )
+    return await call_next(request)
 
 
 # ============================================================================
@@ -196,6 +349,7 @@ async def health_check():
     """Detailed health check"""
     health = {
         "status": "healthy",
+        "ready": startup_state["ready"],
         "services": {
             "line": "ok" if line_handler else "unavailable",
             "facebook_comments": "ok" if fb_comment_handler else "unavailable",
@@ -205,13 +359,28 @@ async def health_check():
         }
     }
     
-    # Check if any critical service is down
-    if not line_handler and not fb_comment_handler and not fb_messenger_handler:
+    # Check if any critical service is down (handlers only exist once warm)
+    if startup_state["ready"] and not line_handler and not fb_comment_handler and not fb_messenger_handler:
         health["status"] = "degraded"
     
     return health
 
 
+@app.get("/ready", response_class=JSONResponse)
+async def readiness_check():
+    """Readiness probe — 503 until the startup warm-up has finished"""
+    if not startup_state["ready"]:
+        return JSONResponse(
+            status_code=503,
+            content={"status": "starting", "components": startup_state["components"]}
+        )
+    return {
+        "status": "degraded" if startup_state["degraded"] else "ready",
+        "startup_seconds": startup_state["total_seconds"],
+        "components": startup_state["components"]
+    }
+
+
 # ============================================================================
 # PRIVACY POLICY & TERMS (required for Meta App Live mode)
 # ============================================================================
@@ -359,18 +528,24 @@ async def facebook_webhook(request: Request):
         comment_result = {"status": "skipped"}
         messenger_result = {"status": "skipped"}
 
+        # Both handlers only split + queue the payload; processing runs in their work queues
         if fb_comment_handler:
             comment_result = await fb_comment_handler.handle_webhook(body, signature, raw_body=raw)
 
         if fb_messenger_handler:
             messenger_result = await fb_messenger_handler.handle_webhook(body)
 
+        if "busy" in (comment_result.get("status"), messenger_result.get("status")):
+            raise HTTPException(status_code=503, detail="Busy, retry later", headers={"Retry-After": "5"})
+
         return JSONResponse(content={
             "status": "ok",
             "comment": comment_result,
             "messenger": messenger_result
         })
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Facebook webhook error: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
@@ -417,7 +592,11 @@ async def instagram_webhook(request: Request):
         
     try:
         result = await instagram_handler.handle_webhook(body)
+        if result.get("status") == "busy":
+            raise HTTPException(status_code=503, detail="Busy, retry later", headers={"Retry-After": "5"})
         return JSONResponse(content={"status": "ok", "result": result})
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Instagram webhook error: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
@@ -432,7 +611,8 @@ async def debug_facebook():
     Debug Facebook configuration and subscription status.
     Call this to diagnose why Messenger events are not arriving.
     """
-    import requests as _req
+    from core.graph_client import get_graph_client
+    graph = get_graph_client()
     token = os.getenv("FACEBOOK_PAGE_ACCESS_TOKEN", "")
     app_secret = os.getenv("FACEBOOK_APP_SECRET", "")
     verify_token = os.getenv("FACEBOOK_VERIFY_TOKEN", "seoulholic_webhook_verify_2026")
@@ -456,22 +636,14 @@ async def debug_facebook():
 
     try:
         # 1. Page info
-        r = _req.get(
-            "https://graph.facebook.com/v20.0/me",
-            params={"access_token": token, "fields": "id,name"},
-            timeout=8
-        )
+        r = await graph.get("/me", params={"access_token": token, "fields": "id,name"})
         if r.status_code == 200:
             result["page_info"] = r.json()
         else:
             result["page_info"] = {"error": r.text}
 
         # 2. Subscribed apps (webhook subscription on this page)
-        r2 = _req.get(
-            "https://graph.facebook.com/v20.0/me/subscribed_apps",
-            params={"access_token": token},
-            timeout=8
-        )
+        r2 = await graph.get("/me/subscribed_apps", params={"access_token": token})
         if r2.status_code == 200:
             result["subscribed_apps"] = r2.json()
         else:
@@ -493,17 +665,38 @@ async def legacy_stats():
     Legacy stats endpoint (redirects to new admin API)
     """
     from platforms.session_manager import session_manager
-    from facebook_integration.rate_limiter import rate_limiter
+    from facebook_integration.rate_limiter import get_rate_limiter
+    from platforms.event_dedup import get_event_deduplicator
+    from platforms.profile_cache import get_profile_cache
+    from database.message_writer import get_message_writer
+    from core.graph_client import get_graph_client
+    from core.graph_batcher import get_graph_batcher
+    from facebook_integration.page_sync import get_page_sync_engine
     
     return {
         "sessions": session_manager.get_session_stats(),
-        "rate_limiter": rate_limiter.get_stats(),
+        "rate_limiter": get_rate_limiter().get_stats(),
+        "event_dedup": get_event_deduplicator().get_stats(),
+        "profile_cache": get_profile_cache().get_stats(),
+        "message_writer": get_message_writer().get_stats(),
+        "graph_api": get_graph_client().get_stats(),
+        "graph_batch": get_graph_batcher().get_stats(),
+        "page_sync": get_page_sync_engine().get_stats(),
         "webhooks": {
             "line": {
-                "status": "active" if line_handler else "inactive"
+                "status": "active" if line_handler else "inactive",
+                "queue": line_handler.get_queue_stats() if line_handler else None
             },
             "facebook": {
-                "status": "active" if (fb_comment_handler or fb_messenger_handler) else "inactive"
+                "status": "active" if (fb_comment_handler or fb_messenger_handler) else "inactive",
+                "comment_queue": fb_comment_handler.work_queue.get_stats() if fb_comment_handler else None,
+                "comment_reply_scheduler": fb_comment_handler.reply_scheduler.get_stats() if fb_comment_handler else None,
+                "comment_clusters": fb_comment_handler.auto_reply_engine.clusterer.get_stats() if fb_comment_handler else None,
+                "messenger_queue": fb_messenger_handler.work_queue.get_stats() if fb_messenger_handler else None
+            },
+            "instagram": {
+                "status": "active" if instagram_handler else "inactive",
+                "queue": instagram_handler.work_queue.get_stats() if instagram_handler else None
             }
         },
         "note": "This endpoint is deprecated. Use /api/admin/analytics/stats instead"
@@ -541,10 +734,23 @@ async def startup_event():
     logger.info("=" * 80)
     logger.info("🚀 Seoulholic Multi-Platform Chatbot Starting...")
     logger.info("=" * 80)
-    logger.info(f"LINE Handler: {'✅ Ready' if line_handler else '❌ Not available'}")
-    logger.info(f"Facebook Comment Handler: {'✅ Ready' if fb_comment_handler else '❌ Not available'}")
-    logger.info(f"Facebook Messenger Handler: {'✅ Ready' if fb_messenger_handler else '❌ Not available'}")
-    logger.info("=" * 80)
+
+    # Warm up in the background: the port opens immediately (/health answers),
+    # /ready and webhooks wait until the warm-up has finished
+    app.state.warm_up_task = asyncio.create_task(warm_up())
+
+    # Meta Graph API pool lives on this loop (worker threads submit to it)
+    from core.graph_client import get_graph_client
+    get_graph_client().open()
+
+    # Incremental Facebook page sync (promotions -> knowledge base), jittered interval
+    if os.getenv("FB_SYNC_ENABLED", "true").lower() == "true":
+        from facebook_integration.page_sync import get_page_sync_engine
+        get_page_sync_engine().start()
+
+    # Pre-render JPEG variants in the background (first requests fall back to lazy render)
+    from core.image_variant_service import get_image_variant_service
+    asyncio.get_running_loop().run_in_executor(None, get_image_variant_service().precompute_all)
 
 
 @app.on_event("shutdown")
@@ -552,6 +758,64 @@ async def shutdown_event():
     """Shutdown tasks"""
     logger.info("🛑 Shutting down...")
     
+    # Let queued webhook events finish before closing resources
+    if line_handler:
+        line_handler.debouncer.flush_all()
+    queues = [
+        handler.work_queue
+        for handler in (line_handler, fb_comment_handler, fb_messenger_handler, instagram_handler)
+        if handler is not None
+    ]
+    if queues:
+        drain_timeout = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", 10))
+        await asyncio.gather(*(queue.join(timeout=drain_timeout) for queue in queues))
+        # Comments classified by the queue above still wait for an LLM worker
+        if fb_comment_handler:
+            await fb_comment_handler.reply_scheduler.join(timeout=drain_timeout)
+    
+    # Stop stats reconcile job
+    try:
+        from database.crud import crud_manager
+        if crud_manager is not None:
+            await crud_manager.stats_rollup.stop()
+    except Exception:
+        pass
+    
+    # Stop page sync before closing the Graph API pool it uses
+    try:
+        from facebook_integration.page_sync import get_page_sync_engine
+        await get_page_sync_engine().stop()
+    except Exception:
+        pass
+    
+    # Close pooled LINE connections
+    try:
+        from platforms.line_client import close_line_client
+        close_line_client()
+    except Exception:
+        pass
+    
+    # Close pooled Graph API connections
+    try:
+        from core.graph_client import close_graph_client
+        await close_graph_client()
+    except Exception:
+        pass
+    
+    # Stop session expiry sweeper
+    try:
+        from platforms.session_manager import session_manager
+        session_manager.stop_sweeper()
+    except Exception:
+        pass
+    
+    # Write out queued chat messages before the DB goes away
+    try:
+        from database.message_writer import get_message_writer
+        await asyncio.to_thread(get_message_writer().flush, float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", 10)))
+    except Exception as e:
+        logger.error(f"❌ Message writer flush failed: {e}")
+    
     # Close database connections
     try:
         from database.connection import db_manager
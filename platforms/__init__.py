@@ -1,17 +1,35 @@
 """
 Platforms Package
 Multi-platform handler for LINE, Facebook, Instagram
+
+Handlers are imported lazily on first attribute access: importing a light
+submodule (e.g. handler_registry) must not load the LINE SDK or AI service
 """
 
-from .base_handler import BaseHandler
-from .session_manager import SessionManager
-from .line_handler import LineHandler
+import importlib
+
+_LAZY_ATTRS = {
+    'BaseHandler': '.base_handler',
+    'SessionManager': '.session_manager',
+    'LineHandler': '.line_handler',
+    # Facebook handler (optional - for Messenger chatbot)
+    'FacebookHandler': '.facebook_handler',
+}
+
+
+def __getattr__(name):
+    module_name = _LAZY_ATTRS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    try:
+        value = getattr(importlib.import_module(module_name, __name__), name)
+    except ImportError:
+        if name != 'FacebookHandler':
+            raise
+        value = None
+    globals()[name] = value
+    return value
 
-# Facebook handler (optional - for Messenger chatbot)
-try:
-    from .facebook_handler import FacebookHandler
-except ImportError:
-    FacebookHandler = None
 
 __all__ = [
     'BaseHandler',
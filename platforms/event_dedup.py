@@ -0,0 +1,170 @@
+"""
+Webhook Event Deduplication
+กัน event ซ้ำจากการ redelivery (LINE / Messenger / Instagram / Feed comments)
+
+- In-memory: bounded TTL set (OrderedDict ตามลำดับเวลา)
+- Redis (optional): SET NX EX ใช้ร่วมกันได้หลาย worker
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class EventDeduplicator:
+    """
+    Idempotency store keyed on platform event IDs
+
+    check_and_mark() must be called before any work is scheduled:
+    it returns True the first time an ID is seen, False for duplicates.
+    unmark() hands an ID back when the delivery is rejected before scheduling
+    """
+
+    def __init__(self, ttl_seconds: int = None, max_entries: int = None, use_redis: bool = True):
+        """
+        Initialize deduplicator
+
+        Args:
+            ttl_seconds: How long an event ID is remembered
+            max_entries: Max IDs kept in memory (oldest evicted first)
+            use_redis: Use Redis if available (shared across workers)
+        """
+        self.ttl_seconds = ttl_seconds or int(os.getenv('EVENT_DEDUP_TTL', 3600 * 6))
+        self.max_entries = max_entries or int(os.getenv('EVENT_DEDUP_MAX_ENTRIES', 50000))
+
+        # key -> expires_at (insertion order == expiry order, TTL is constant)
+        self._seen: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.redis_client = None
+        if use_redis and os.getenv('EVENT_DEDUP_REDIS', 'true').lower() == 'true':
+            try:
+                import redis
+                self.redis_client = redis.Redis(
+                    host=os.getenv('REDIS_HOST', 'localhost'),
+                    port=int(os.getenv('REDIS_PORT', 6379)),
+                    db=int(os.getenv('REDIS_DB', 0)),
+                    decode_responses=True,
+                    socket_timeout=1,
+                    socket_connect_timeout=1
+                )
+                self.redis_client.ping()
+                logger.info("✅ Event dedup connected to Redis")
+            except Exception as e:
+                logger.warning(f"⚠️  Event dedup Redis not available: {e}. Using in-memory set.")
+                self.redis_client = None
+
+        self.stats = {
+            "checked": 0,
+            "duplicates": 0,
+            "redis_errors": 0,
+            "duplicates_by_platform": {}
+        }
+
+        logger.info(f"🔁 Event dedup initialized (ttl={self.ttl_seconds}s, redis={self.redis_client is not None})")
+
+    def check_and_mark(self, platform: str, event_id: Optional[str]) -> bool:
+        """
+        Atomically check + remember an event ID
+
+        Args:
+            platform: 'line' | 'facebook' | 'instagram' | 'facebook_comment'
+            event_id: Platform event ID (None/empty = cannot dedup, always new)
+
+        Returns:
+            True if the event is new (process it), False if duplicate (drop it)
+        """
+        if not event_id:
+            return True
+
+        key = f"{platform}:{event_id}"
+        self.stats["checked"] += 1
+
+        is_new = None
+        if self.redis_client is not None:
+            try:
+                is_new = bool(self.redis_client.set(f"event_dedup:{key}", 1, nx=True, ex=self.ttl_seconds))
+            except Exception as e:
+                self.stats["redis_errors"] += 1
+                logger.warning(f"⚠️  Event dedup Redis error: {e}. Falling back to memory.")
+
+        if is_new is None:
+            is_new = self._check_and_mark_memory(key)
+
+        if not is_new:
+            self.stats["duplicates"] += 1
+            by_platform = self.stats["duplicates_by_platform"]
+            by_platform[platform] = by_platform.get(platform, 0) + 1
+            logger.info(f"🔁 Dropping duplicate {platform} event: {event_id}")
+
+        return is_new
+
+    def unmark(self, platform: str, event_id: Optional[str]):
+        """
+        Forget an event ID marked by check_and_mark() whose work was never scheduled
+        (e.g. the delivery was rejected as busy), so the platform's redelivery is processed
+
+        Args:
+            platform: Platform used when marking
+            event_id: Platform event ID
+        """
+        if not event_id:
+            return
+
+        key = f"{platform}:{event_id}"
+        if self.redis_client is not None:
+            try:
+                self.redis_client.delete(f"event_dedup:{key}")
+            except Exception as e:
+                self.stats["redis_errors"] += 1
+                logger.warning(f"⚠️  Event dedup Redis error: {e}. Falling back to memory.")
+        with self._lock:
+            self._seen.pop(key, None)
+
+    def _check_and_mark_memory(self, key: str) -> bool:
+        """In-memory TTL set (O(1) amortized)"""
+        now = time.time()
+        with self._lock:
+            # Purge expired IDs from the oldest end
+            while self._seen:
+                if next(iter(self._seen.values())) > now:
+                    break
+                self._seen.popitem(last=False)
+
+            expires_at = self._seen.get(key)
+            if expires_at is not None and expires_at > now:
+                return False
+
+            self._seen[key] = now + self.ttl_seconds
+            self._seen.move_to_end(key)
+            while len(self._seen) > self.max_entries:
+                self._seen.popitem(last=False)
+            return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Dedup statistics"""
+        return {
+            "backend": "redis" if self.redis_client is not None else "memory",
+            "checked": self.stats["checked"],
+            "duplicates_dropped": self.stats["duplicates"],
+            "duplicates_by_platform": dict(self.stats["duplicates_by_platform"]),
+            "redis_errors": self.stats["redis_errors"],
+            "memory_entries": len(self._seen),
+            "ttl_seconds": self.ttl_seconds
+        }
+
+
+# Singleton
+_event_deduplicator = None
+
+def get_event_deduplicator() -> EventDeduplicator:
+    """Get Event Deduplicator singleton"""
+    global _event_deduplicator
+    if _event_deduplicator is None:
+        _event_deduplicator = EventDeduplicator()
+    return _event_deduplicator
@@ -5,17 +5,24 @@ For comments, use facebook_integration/comment_webhook.py
 
 import os
 import sys
+import asyncio
+import functools
 from pathlib import Path
 from typing import Dict, Any, Optional, List
 import logging
-import requests
 
 # Add parent directory
 sys.path.append(str(Path(__file__).resolve().parents[1]))
 
 from platforms.base_handler import BaseHandler
 from platforms.session_manager import session_manager
+from platforms.work_queue import create_work_queue
+from platforms.event_dedup import get_event_deduplicator
+from platforms.profile_cache import get_profile_cache
+from database.message_writer import get_message_writer
 from core.ai_service import AIService
+from core.graph_client import get_graph_client
+from core.graph_batcher import get_graph_batcher
 
 logger = logging.getLogger(__name__)
 
@@ -40,7 +47,10 @@ class FacebookHandler(BaseHandler):
         
         self.graph_api_url = "https://graph.facebook.com/v20.0"
         self.ai_service = AIService()
+        get_profile_cache().register_fetcher("facebook", self._fetch_profile)
         self.auto_reply_enabled = os.getenv('FACEBOOK_INBOX_AUTO_REPLY', 'true').lower() == 'true'
+        # Messaging events are processed in the background: per-sender FIFO, cross-sender parallel
+        self.work_queue = create_work_queue("facebook_messenger", "FACEBOOK", concurrency=8, max_depth=1000)
         
         logger.info("✅ Facebook Messenger Handler initialized")
     
@@ -68,24 +78,38 @@ class FacebookHandler(BaseHandler):
                 logger.info(f"⏩ FB Messenger: ignoring non-page event (object={obj})")
                 return {"status": "ignored", "reason": f"non-page-event: {obj}"}
 
-            handled_events = 0
-            for entry in body.get("entry", []):
-                handled_events += await self._process_entry(entry)
+            # One unit of work per messaging event; processed in the background
+            # (per-sender order, bounded concurrency) so Meta gets its 200 right away
+            events = [event for entry in body.get("entry", []) for event in entry.get("messaging", [])]
+            # Drop redelivered events before they take queue slots or count against capacity
+            dedup = get_event_deduplicator()
+            received = len(events)
+            events = [event for event in events if dedup.check_and_mark("facebook", self._event_id(event))]
+            if not self.work_queue.has_capacity(len(events)):
+                # Nothing was scheduled: let Meta's redelivery through
+                for event in events:
+                    dedup.unmark("facebook", self._event_id(event))
+                self.work_queue.stats["rejected"] += len(events)
+                logger.warning(f"⚠️  {self.work_queue.name} queue full ({self.work_queue.depth}), rejecting {len(events)} events")
+                return {"status": "busy"}
+
+            for event in events:
+                key = (event.get("sender") or {}).get("id") or "unknown"
+                self.work_queue.submit(key, functools.partial(self._handle_messaging_event, event))
 
             return {
                 "status": "ok",
-                "messenger_events_handled": handled_events
+                "messenger_events_queued": len(events),
+                "duplicates": received - len(events)
             }
         except Exception as e:
             logger.error(f"❌ Error handling Facebook Messenger webhook: {e}", exc_info=True)
             return {"status": "error", "message": str(e)}
 
-    async def _process_entry(self, entry: Dict[str, Any]) -> int:
-        handled = 0
-        for event in entry.get("messaging", []):
-            if await self._handle_messaging_event(event):
-                handled += 1
-        return handled
+    @staticmethod
+    def _event_id(event: Dict[str, Any]) -> Optional[str]:
+        """Message / postback mid (kept across Meta redeliveries)"""
+        return (event.get("message") or {}).get("mid") or (event.get("postback") or {}).get("mid")
 
     async def _handle_messaging_event(self, event: Dict[str, Any]) -> bool:
         sender = event.get("sender", {})
@@ -112,10 +136,36 @@ class FacebookHandler(BaseHandler):
             logger.info("⏩ Facebook inbox auto-reply disabled")
             return True
 
-        profile = await self.get_user_profile(sender_id)
+        profile = await get_profile_cache().aget("facebook", sender_id)
         display_name = profile.get("display_name") if profile else None
         profile_pic_url = profile.get("profile_pic") if profile else None
 
+        # Session reads/writes (Redis, DB rehydration) + RAG + LLM are blocking —
+        # keep them off the event loop so other senders keep flowing
+        response_text, cleaned_text = await asyncio.to_thread(
+            self._prepare_reply, sender_id, user_text, display_name, profile_pic_url
+        )
+
+        sent = await self.send_message(sender_id, {
+            "text": cleaned_text,
+            "messaging_type": "RESPONSE"
+        })
+        if sent:
+            await asyncio.to_thread(self._record_reply, sender_id, response_text, display_name, profile_pic_url)
+
+        return True
+    
+    def _prepare_reply(
+        self,
+        sender_id: str,
+        user_text: str,
+        display_name: Optional[str],
+        profile_pic_url: Optional[str]
+    ):
+        """Record the inbound message in the session and generate the reply (blocking)"""
+        # Load (or rehydrate) the session before this message hits the DB
+        session_manager.get_session("facebook", sender_id)
+
         # Save inbound message
         self._save_message_to_db(sender_id, user_text, "user", display_name, profile_pic_url)
 
@@ -125,6 +175,24 @@ class FacebookHandler(BaseHandler):
             "content": user_text
         })
         history = session_manager.get_conversation_history("facebook", sender_id)
+        return self._generate_reply(user_text, history)
+    
+    def _record_reply(
+        self,
+        sender_id: str,
+        response_text: str,
+        display_name: Optional[str],
+        profile_pic_url: Optional[str]
+    ):
+        """Append the sent reply to the session and queue it for the DB (blocking)"""
+        session_manager.update_session("facebook", sender_id, {
+            "role": "assistant",
+            "content": response_text
+        })
+        self._save_message_to_db(sender_id, response_text, "bot", display_name, profile_pic_url)
+    
+    def _generate_reply(self, user_text: str, history: List[Dict[str, str]]):
+        """RAG + completion (blocking). Returns (raw response, cleaned text)"""
         relevant_info = self.ai_service.find_relevant_info(user_text, history)
 
         messages_to_send: List[Dict[str, str]] = history.copy()
@@ -136,21 +204,8 @@ class FacebookHandler(BaseHandler):
         for chunk in self.ai_service.chat_completion(messages_to_send, stream=False):
             response_text += chunk
 
-        cleaned_text = self.ai_service._clean_markdown(response_text)
-
-        sent = await self.send_message(sender_id, {
-            "text": cleaned_text,
-            "messaging_type": "RESPONSE"
-        })
-        if sent:
-            session_manager.update_session("facebook", sender_id, {
-                "role": "assistant",
-                "content": response_text
-            })
-            self._save_message_to_db(sender_id, response_text, "bot", display_name, profile_pic_url)
+        return response_text, self.ai_service._clean_markdown(response_text)
 
-        return True
-    
     async def send_message(self, user_id: str, message: Dict[str, Any]) -> bool:
         """
         Send message to Facebook user via Messenger
@@ -163,46 +218,89 @@ class FacebookHandler(BaseHandler):
             Success status
         """
         try:
-            url = f"{self.graph_api_url}/me/messages"
             params = {"access_token": self.page_access_token}
-
-            messaging_type = message.get("messaging_type", "RESPONSE")
-            json_data = {
-                "recipient": {"id": user_id},
-                "message": {"text": message.get("text", "")},
-                "messaging_type": messaging_type
-            }
-
-            # For proactive messaging outside 24-hour window
-            if messaging_type == "MESSAGE_TAG" and message.get("tag"):
-                json_data["tag"] = message.get("tag")
-
-            if message.get("notification_type"):
-                json_data["notification_type"] = message.get("notification_type")
+            json_data = self._build_send_payload(user_id, message)
             
-            response = requests.post(url, params=params, json=json_data, timeout=10)
+            response = await get_graph_client().post("/me/messages", params=params, json=json_data)
             
             # Log detailed error if request fails
-            if not response.ok:
+            if not response.is_success:
                 error_detail = response.text
                 logger.error(f"❌ Facebook API Error {response.status_code}: {error_detail}")
-                logger.error(f"   Request: POST {url}")
+                logger.error(f"   Request: POST /me/messages")
                 logger.error(f"   Payload: {json_data}")
-                response.raise_for_status()
+                return False
             
             logger.info(f"✅ Message sent to Facebook user {user_id}")
             return True
             
-        except requests.exceptions.HTTPError as e:
-            logger.error(f"❌ HTTP Error sending Facebook message: {e}")
-            return False
         except Exception as e:
             logger.error(f"❌ Error sending Facebook message: {e}")
             return False
     
+    @staticmethod
+    def _build_send_payload(user_id: str, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Send API payload for one recipient"""
+        messaging_type = message.get("messaging_type", "RESPONSE")
+        payload = {
+            "recipient": {"id": user_id},
+            "message": {"text": message.get("text", "")},
+            "messaging_type": messaging_type
+        }
+
+        # For proactive messaging outside 24-hour window
+        if messaging_type == "MESSAGE_TAG" and message.get("tag"):
+            payload["tag"] = message.get("tag")
+
+        if message.get("notification_type"):
+            payload["notification_type"] = message.get("notification_type")
+        return payload
+
+    async def send_messages_bulk(self, user_ids: List[str], message: Dict[str, Any]) -> Dict[str, bool]:
+        """
+        Send the same message to many users via Graph batch requests (broadcast)
+        
+        Args:
+            user_ids: Page-scoped IDs (PSIDs)
+            message: Message content (same format as send_message)
+            
+        Returns:
+            {psid: success}
+        """
+        batcher = get_graph_batcher()
+        results = await asyncio.gather(*(
+            batcher.post("me/messages", self.page_access_token, self._build_send_payload(user_id, message))
+            for user_id in user_ids
+        ))
+
+        sent = {}
+        for user_id, result in zip(user_ids, results):
+            sent[user_id] = result.is_success
+            if not result.is_success:
+                logger.error(f"❌ Facebook broadcast to {user_id} failed: {result.code} {result.body}")
+        logger.info(f"✅ Facebook bulk send: {sum(sent.values())}/{len(user_ids)} delivered")
+        return sent
+
     async def get_user_profile(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Get Facebook user profile (direct API call, batched with concurrent lookups)"""
+        return await self._fetch_profile_async(user_id)
+
+    async def get_user_profiles(self, user_ids: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """Look up many profiles at once (backfill) — 2 batch operations per user"""
+        profiles = await asyncio.gather(*(self._fetch_profile_async(user_id) for user_id in user_ids))
+        return dict(zip(user_ids, profiles))
+
+    def _fetch_profile(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Blocking Graph API profile lookup (used by the profile cache worker threads)"""
+        try:
+            return get_graph_client().run_sync(self._fetch_profile_async(user_id))
+        except Exception as e:
+            logger.debug(f"Could not fetch Facebook profile for {user_id}: {e}")
+            return None
+
+    async def _fetch_profile_async(self, user_id: str) -> Optional[Dict[str, Any]]:
         """
-        Get Facebook user profile
+        Graph API profile lookup; concurrent lookups share batch calls
         
         Args:
             user_id: Page-scoped ID (PSID)
@@ -210,33 +308,26 @@ class FacebookHandler(BaseHandler):
         Returns:
             User profile dict
         """
+        if not self.page_access_token:
+            return None
         try:
-            url = f"{self.graph_api_url}/{user_id}"
+            batcher = get_graph_batcher()
             # In Live mode, only 'id' is freely accessible via PSID
             # name/profile_pic require pages_user_gender permission (App Review)
-            params = {
-                "fields": "id,name",
-                "access_token": self.page_access_token
-            }
-            
-            response = requests.get(url, params=params, timeout=5)
-            response.raise_for_status()
+            # Profile picture needs no special permission
+            node, picture = await asyncio.gather(
+                batcher.get(f"{user_id}?fields=id,name", self.page_access_token),
+                batcher.get(f"{user_id}/picture?redirect=false&type=normal", self.page_access_token)
+            )
+            if not node.is_success:
+                # Non-critical: profile fetch fails in Live mode without extra permissions
+                logger.debug(f"Could not fetch Facebook profile for {user_id}: {node.code} {node.body}")
+                return None
             
-            data = response.json()
-
-            # Fetch profile picture (no special permission needed)
+            data = node.json() or {}
             pic_url = None
-            try:
-                pic_response = requests.get(
-                    f"{self.graph_api_url}/{user_id}/picture",
-                    params={"redirect": "false", "type": "normal", "access_token": self.page_access_token},
-                    timeout=5
-                )
-                if pic_response.ok:
-                    pic_data = pic_response.json()
-                    pic_url = pic_data.get("data", {}).get("url")
-            except Exception:
-                pass
+            if picture.is_success and isinstance(picture.json(), dict):
+                pic_url = picture.json().get("data", {}).get("url")
 
             return {
                 "user_id": data.get("id"),
@@ -247,7 +338,6 @@ class FacebookHandler(BaseHandler):
             }
             
         except Exception as e:
-            # Non-critical: profile fetch fails in Live mode without extra permissions
             logger.debug(f"Could not fetch Facebook profile for {user_id}: {e}")
             return None
 
@@ -259,43 +349,13 @@ class FacebookHandler(BaseHandler):
         display_name: Optional[str] = None,
         profile_pic_url: Optional[str] = None
     ):
-        """Save Facebook inbox message to unified conversation tables"""
-        try:
-            from database.crud import get_crud
-            from database.connection import db_manager
-
-            if not db_manager or not db_manager._engine:
-                return
-
-            crud = get_crud()
-            user = crud.get_or_create_user(
-                platform="facebook",
-                platform_user_id=user_id,
-                display_name=display_name,
-                profile_pic_url=profile_pic_url
-            )
-            if not user:
-                return
-
-            conversation = crud.get_active_conversation(
-                user_id=user.id,
-                platform="facebook"
-            )
-            if not conversation:
-                conversation = crud.create_conversation(
-                    user_id=user.id,
-                    platform="facebook",
-                    conversation_type="personal"
-                )
-            if not conversation:
-                return
-
-            crud.save_message(
-                conversation_id=conversation.id,
-                sender_type=sender_type,
-                content=message,
-                message_type="text",
-                metadata={"channel": "messenger"}
-            )
-        except Exception as e:
-            logger.error(f"❌ Error saving Facebook inbox message: {e}")
+        """Queue Facebook inbox message for the background DB writer"""
+        get_message_writer().enqueue(
+            platform="facebook",
+            platform_user_id=user_id,
+            sender_type=sender_type,
+            content=message,
+            display_name=display_name,
+            profile_pic_url=profile_pic_url,
+            metadata={"channel": "messenger"}
+        )
@@ -4,17 +4,23 @@ Instagram Handler - Handles Instagram Direct Messages
 
 import os
 import sys
+import asyncio
+import functools
 from pathlib import Path
 from typing import Dict, Any, Optional, List
 import logging
-import requests
 
 # Add parent directory
 sys.path.append(str(Path(__file__).resolve().parents[1]))
 
 from platforms.base_handler import BaseHandler
 from platforms.session_manager import session_manager
+from platforms.work_queue import create_work_queue
+from platforms.event_dedup import get_event_deduplicator
+from platforms.profile_cache import get_profile_cache
+from database.message_writer import get_message_writer
 from core.ai_service import AIService
+from core.graph_client import get_graph_client
 
 logger = logging.getLogger(__name__)
 
@@ -37,7 +43,10 @@ class InstagramHandler(BaseHandler):
         
         self.graph_api_url = "https://graph.facebook.com/v20.0"
         self.ai_service = AIService()
+        get_profile_cache().register_fetcher("instagram", self._fetch_profile)
         self.auto_reply_enabled = os.getenv('INSTAGRAM_INBOX_AUTO_REPLY', 'true').lower() == 'true'
+        # DM events are processed in the background: per-sender FIFO, cross-sender parallel
+        self.work_queue = create_work_queue("instagram", "INSTAGRAM", concurrency=8, max_depth=1000)
         
         logger.info("✅ Instagram DM Handler initialized")
     
@@ -59,24 +68,38 @@ class InstagramHandler(BaseHandler):
                 logger.info(f"⏩ IG: ignoring non-instagram event (object={obj})")
                 return {"status": "ignored", "reason": f"non-ig-event: {obj}"}
 
-            handled_events = 0
-            for entry in body.get("entry", []):
-                handled_events += await self._process_entry(entry)
+            # One unit of work per messaging event; processed in the background
+            # (per-sender order, bounded concurrency) so Meta gets its 200 right away
+            events = [event for entry in body.get("entry", []) for event in entry.get("messaging", [])]
+            # Drop redelivered events before they take queue slots or count against capacity
+            dedup = get_event_deduplicator()
+            received = len(events)
+            events = [event for event in events if dedup.check_and_mark("instagram", self._event_id(event))]
+            if not self.work_queue.has_capacity(len(events)):
+                # Nothing was scheduled: let Meta's redelivery through
+                for event in events:
+                    dedup.unmark("instagram", self._event_id(event))
+                self.work_queue.stats["rejected"] += len(events)
+                logger.warning(f"⚠️  {self.work_queue.name} queue full ({self.work_queue.depth}), rejecting {len(events)} events")
+                return {"status": "busy"}
+
+            for event in events:
+                key = (event.get("sender") or {}).get("id") or "unknown"
+                self.work_queue.submit(key, functools.partial(self._handle_messaging_event, event))
 
             return {
                 "status": "ok",
-                "ig_events_handled": handled_events
+                "ig_events_queued": len(events),
+                "duplicates": received - len(events)
             }
         except Exception as e:
             logger.error(f"❌ Error handling Instagram webhook: {e}", exc_info=True)
             return {"status": "error", "message": str(e)}
 
-    async def _process_entry(self, entry: Dict[str, Any]) -> int:
-        handled = 0
-        for event in entry.get("messaging", []):
-            if await self._handle_messaging_event(event):
-                handled += 1
-        return handled
+    @staticmethod
+    def _event_id(event: Dict[str, Any]) -> Optional[str]:
+        """Message / postback mid (kept across Meta redeliveries)"""
+        return (event.get("message") or {}).get("mid") or (event.get("postback") or {}).get("mid")
 
     async def _handle_messaging_event(self, event: Dict[str, Any]) -> bool:
         sender = event.get("sender", {})
@@ -103,16 +126,54 @@ class InstagramHandler(BaseHandler):
             logger.info("⏩ IG DM auto-reply disabled")
             return True
 
-        profile = await self.get_user_profile(sender_id)
+        profile = await get_profile_cache().aget("instagram", sender_id)
         display_name = profile.get("display_name") if profile else f"IG_User_{sender_id[-4:]}"
         profile_pic_url = profile.get("profile_pic") if profile else None
 
+        # Session reads/writes (Redis, DB rehydration) + RAG + LLM are blocking —
+        # keep them off the event loop so other senders keep flowing
+        response_text, cleaned_text = await asyncio.to_thread(
+            self._prepare_reply, sender_id, user_text, display_name, profile_pic_url
+        )
+
+        sent = await self.send_message(sender_id, {"text": cleaned_text})
+        if sent:
+            await asyncio.to_thread(self._record_reply, sender_id, response_text, display_name, profile_pic_url)
+
+        return True
+    
+    def _prepare_reply(
+        self,
+        sender_id: str,
+        user_text: str,
+        display_name: Optional[str],
+        profile_pic_url: Optional[str]
+    ):
+        """Record the inbound message in the session and generate the reply (blocking)"""
+        # Load (or rehydrate) the session before this message hits the DB
+        session_manager.get_session("instagram", sender_id)
+
         # Save inbound message
         self._save_message_to_db(sender_id, user_text, "user", display_name, profile_pic_url)
 
         # Standard AI session logic
         session_manager.update_session("instagram", sender_id, {"role": "user", "content": user_text})
         history = session_manager.get_conversation_history("instagram", sender_id)
+        return self._generate_reply(user_text, history)
+    
+    def _record_reply(
+        self,
+        sender_id: str,
+        response_text: str,
+        display_name: Optional[str],
+        profile_pic_url: Optional[str]
+    ):
+        """Append the sent reply to the session and queue it for the DB (blocking)"""
+        session_manager.update_session("instagram", sender_id, {"role": "assistant", "content": response_text})
+        self._save_message_to_db(sender_id, response_text, "bot", display_name, profile_pic_url)
+    
+    def _generate_reply(self, user_text: str, history: List[Dict[str, str]]):
+        """RAG + completion (blocking). Returns (raw response, cleaned text)"""
         relevant_info = self.ai_service.find_relevant_info(user_text, history)
 
         messages_to_send: List[Dict[str, str]] = history.copy()
@@ -124,21 +185,13 @@ class InstagramHandler(BaseHandler):
         for chunk in self.ai_service.chat_completion(messages_to_send, stream=False):
             response_text += chunk
 
-        cleaned_text = self.ai_service._clean_markdown(response_text)
-
-        sent = await self.send_message(sender_id, {"text": cleaned_text})
-        if sent:
-            session_manager.update_session("instagram", sender_id, {"role": "assistant", "content": response_text})
-            self._save_message_to_db(sender_id, response_text, "bot", display_name, profile_pic_url)
+        return response_text, self.ai_service._clean_markdown(response_text)
 
-        return True
-    
     async def send_message(self, user_id: str, message: Dict[str, Any]) -> bool:
         """
         Send message to IG user
         """
         try:
-            url = f"{self.graph_api_url}/me/messages"
             params = {"access_token": self.access_token}
 
             json_data = {
@@ -146,9 +199,9 @@ class InstagramHandler(BaseHandler):
                 "message": {"text": message.get("text", "")}
             }
 
-            response = requests.post(url, params=params, json=json_data, timeout=10)
+            response = await get_graph_client().post("/me/messages", params=params, json=json_data)
             
-            if not response.ok:
+            if not response.is_success:
                 error_detail = response.text
                 logger.error(f"❌ IG API Error {response.status_code}: {error_detail}")
                 return False
@@ -156,25 +209,25 @@ class InstagramHandler(BaseHandler):
             logger.info(f"✅ Message sent to IG user {user_id}")
             return True
             
-        except requests.exceptions.HTTPError as e:
-            logger.error(f"❌ HTTP Error sending IG message: {e}")
-            return False
         except Exception as e:
             logger.error(f"❌ Error sending IG message: {e}")
             return False
     
     async def get_user_profile(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Get IG user profile (direct API call, runs in a thread)"""
+        return await asyncio.to_thread(self._fetch_profile, user_id)
+
+    def _fetch_profile(self, user_id: str) -> Optional[Dict[str, Any]]:
         """
-        Get IG user profile (Requires advanced access for real basic info, standard provides little)
+        Blocking IG profile lookup, also used by the profile cache (Requires advanced access for real basic info, standard provides little)
         """
         try:
-            url = f"{self.graph_api_url}/{user_id}"
             params = {
                 "fields": "id,name,profile_pic",
                 "access_token": self.access_token
             }
             
-            response = requests.get(url, params=params, timeout=5)
+            response = get_graph_client().request_sync("GET", f"/{user_id}", params=params)
             response.raise_for_status()
             
             data = response.json()
@@ -197,33 +250,12 @@ class InstagramHandler(BaseHandler):
         display_name: Optional[str] = None,
         profile_pic_url: Optional[str] = None
     ):
-        """Save IG inbox message to unified conversation tables"""
-        try:
-            from database.crud import get_crud
-            from database.connection import db_manager
-
-            if not db_manager or not db_manager._engine:
-                return
-
-            crud = get_crud()
-            user = crud.get_or_create_user(
-                platform="instagram",
-                platform_user_id=user_id,
-                display_name=display_name,
-                profile_pic_url=profile_pic_url
-            )
-            if not user:
-                return
-
-            conversation = crud.get_active_conversation(user.id, platform="instagram")
-            if not conversation:
-                conversation = crud.create_conversation(user.id, platform="instagram")
-
-            if conversation:
-                crud.save_message(
-                    conversation_id=conversation.id,
-                    sender_type=sender_type,
-                    content=message
-                )
-        except Exception as e:
-            logger.error(f"❌ Error saving message to database: {e}")
+        """Queue IG inbox message for the background DB writer"""
+        get_message_writer().enqueue(
+            platform="instagram",
+            platform_user_id=user_id,
+            sender_type=sender_type,
+            content=message,
+            display_name=display_name,
+            profile_pic_url=profile_pic_url
+        )
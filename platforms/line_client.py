@@ -0,0 +1,113 @@
+"""
+Pooled LINE Messaging API Client
+ApiClient ตัวเดียวใช้ร่วมกันทั้งระบบ (reply / push / profile / broadcast)
+เปิด connection ครั้งเดียวแล้ว keep-alive ไม่ต้อง TLS handshake ทุก request
+"""
+
+import os
+import threading
+from typing import Any, Dict, Optional
+import logging
+
+from linebot.v3.messaging import Configuration, ApiClient, MessagingApi
+
+logger = logging.getLogger(__name__)
+
+
+class LineClient:
+    """
+    Long-lived LINE client backed by one urllib3 connection pool
+
+    The sync client is used on purpose: LINE events are processed in worker
+    threads (see LineHandler), and urllib3's pool is thread-safe
+    """
+
+    def __init__(self, channel_access_token: str):
+        self.pool_size = int(os.getenv('LINE_HTTP_POOL_SIZE', 16))
+        self.timeout = (
+            float(os.getenv('LINE_HTTP_CONNECT_TIMEOUT', 3)),
+            float(os.getenv('LINE_HTTP_READ_TIMEOUT', 10))
+        )
+
+        self.configuration = Configuration(access_token=channel_access_token)
+        self.configuration.connection_pool_maxsize = self.pool_size
+        self.api_client = ApiClient(self.configuration)
+        self.messaging_api = MessagingApi(self.api_client)
+
+        self.stats = {"requests": 0, "errors": 0}
+
+        logger.info(f"🔌 LINE client pool ready (size={self.pool_size}, timeout={self.timeout})")
+
+    def _call(self, method, *args, **kwargs):
+        self.stats["requests"] += 1
+        try:
+            return method(*args, _request_timeout=self.timeout, **kwargs)
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+
+    def reply_message(self, request):
+        """Reply using a reply token"""
+        return self._call(self.messaging_api.reply_message_with_http_info, request)
+
+    def push_message(self, request):
+        """Push message to a user"""
+        return self._call(self.messaging_api.push_message, request)
+
+    def get_profile(self, user_id: str):
+        """Get LINE user profile"""
+        return self._call(self.messaging_api.get_profile, user_id)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Connection reuse statistics from the underlying urllib3 pools"""
+        new_connections = 0
+        pool_requests = 0
+        idle_connections = 0
+        pool_manager = self.api_client.rest_client.pool_manager
+        for key in list(pool_manager.pools.keys()):
+            pool = pool_manager.pools.get(key)
+            if pool is None:
+                continue
+            new_connections += pool.num_connections
+            pool_requests += pool.num_requests
+            idle_connections += pool.pool.qsize() if pool.pool else 0
+
+        return {
+            "pool_size": self.pool_size,
+            "requests": self.stats["requests"],
+            "errors": self.stats["errors"],
+            "new_connections": new_connections,
+            "idle_connections": idle_connections,
+            "connection_reuse_percent": round((1 - new_connections / pool_requests) * 100, 2) if pool_requests else 0
+        }
+
+    def close(self):
+        """Close pooled connections (shutdown)"""
+        try:
+            self.api_client.close()
+            self.api_client.rest_client.pool_manager.clear()
+        except Exception as e:
+            logger.warning(f"⚠️  Error closing LINE client: {e}")
+
+
+# Singleton
+_line_client: Optional[LineClient] = None
+_line_client_lock = threading.Lock()
+
+def get_line_client() -> LineClient:
+    """Get pooled LINE client singleton (token from LINE_CHANNEL_ACCESS_TOKEN)"""
+    global _line_client
+    if _line_client is None:
+        with _line_client_lock:
+            if _line_client is None:
+                token = os.getenv('LINE_CHANNEL_ACCESS_TOKEN')
+                if not token:
+                    raise ValueError("LINE_CHANNEL_ACCESS_TOKEN not set")
+                _line_client = LineClient(token)
+    return _line_client
+
+
+def close_line_client():
+    """Close the shared client if it was created"""
+    if _line_client is not None:
+        _line_client.close()
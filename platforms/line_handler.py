@@ -5,6 +5,9 @@ Handles LINE Messaging API webhooks and responses
 
 import os
 import sys
+import time
+import asyncio
+import functools
 from pathlib import Path
 from typing import Dict, Any, Optional
 import logging
@@ -15,13 +18,17 @@ sys.path.append(str(Path(__file__).resolve().parents[1]))
 
 from platforms.base_handler import BaseHandler
 from platforms.session_manager import session_manager
+from platforms.work_queue import create_work_queue
+from platforms.message_debouncer import create_debouncer
+from platforms.event_dedup import get_event_deduplicator
+from platforms.profile_cache import get_profile_cache
+from platforms.line_client import get_line_client
+from database.message_writer import get_message_writer
 from core.ai_service import AIService
-from linebot.v3 import WebhookHandler
+from facebook_integration.rate_limiter import RateLimiter
+from linebot.v3 import WebhookParser
 from linebot.v3.exceptions import InvalidSignatureError
 from linebot.v3.messaging import (
-    Configuration,
-    ApiClient,
-    MessagingApi,
     ReplyMessageRequest,
     PushMessageRequest,
     TextMessage,
@@ -51,128 +58,183 @@ class LineHandler(BaseHandler):
         if not self.channel_access_token or not self.channel_secret:
             raise ValueError("LINE credentials not set in environment")
         
-        self.configuration = Configuration(access_token=self.channel_access_token)
-        self.handler = WebhookHandler(self.channel_secret)
+        # Shared keep-alive connection pool (also used by admin broadcast via send_message)
+        self.line_client = get_line_client()
+        self.parser = WebhookParser(self.channel_secret)
         self.ai_service = AIService()
         
-        # Register event handlers
-        self._register_handlers()
+        # Events are processed in the background: per-user FIFO, cross-user parallel
+        self.work_queue = create_work_queue("line", "LINE", concurrency=8, max_depth=1000)
+        # Bubbles typed in quick succession by one user become a single AI turn
+        self.debouncer = create_debouncer("line", "LINE", self._submit_text_turn)
+        # Optional per-user LLM budget (LINE_LLM_BUDGET_PER_DAY, 0 = unlimited)
+        llm_budget = int(os.getenv('LINE_LLM_BUDGET_PER_DAY', 0))
+        self.llm_budget = RateLimiter(limit_per_day=llm_budget, name="line_llm") if llm_budget > 0 else None
+        # Reply tokens expire ~1 min after the event; after this we push instead
+        self.reply_token_ttl = float(os.getenv('LINE_REPLY_TOKEN_TTL', 50))
+        self.reply_stats = {"replied": 0, "pushed": 0}
+        self.dedup = get_event_deduplicator()
+        self.profile_cache = get_profile_cache()
+        self.profile_cache.register_fetcher("line", self._fetch_profile)
         
         logger.info("✅ LINE Handler initialized")
     
-    def _register_handlers(self):
-        """Register LINE event handlers"""
+    def _dispatch_event(self, event):
+        """Route a parsed LINE event to its handler (runs in a worker thread)"""
+        if isinstance(event, MessageEvent) and isinstance(event.message, TextMessageContent):
+            self._handle_text_messages([event])
+        elif isinstance(event, FollowEvent):
+            self._handle_follow(event)
+        else:
+            logger.debug(f"Ignoring LINE event type: {getattr(event, 'type', '?')}")
+    
+    @staticmethod
+    def _is_debounceable(event) -> bool:
+        """Only 1:1 text messages are merged (group turns belong to different people)"""
+        return (
+            isinstance(event, MessageEvent)
+            and isinstance(event.message, TextMessageContent)
+            and getattr(event.source, 'type', None) == "user"
+        )
+    
+    def _submit_text_turn(self, key: str, events: list):
+        """Debouncer callback: queue one AI turn for the merged bubbles"""
+        # These events passed the capacity check and were acked when buffered (LINE won't
+        # redeliver them), so the flush may exceed max_depth instead of dropping the turn
+        self.work_queue.submit(key, functools.partial(asyncio.to_thread, self._handle_text_messages, events), force=True)
+    
+    def _handle_text_messages(self, events: list):
+        """Handle one user turn (one or more merged text bubbles): RAG + AI reply"""
+        # Reply with the newest event: its reply token is the freshest
+        event = events[-1]
+        user_id = event.source.user_id
+        texts = [e.message.text for e in events]
+        user_message = "\n".join(texts)
         
-        @self.handler.add(MessageEvent, message=TextMessageContent)
-        def handle_text_message(event):
-            user_id = event.source.user_id
-            user_message = event.message.text
-            
-            logger.info(f"LINE User {user_id}: {user_message}")
-            
-            # Save to database
-            self._save_message_to_db(user_id, user_message, "user")
-            
-            # Get session
-            session = session_manager.get_session("line", user_id)
-            
-            # Add user message to session
-            session_manager.update_session("line", user_id, {
-                "role": "user",
-                "content": user_message
-            })
-            
-            # Find relevant info using RAG
-            history = session_manager.get_conversation_history("line", user_id)
-            relevant_info = self.ai_service.find_relevant_info(user_message, history)
-            
-            # Find relevant image
-            relevant_image = self.ai_service.get_image_for_topic(user_message)
-            
-            # Prepare messages for AI
-            messages_to_send = history.copy()
-            if relevant_info:
-                context_msg = f"CONTEXT (ข้อมูลเพิ่มเติม):\n{relevant_info}\n\nคำถาม: {user_message}"
-                messages_to_send[-1] = {"role": "user", "content": context_msg}
-            
-            # Get AI response
-            response_text = ""
-            for chunk in self.ai_service.chat_completion(messages_to_send, stream=False):
-                response_text += chunk
-            
-            # Clean markdown
-            cleaned_text = self.ai_service._clean_markdown(response_text)
-            
-            # Save bot response to database
-            self._save_message_to_db(user_id, response_text, "bot")
-            
-            # Add bot response to session
-            session_manager.update_session("line", user_id, {
-                "role": "assistant",
-                "content": response_text
-            })
-            
-            # Send reply
-            with ApiClient(self.configuration) as api_client:
-                line_bot_api = MessagingApi(api_client)
-                
-                messages = [TextMessage(text=cleaned_text)]
-                
-                # Add image if available (only if public URL is configured)
-                if relevant_image:
-                    image_url = self._get_public_image_url(relevant_image)
-                    if image_url:
-                        try:
-                            line_bot_api.reply_message_with_http_info(
-                                ReplyMessageRequest(
-                                    reply_token=event.reply_token,
-                                    messages=messages + [ImageMessage(
-                                        original_content_url=image_url,
-                                        preview_image_url=image_url
-                                    )]
-                                )
-                            )
-                            return
-                        except Exception as img_err:
-                            logger.warning(f"Image send failed ({img_err}), sending text only")
-                
-                line_bot_api.reply_message_with_http_info(
+        logger.info(f"LINE User {user_id}: {user_message}")
+        
+        # Get session first: a missing session is rehydrated from the DB,
+        # which must not already contain this message
+        session_manager.get_session("line", user_id)
+        
+        # Save to database (each bubble as sent)
+        for text in texts:
+            self._save_message_to_db(user_id, text, "user")
+        
+        # Add user message to session
+        session_manager.update_session("line", user_id, {
+            "role": "user",
+            "content": user_message
+        })
+        
+        if self.llm_budget and not self.llm_budget.try_acquire(user_id):
+            self._reply(event, [TextMessage(text=os.getenv(
+                'LINE_LLM_BUDGET_MESSAGE',
+                "ขออภัยค่ะ วันนี้สอบถามครบจำนวนแล้ว แอดมินจะติดต่อกลับโดยเร็วที่สุดนะคะ"
+            ))])
+            return
+        
+        # Find relevant info using RAG
+        history = session_manager.get_conversation_history("line", user_id)
+        relevant_info = self.ai_service.find_relevant_info(user_message, history)
+        
+        # Find relevant image
+        relevant_image = self.ai_service.get_image_for_topic(user_message)
+        
+        # Prepare messages for AI
+        messages_to_send = history.copy()
+        if relevant_info:
+            context_msg = f"CONTEXT (ข้อมูลเพิ่มเติม):\n{relevant_info}\n\nคำถาม: {user_message}"
+            messages_to_send[-1] = {"role": "user", "content": context_msg}
+        
+        # Get AI response
+        response_text = ""
+        for chunk in self.ai_service.chat_completion(messages_to_send, stream=False):
+            response_text += chunk
+        
+        # Clean markdown
+        cleaned_text = self.ai_service._clean_markdown(response_text)
+        
+        # Save bot response to database
+        self._save_message_to_db(user_id, response_text, "bot")
+        
+        # Add bot response to session
+        session_manager.update_session("line", user_id, {
+            "role": "assistant",
+            "content": response_text
+        })
+        
+        # Send reply
+        messages = [TextMessage(text=cleaned_text)]
+        
+        # Add image if available (only if public URL is configured)
+        if relevant_image:
+            image_url = self._get_public_image_url(relevant_image)
+            if image_url:
+                try:
+                    self._reply(event, messages + [ImageMessage(
+                        original_content_url=image_url,
+                        preview_image_url=self._get_public_image_url(relevant_image, preview=True)
+                    )])
+                    return
+                except Exception as img_err:
+                    logger.warning(f"Image send failed ({img_err}), sending text only")
+        
+        self._reply(event, messages)
+    
+    def _handle_follow(self, event):
+        """Handle new follower: save user + welcome message"""
+        user_id = event.source.user_id
+        logger.info(f"New LINE follower: {user_id}")
+
+        # Save/create user in DB when they follow
+        self._save_message_to_db(user_id, "ติดตาม (Follow)", "user")
+        
+        welcome_message = (
+            "สวัสดีค่ะ! ยินดีต้อนรับสู่ Seoulholic Clinic นะคะ\n\n"
+            "ฉันคือ Seoul Bot แอดมินผู้ช่วยอัจฉริยะที่พร้อมตอบคำถามเกี่ยวกับ:\n"
+            "- บริการและโปรโมชั่นต่างๆ\n"
+            "- ราคาและแพ็กเกจ\n"
+            "- ที่อยู่คลินิก\n"
+            "- เวลาทำการและการจองคิว\n\n"
+            "อยากสอบถามเรื่องอะไรคะ?"
+        )
+        
+        self._reply(event, [TextMessage(text=welcome_message)])
+    
+    def _reply(self, event, messages: list):
+        """
+        Reply with the event's reply token while it is still valid,
+        otherwise (or if the reply fails) push to the user instead
+        """
+        age_seconds = time.time() - (event.timestamp or 0) / 1000
+        
+        if event.reply_token and age_seconds < self.reply_token_ttl:
+            try:
+                self.line_client.reply_message(
                     ReplyMessageRequest(
                         reply_token=event.reply_token,
                         messages=messages
                     )
                 )
+                self.reply_stats["replied"] += 1
+                return
+            except Exception as e:
+                logger.warning(f"Reply failed ({e}), falling back to push")
+        else:
+            logger.info(f"Reply token expired ({age_seconds:.1f}s old), using push")
         
-        @self.handler.add(FollowEvent)
-        def handle_follow(event):
-            user_id = event.source.user_id
-            logger.info(f"New LINE follower: {user_id}")
-
-            # Save/create user in DB when they follow
-            self._save_message_to_db(user_id, "ติดตาม (Follow)", "user")
-            
-            welcome_message = (
-                "สวัสดีค่ะ! ยินดีต้อนรับสู่ Seoulholic Clinic นะคะ\n\n"
-                "ฉันคือ Seoul Bot แอดมินผู้ช่วยอัจฉริยะที่พร้อมตอบคำถามเกี่ยวกับ:\n"
-                "- บริการและโปรโมชั่นต่างๆ\n"
-                "- ราคาและแพ็กเกจ\n"
-                "- ที่อยู่คลินิก\n"
-                "- เวลาทำการและการจองคิว\n\n"
-                "อยากสอบถามเรื่องอะไรคะ?"
+        self.line_client.push_message(
+            PushMessageRequest(
+                to=event.source.user_id,
+                messages=messages
             )
-            
-            with ApiClient(self.configuration) as api_client:
-                line_bot_api = MessagingApi(api_client)
-                line_bot_api.reply_message_with_http_info(
-                    ReplyMessageRequest(
-                        reply_token=event.reply_token,
-                        messages=[TextMessage(text=welcome_message)]
-                    )
-                )
+        )
+        self.reply_stats["pushed"] += 1
     
     async def handle_webhook(self, request: Request) -> Dict[str, Any]:
         """
-        Handle LINE webhook
+        Handle LINE webhook: verify signature, queue events, return immediately
         
         Args:
             request: FastAPI Request
@@ -190,17 +252,55 @@ class LineHandler(BaseHandler):
         body = await request.body()
         body_text = body.decode('utf-8')
         
-        # Handle webhook
+        # Verify + parse (no processing inside the request)
         try:
-            self.handler.handle(body_text, signature)
+            events = self.parser.parse(body_text, signature)
         except InvalidSignatureError:
             logger.error("Invalid LINE signature")
             raise HTTPException(status_code=400, detail="Invalid signature")
         except Exception as e:
-            logger.error(f"Error handling LINE webhook: {e}")
-            raise HTTPException(status_code=500, detail=str(e))
+            logger.error(f"Error parsing LINE webhook: {e}")
+            raise HTTPException(status_code=400, detail=str(e))
         
-        return {"status": "ok"}
+        # Redelivered events (slow ack, retries) keep the same webhookEventId —
+        # drop them before they count against capacity
+        received = len(events)
+        events = [event for event in events if self.dedup.check_and_mark("line", event.webhook_event_id)]
+        
+        # Backpressure, checked once per delivery: every new event becomes at most one job,
+        # and each buffered turn flushes into the queue too (dispatch below flushes first)
+        if not self.work_queue.has_capacity(len(events) + self.debouncer.pending_turns):
+            # Nothing was scheduled: let LINE's redelivery through
+            for event in events:
+                self.dedup.unmark("line", event.webhook_event_id)
+            self.work_queue.stats["rejected"] += len(events)
+            logger.warning(f"⚠️  LINE queue full ({self.work_queue.depth}), rejecting {len(events)} events")
+            raise HTTPException(status_code=503, detail="Busy, retry later", headers={"Retry-After": "5"})
+        
+        queued = 0
+        for event in events:
+            source = event.source
+            key = getattr(source, 'user_id', None) or getattr(source, 'group_id', None) or getattr(source, 'room_id', None) or "unknown"
+            if self._is_debounceable(event):
+                self.debouncer.add(key, event)
+            else:
+                # Keep per-user order: anything buffered for this key goes first
+                self.debouncer.flush(key)
+                if not self.work_queue.submit(key, functools.partial(asyncio.to_thread, self._dispatch_event, event)):
+                    continue
+            queued += 1
+        
+        return {"status": "ok", "queued": queued, "duplicates": received - len(events)}
+    
+    def get_queue_stats(self) -> Dict[str, Any]:
+        """Background queue + reply/push statistics"""
+        return {
+            **self.work_queue.get_stats(),
+            **self.reply_stats,
+            "debounce": self.debouncer.get_stats(),
+            "llm_budget": self.llm_budget.get_stats() if self.llm_budget else None,
+            "http": self.line_client.get_stats()
+        }
     
     async def send_message(self, user_id: str, message: Dict[str, Any]) -> bool:
         """
@@ -214,24 +314,23 @@ class LineHandler(BaseHandler):
             Success status
         """
         try:
-            with ApiClient(self.configuration) as api_client:
-                line_bot_api = MessagingApi(api_client)
-                
-                messages = []
-                if 'text' in message:
-                    messages.append(TextMessage(text=message['text']))
-                if 'image_url' in message:
-                    messages.append(ImageMessage(
-                        original_content_url=message['image_url'],
-                        preview_image_url=message['image_url']
-                    ))
-                
-                line_bot_api.push_message(
-                    PushMessageRequest(
-                        to=user_id,
-                        messages=messages
-                    )
+            messages = []
+            if 'text' in message:
+                messages.append(TextMessage(text=message['text']))
+            if 'image_url' in message:
+                messages.append(ImageMessage(
+                    original_content_url=message['image_url'],
+                    preview_image_url=message['image_url']
+                ))
+            
+            # Blocking HTTP call on the shared pool — keep it off the event loop
+            await asyncio.to_thread(
+                self.line_client.push_message,
+                PushMessageRequest(
+                    to=user_id,
+                    messages=messages
                 )
+            )
             
             logger.info(f"Message sent to LINE user {user_id}")
             return True
@@ -250,22 +349,34 @@ class LineHandler(BaseHandler):
             User profile dict
         """
         try:
-            with ApiClient(self.configuration) as api_client:
-                line_bot_api = MessagingApi(api_client)
-                profile = line_bot_api.get_profile(user_id)
-                
-                return {
-                    "user_id": profile.user_id,
-                    "display_name": profile.display_name,
-                    "picture_url": profile.picture_url,
-                    "status_message": profile.status_message
-                }
+            profile = await asyncio.to_thread(self.line_client.get_profile, user_id)
+            
+            return {
+                "user_id": profile.user_id,
+                "display_name": profile.display_name,
+                "picture_url": profile.picture_url,
+                "status_message": profile.status_message
+            }
         except Exception as e:
             logger.error(f"Error getting LINE profile: {e}")
             return None
     
-    def _get_public_image_url(self, image_name: str) -> Optional[str]:
-        """Convert image filename to public URL — only if file exists locally"""
+    def _fetch_profile(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Blocking LINE get_profile call used by the profile cache"""
+        try:
+            profile = self.line_client.get_profile(user_id)
+            return {
+                "display_name": profile.display_name,
+                "profile_pic": profile.picture_url
+            }
+        except Exception as e:
+            logger.warning(f"Could not fetch LINE profile for {user_id}: {e}")
+            return None
+    
+    def _get_public_image_url(self, image_name: str, preview: bool = False) -> Optional[str]:
+        """Convert image filename to public URL — only if file exists locally
+        
+        preview=True returns the small thumbnail variant for preview_image_url"""
         # Check file exists in data/img/
         img_path = Path(__file__).resolve().parents[1] / "data" / "img" / image_name
         if not img_path.exists():
@@ -277,71 +388,18 @@ class LineHandler(BaseHandler):
             logger.warning("No PUBLIC_URL or NGROK_URL set — cannot serve images")
             return None
         base_url = base_url.rstrip("/")
-        # LINE only accepts JPEG — use conversion endpoint
+        # LINE only accepts JPEG — use pre-rendered JPEG variant endpoints
+        if preview:
+            return f"{base_url}/img-jpeg/preview/{image_name}"
         url = f"{base_url}/img-jpeg/{image_name}"
         logger.info(f"Image URL (JPEG): {url}")
         return url
     
     def _save_message_to_db(self, user_id: str, message: str, sender_type: str):
-        """Save message to database"""
-        try:
-            from database.crud import get_crud
-            from database.connection import db_manager
-            
-            # Check if database is available
-            if not db_manager or not db_manager._engine:
-                return
-            
-            crud = get_crud()
-
-            # Try to fetch LINE profile for display_name and profile_pic
-            display_name = None
-            profile_pic_url = None
-            try:
-                with ApiClient(self.configuration) as api_client:
-                    line_bot_api = MessagingApi(api_client)
-                    profile = line_bot_api.get_profile(user_id)
-                    display_name = profile.display_name
-                    profile_pic_url = profile.picture_url
-            except Exception as profile_err:
-                logger.warning(f"Could not fetch LINE profile for {user_id}: {profile_err}")
-            
-            # Get or create user
-            user = crud.get_or_create_user(
-                platform="line",
-                platform_user_id=user_id,
-                display_name=display_name,
-                profile_pic_url=profile_pic_url
-            )
-            
-            if not user:
-                return
-            
-            # Get or create conversation
-            conversation = crud.get_active_conversation(
-                user_id=user.id,
-                platform="line"
-            )
-            
-            if not conversation:
-                conversation = crud.create_conversation(
-                    user_id=user.id,
-                    platform="line",
-                    conversation_type="personal"
-                )
-            
-            if not conversation:
-                return
-            
-            # Save message
-            crud.save_message(
-                conversation_id=conversation.id,
-                sender_type=sender_type,
-                content=message,
-                message_type="text"
-            )
-            
-            logger.debug(f"✅ Saved {sender_type} message to database")
-            
-        except Exception as e:
-            logger.error(f"❌ Error saving message to database: {e}")
+        """Queue message for the background DB writer (never blocks the reply)"""
+        get_message_writer().enqueue(
+            platform="line",
+            platform_user_id=user_id,
+            sender_type=sender_type,
+            content=message
+        )
@@ -0,0 +1,139 @@
+"""
+Message Debouncer - รวมข้อความหลาย bubble ที่ผู้ใช้พิมพ์ติดกันเป็น turn เดียว
+เช่น "สวัสดีค่ะ" / "อยากถาม" / "ฟิลเลอร์ราคาเท่าไหร่" → เรียก LLM ครั้งเดียว ตอบครั้งเดียว
+
+- หน้าต่างต่อ key (user): ทุกข้อความใหม่เลื่อนเวลา flush ออกไปอีก `window` วินาที
+- `max_wait` จำกัดเวลารอรวม คนที่พิมพ์ไม่หยุดก็ยังได้คำตอบ
+- ใช้ loop.call_later — ไม่มี task ค้างต่อ user และไม่บล็อก user อื่น
+"""
+
+import asyncio
+import os
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# on_flush(key, items) — called on the event loop thread
+FlushCallback = Callable[[str, List[Any]], None]
+
+
+@dataclass(slots=True)
+class _PendingTurn:
+    first_at: float
+    items: List[Any] = field(default_factory=list)
+    timer: Optional[asyncio.TimerHandle] = None
+
+
+class MessageDebouncer:
+    """Per-key trailing-edge debounce with a hard max wait"""
+
+    def __init__(self, name: str, on_flush: FlushCallback, window: float = 1.2, max_wait: float = 4.0):
+        """
+        Initialize debouncer
+
+        Args:
+            name: Name for logs / stats
+            on_flush: Receives the buffered items (in arrival order) for one key
+            window: Quiet time (seconds) after the last item before flushing; 0 disables merging
+            max_wait: Max seconds the first item of a turn may wait
+        """
+        self.name = name
+        self.on_flush = on_flush
+        self.window = window
+        self.max_wait = max(max_wait, window)
+
+        self._pending: Dict[str, _PendingTurn] = {}
+
+        self.stats = {
+            "messages": 0,
+            "turns": 0,
+            "max_turn_size": 0
+        }
+
+        logger.info(f"⏱️  Debouncer '{name}' ready (window={window}s, max_wait={self.max_wait}s)")
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    @property
+    def pending_turns(self) -> int:
+        """Buffered turns that will each become one flush"""
+        return len(self._pending)
+
+    def add(self, key: str, item: Any):
+        """Buffer an item for `key` (must be called from the event loop thread)"""
+        self.stats["messages"] += 1
+        if not self.enabled:
+            self._emit(key, [item])
+            return
+
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        turn = self._pending.get(key)
+        if turn is None:
+            turn = _PendingTurn(first_at=now)
+            self._pending[key] = turn
+        elif turn.timer is not None:
+            turn.timer.cancel()
+
+        turn.items.append(item)
+        remaining = turn.first_at + self.max_wait - now
+        if remaining <= 0:
+            self.flush(key)
+            return
+        turn.timer = loop.call_later(min(self.window, remaining), self.flush, key)
+
+    def flush(self, key: str):
+        """Flush `key` now (e.g. before a non-text event for the same user)"""
+        turn = self._pending.pop(key, None)
+        if turn is None:
+            return
+        if turn.timer is not None:
+            turn.timer.cancel()
+        self._emit(key, turn.items)
+
+    def flush_all(self):
+        """Flush every pending turn (shutdown)"""
+        for key in list(self._pending.keys()):
+            self.flush(key)
+
+    def _emit(self, key: str, items: List[Any]):
+        self.stats["turns"] += 1
+        self.stats["max_turn_size"] = max(self.stats["max_turn_size"], len(items))
+        if len(items) > 1:
+            logger.info(f"🧩 Debouncer '{self.name}': merged {len(items)} messages from {key}")
+        try:
+            self.on_flush(key, items)
+        except Exception as e:
+            logger.error(f"❌ Debouncer '{self.name}' flush error for {key}: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Debounce statistics (llm_calls_saved = messages merged into an earlier turn)"""
+        pending_messages = sum(len(turn.items) for turn in self._pending.values())
+        flushed = self.stats["messages"] - pending_messages
+        return {
+            **self.stats,
+            "window_seconds": self.window,
+            "max_wait_seconds": self.max_wait,
+            "pending_turns": len(self._pending),
+            "llm_calls_saved": flushed - self.stats["turns"],
+            "avg_turn_size": round(flushed / self.stats["turns"], 2) if self.stats["turns"] else 0
+        }
+
+
+def create_debouncer(name: str, prefix: str, on_flush: FlushCallback, window: float = 1.2, max_wait: float = 4.0) -> MessageDebouncer:
+    """
+    Create debouncer with env overrides
+
+    Reads {prefix}_DEBOUNCE_WINDOW and {prefix}_DEBOUNCE_MAX_WAIT (seconds)
+    """
+    return MessageDebouncer(
+        name,
+        on_flush,
+        window=float(os.getenv(f'{prefix}_DEBOUNCE_WINDOW', window)),
+        max_wait=float(os.getenv(f'{prefix}_DEBOUNCE_MAX_WAIT', max_wait))
+    )
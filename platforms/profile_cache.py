@@ -0,0 +1,265 @@
+"""
+Platform Profile Cache
+Cache ชื่อ/รูปโปรไฟล์ผู้ใช้ (LINE / Messenger / Instagram) ไม่ต้องเรียก API ทุกข้อความ
+
+- Bounded LRU + TTL, key = (platform, user_id)
+- Stale-while-revalidate: ข้อมูลหมดอายุจะถูกใช้ต่อ แล้ว refresh เบื้องหลัง
+- Single-flight: เรียก API พร้อมกันสำหรับ user เดียวกันได้แค่ครั้งเดียว
+- Persist ผ่าน users.display_name / users.profile_pic_url (รอด restart)
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# fetch(user_id) -> {"display_name": ..., "profile_pic": ...} or None
+ProfileFetcher = Callable[[str], Optional[Dict[str, Any]]]
+CacheKey = Tuple[str, str]
+
+
+@dataclass(slots=True)
+class _ProfileEntry:
+    profile: Optional[Dict[str, Any]]
+    fetched_at: float
+    ttl: float
+
+    def is_fresh(self, now: float) -> bool:
+        return now - self.fetched_at < self.ttl
+
+
+class ProfileCache:
+    """Shared profile cache for all platform handlers"""
+
+    def __init__(self, max_entries: int = None, ttl_seconds: int = None, negative_ttl_seconds: int = None):
+        """
+        Initialize profile cache
+
+        Args:
+            max_entries: LRU bound
+            ttl_seconds: Profile freshness (after this it is refreshed in background)
+            negative_ttl_seconds: How long a failed lookup is remembered
+        """
+        self.max_entries = max_entries or int(os.getenv('PROFILE_CACHE_MAX_ENTRIES', 10000))
+        self.ttl_seconds = ttl_seconds or int(os.getenv('PROFILE_CACHE_TTL', 3600 * 24))
+        self.negative_ttl_seconds = negative_ttl_seconds or int(os.getenv('PROFILE_CACHE_NEGATIVE_TTL', 3600))
+        self.fetch_timeout = float(os.getenv('PROFILE_FETCH_TIMEOUT', 10))
+
+        self._entries: "OrderedDict[CacheKey, _ProfileEntry]" = OrderedDict()
+        self._inflight: Dict[CacheKey, Future] = {}
+        self._refreshing: Set[CacheKey] = set()
+        self._fetchers: Dict[str, ProfileFetcher] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="profile-refresh")
+
+        self.stats = {
+            "hits": 0,
+            "stale_hits": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "db_hits": 0,
+            "api_calls": 0,
+            "api_failures": 0,
+            "background_refreshes": 0,
+            "evictions": 0
+        }
+
+        logger.info(f"👤 Profile cache initialized (max={self.max_entries}, ttl={self.ttl_seconds}s)")
+
+    def register_fetcher(self, platform: str, fetcher: ProfileFetcher):
+        """Register the (blocking) API call used to load a profile for a platform"""
+        self._fetchers[platform] = fetcher
+
+    # ------------------------------------------------------------------
+    # Public lookups
+    # ------------------------------------------------------------------
+
+    def get(self, platform: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """Get profile (sync — for worker threads)"""
+        cached, future, is_owner = self._lookup((platform, user_id))
+        if future is None:
+            return cached
+        if is_owner:
+            self._load(platform, user_id, future)
+        try:
+            return future.result(timeout=self.fetch_timeout)
+        except Exception:
+            return None
+
+    async def aget(self, platform: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """Get profile (async — blocking fetch runs in a thread)"""
+        cached, future, is_owner = self._lookup((platform, user_id))
+        if future is None:
+            return cached
+        if is_owner:
+            await asyncio.to_thread(self._load, platform, user_id, future)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout=self.fetch_timeout)
+        except Exception:
+            return None
+
+    def invalidate(self, platform: str, user_id: str):
+        """Drop a cached profile"""
+        with self._lock:
+            self._entries.pop((platform, user_id), None)
+
+    # ------------------------------------------------------------------
+    # Internals
+    # ------------------------------------------------------------------
+
+    def _lookup(self, key: CacheKey) -> Tuple[Optional[Dict[str, Any]], Optional[Future], bool]:
+        """
+        Returns (profile, None, False) when served from cache, otherwise
+        (None, future, is_owner) — only the owner performs the load
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                if entry.is_fresh(now):
+                    self.stats["hits"] += 1
+                else:
+                    # Serve stale, refresh off the request path
+                    self.stats["stale_hits"] += 1
+                    self._schedule_refresh(key)
+                return entry.profile, None, False
+
+            future = self._inflight.get(key)
+            if future is not None:
+                self.stats["coalesced"] += 1
+                return None, future, False
+
+            self.stats["misses"] += 1
+            future = Future()
+            self._inflight[key] = future
+            return None, future, True
+
+    def _load(self, platform: str, user_id: str, future: Future):
+        """Miss path (owner only): persisted profile first, then the platform API"""
+        key = (platform, user_id)
+        profile = None
+        try:
+            persisted = self._load_persisted(platform, user_id)
+            if persisted is not None:
+                self.stats["db_hits"] += 1
+                profile = persisted
+                # Known user after a restart: serve the stored name now, refresh later
+                self._store(key, persisted, fetched_at=0.0)
+                with self._lock:
+                    self._schedule_refresh(key)
+            else:
+                profile = self._fetch(platform, user_id)
+                self._store(key, profile)
+                if profile:
+                    self._persist(platform, user_id, profile)
+        except Exception as e:
+            logger.error(f"❌ Profile load error ({platform}:{user_id}): {e}")
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_result(profile)
+
+    def _fetch(self, platform: str, user_id: str) -> Optional[Dict[str, Any]]:
+        fetcher = self._fetchers.get(platform)
+        if fetcher is None:
+            return None
+        self.stats["api_calls"] += 1
+        try:
+            profile = fetcher(user_id)
+        except Exception as e:
+            logger.warning(f"⚠️  Profile fetch failed ({platform}:{user_id}): {e}")
+            profile = None
+        if profile is None:
+            self.stats["api_failures"] += 1
+        return profile
+
+    def _store(self, key: CacheKey, profile: Optional[Dict[str, Any]], fetched_at: float = None):
+        ttl = self.ttl_seconds if profile else self.negative_ttl_seconds
+        with self._lock:
+            self._entries[key] = _ProfileEntry(profile, time.time() if fetched_at is None else fetched_at, ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def _schedule_refresh(self, key: CacheKey):
+        """Queue one background refresh per key (caller may hold the lock)"""
+        if key in self._refreshing:
+            return
+        self._refreshing.add(key)
+        self._executor.submit(self._refresh, key)
+
+    def _refresh(self, key: CacheKey):
+        platform, user_id = key
+        try:
+            self.stats["background_refreshes"] += 1
+            profile = self._fetch(platform, user_id)
+            if profile:
+                self._store(key, profile)
+                self._persist(platform, user_id, profile)
+            else:
+                # Keep the last known profile, retry after the negative TTL
+                with self._lock:
+                    entry = self._entries.get(key)
+                    if entry is not None:
+                        entry.fetched_at = time.time()
+                        entry.ttl = self.negative_ttl_seconds
+        except Exception as e:
+            logger.error(f"❌ Profile refresh error ({platform}:{user_id}): {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _load_persisted(self, platform: str, user_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            from database.crud import get_crud
+            return get_crud().get_user_profile_fields(platform, user_id)
+        except Exception:
+            return None
+
+    def _persist(self, platform: str, user_id: str, profile: Dict[str, Any]):
+        try:
+            from database.crud import get_crud
+            get_crud().update_user_profile(
+                platform=platform,
+                platform_user_id=user_id,
+                display_name=profile.get("display_name"),
+                profile_pic_url=profile.get("profile_pic")
+            )
+        except Exception:
+            pass
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Cache statistics"""
+        lookups = self.stats["hits"] + self.stats["stale_hits"] + self.stats["misses"] + self.stats["coalesced"]
+        served = self.stats["hits"] + self.stats["stale_hits"] + self.stats["coalesced"] + self.stats["db_hits"]
+        return {
+            **self.stats,
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "inflight": len(self._inflight),
+            "hit_rate_percent": round(served / lookups * 100, 2) if lookups else 0
+        }
+
+
+# Singleton
+_profile_cache = None
+_profile_cache_lock = threading.Lock()
+
+def get_profile_cache() -> ProfileCache:
+    """Get Profile Cache singleton"""
+    global _profile_cache
+    if _profile_cache is None:
+        with _profile_cache_lock:
+            if _profile_cache is None:
+                _profile_cache = ProfileCache()
+    return _profile_cache
@@ -3,14 +3,87 @@ Unified Session Manager
 Manages user sessions across all platforms (LINE, Facebook, Instagram)
 """
 
+import heapq
+import json
+import os
+import sys
+import threading
 import time
-from typing import Dict, List, Optional, Any
+from collections import deque
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import Deque, Dict, List, Optional, Any, Tuple
 from datetime import datetime, timedelta
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+# Conversation turns kept per session (system prompt is not stored)
+MAX_HISTORY = 20
+
+
+@dataclass(slots=True)
+class Session:
+    """
+    Compact per-user session record
+
+    The system prompt is NOT copied into history — only its version
+    (content hash) is stored; the prompt text is re-attached when the
+    conversation is assembled for the model
+    """
+    platform: str
+    user_id: str
+    prompt_version: str
+    created_at: float = field(default_factory=time.time)
+    last_active: float = field(default_factory=time.time)
+    history: Deque[Dict[str, str]] = field(default_factory=lambda: deque(maxlen=MAX_HISTORY))
+    message_count: int = 0
+    tags: List[str] = field(default_factory=list)
+    interests: List[str] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serializable form (Redis)"""
+        return {
+            "platform": self.platform,
+            "user_id": self.user_id,
+            "prompt_version": self.prompt_version,
+            "created_at": self.created_at,
+            "last_active": self.last_active,
+            "history": list(self.history),
+            "metadata": {
+                "message_count": self.message_count,
+                "tags": self.tags,
+                "interests": self.interests
+            }
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Session":
+        """Load from dict (also accepts the old format with the prompt in history[0])"""
+        metadata = data.get("metadata", {})
+        history = [m for m in data.get("history", []) if m.get("role") != "system"]
+        return cls(
+            platform=data["platform"],
+            user_id=data["user_id"],
+            prompt_version=data.get("prompt_version", ""),
+            created_at=data.get("created_at", time.time()),
+            last_active=data.get("last_active", time.time()),
+            history=deque(history, maxlen=MAX_HISTORY),
+            message_count=metadata.get("message_count", 0),
+            tags=metadata.get("tags", []),
+            interests=metadata.get("interests", [])
+        )
+
+    def estimate_size_bytes(self) -> int:
+        """Approximate memory footprint (record + history messages)"""
+        size = sys.getsizeof(self) + sys.getsizeof(self.history)
+        for message in self.history:
+            size += sys.getsizeof(message)
+            size += sum(sys.getsizeof(value) for value in message.values())
+        return size
+
+
 class SessionManager:
     """
     Unified session manager for multi-platform chatbot
@@ -25,13 +98,28 @@ class SessionManager:
             use_redis: Use Redis for persistent storage
         """
         self.use_redis = use_redis
-        self.sessions: Dict[str, Dict[str, Any]] = {}
+        self.sessions: Dict[str, Session] = {}
         self.session_ttl = 3600 * 24  # 24 hours
+        self._prompt_cache: Optional[Tuple[str, str]] = None
+        
+        # Expiry index: min-heap of (last_active, key). Touching a session pushes
+        # a new entry (O(log n)); outdated entries are skipped when popped
+        self._expiry_heap: List[Tuple[float, str]] = []
+        self._lock = threading.RLock()
+        # Maintained incrementally so stats are O(1)
+        self._platform_counts: Dict[str, int] = {}
+        self._evicted_total = 0
+        self._last_sweep: Optional[Dict[str, Any]] = None
+        self._sweeper_thread: Optional[threading.Thread] = None
+        self._sweeper_stop = threading.Event()
+        
+        # Lazy rehydration from the messages table (after restart / worker handoff)
+        self.rehydrate_enabled = os.getenv('SESSION_REHYDRATE', 'true').lower() == 'true'
+        self.rehydrate_stats = {"attempts": 0, "hits": 0, "misses": 0, "total_ms": 0.0, "max_ms": 0.0}
         
         if use_redis:
             try:
                 import redis
-                import os
                 self.redis_client = redis.Redis(
                     host=os.getenv('REDIS_HOST', 'localhost'),
                     port=int(os.getenv('REDIS_PORT', 6379)),
@@ -50,7 +138,7 @@ class SessionManager:
         """Generate session key"""
         return f"{platform}_{user_id}"
     
-    def get_session(self, platform: str, user_id: str) -> Dict[str, Any]:
+    def get_session(self, platform: str, user_id: str) -> Session:
         """
         Get user session
         
@@ -59,52 +147,126 @@ class SessionManager:
             user_id: Platform-specific user ID
             
         Returns:
-            Session dict with conversation history
+            Session record with conversation history
         """
         session_key = self._get_session_key(platform, user_id)
         
         # Try Redis first
         if self.use_redis:
             try:
-                import json
-                session_data = self.redis_client.get(f"session:{session_key}")
-                if session_data:
-                    return json.loads(session_data)
+                session = self._redis_load(session_key)
+                if session is not None:
+                    return session
             except Exception as e:
                 logger.error(f"Redis get error: {e}")
         
         # Fallback to memory
-        if session_key not in self.sessions:
-            self.sessions[session_key] = self._create_new_session(platform, user_id)
+        with self._lock:
+            session = self.sessions.get(session_key)
+            
+            # Check if session expired (the sweeper may not have run yet)
+            if session is not None and time.time() - session.last_active > self.session_ttl:
+                logger.info(f"Session expired for {session_key}, creating new one")
+                session = None
+                self._remove(session_key)
+        
+        if session is not None:
+            return session
         
-        session = self.sessions[session_key]
+        # No live session (restart / other worker) — rebuild from the messages table
+        session = self._rehydrate(platform, user_id) or self._create_new_session(platform, user_id)
+        with self._lock:
+            # Another thread may have created it while we were querying
+            existing = self.sessions.get(session_key)
+            if existing is not None:
+                return existing
+            self._store(session_key, session)
         
-        # Check if session expired
-        if time.time() - session['last_active'] > self.session_ttl:
-            logger.info(f"Session expired for {session_key}, creating new one")
-            self.sessions[session_key] = self._create_new_session(platform, user_id)
+        if self.use_redis and session.history:
+            try:
+                self._redis_write_full(session_key, session)
+            except Exception as e:
+                logger.error(f"Redis set error: {e}")
         
-        return self.sessions[session_key]
+        return session
     
-    def _create_new_session(self, platform: str, user_id: str) -> Dict[str, Any]:
-        """Create new session"""
+    def _rehydrate(self, platform: str, user_id: str) -> Optional[Session]:
+        """
+        Lazy rehydration: load the last MAX_HISTORY messages of the user's
+        active conversation (one indexed query). Returns None if there is
+        nothing recent enough to resume
+        """
+        if not self.rehydrate_enabled:
+            return None
+        
+        started = time.perf_counter()
+        self.rehydrate_stats["attempts"] += 1
+        try:
+            from database.crud import get_crud
+            messages = get_crud().get_recent_messages_for_user(platform, user_id, limit=MAX_HISTORY)
+        except Exception as e:
+            logger.debug(f"Session rehydration unavailable: {e}")
+            messages = []
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.rehydrate_stats["total_ms"] += elapsed_ms
+            self.rehydrate_stats["max_ms"] = max(self.rehydrate_stats["max_ms"], elapsed_ms)
+        
+        # Only resume conversations that would still be within the session TTL
+        last_at = messages[-1]["created_at"] if messages else None
+        if not last_at or (datetime.utcnow() - last_at).total_seconds() > self.session_ttl:
+            self.rehydrate_stats["misses"] += 1
+            return None
+        
+        self.rehydrate_stats["hits"] += 1
+        session = self._create_new_session(platform, user_id)
+        session.history.extend({"role": m["role"], "content": m["content"]} for m in messages)
+        session.message_count = len(messages)
+        logger.info(f"♻️  Rehydrated {platform}_{user_id} with {len(messages)} messages ({elapsed_ms:.1f}ms)")
+        return session
+    
+    # ------------------------------------------------------------------
+    # In-memory index (callers hold self._lock)
+    # ------------------------------------------------------------------
+    
+    def _store(self, session_key: str, session: Session):
+        """Insert/replace a session and index its expiry"""
+        previous = self.sessions.get(session_key)
+        if previous is not None:
+            self._platform_counts[previous.platform] -= 1
+        self.sessions[session_key] = session
+        self._platform_counts[session.platform] = self._platform_counts.get(session.platform, 0) + 1
+        self._index(session_key, session)
+    
+    def _index(self, session_key: str, session: Session):
+        """Record the (new) last_active of a session — O(log n)"""
+        heapq.heappush(self._expiry_heap, (session.last_active, session_key))
+        # Keep outdated entries from piling up for very chatty users
+        if len(self._expiry_heap) > 4 * len(self.sessions) + 1024:
+            self._expiry_heap = [(s.last_active, k) for k, s in self.sessions.items()]
+            heapq.heapify(self._expiry_heap)
+    
+    def _remove(self, session_key: str) -> bool:
+        """Remove a session (its heap entries become outdated and are skipped)"""
+        session = self.sessions.pop(session_key, None)
+        if session is None:
+            return False
+        self._platform_counts[session.platform] -= 1
+        return True
+    
+    def _get_system_prompt(self) -> Tuple[str, str]:
+        """Current (version, text) of the system prompt — shared by all sessions"""
         from core.ai_service import AIService
         ai_service = AIService()
-        
-        return {
-            "platform": platform,
-            "user_id": user_id,
-            "created_at": time.time(),
-            "last_active": time.time(),
-            "history": [
-                {"role": "system", "content": ai_service.get_system_prompt()}
-            ],
-            "metadata": {
-                "message_count": 0,
-                "tags": [],
-                "interests": []
-            }
-        }
+        prompt = ai_service.get_system_prompt()
+        if self._prompt_cache is None or self._prompt_cache[1] != prompt:
+            self._prompt_cache = (ai_service.get_system_prompt_version(), prompt)
+        return self._prompt_cache
+    
+    def _create_new_session(self, platform: str, user_id: str) -> Session:
+        """Create new session"""
+        prompt_version, _ = self._get_system_prompt()
+        return Session(platform=platform, user_id=user_id, prompt_version=prompt_version)
     
     def update_session(self, platform: str, user_id: str, message: Dict[str, str]):
         """
@@ -116,94 +278,283 @@ class SessionManager:
             message: Message dict with 'role' and 'content'
         """
         session_key = self._get_session_key(platform, user_id)
-        session = self.get_session(platform, user_id)
         
-        # Add message to history
-        session['history'].append(message)
-        session['last_active'] = time.time()
-        session['metadata']['message_count'] += 1
+        # Update in memory (local copy; Redis is the shared source of truth)
+        with self._lock:
+            session = self.sessions.get(session_key)
+            if session is None or time.time() - session.last_active > self.session_ttl:
+                session = None
         
-        # Limit history size (keep last 20 messages + system prompt)
-        if len(session['history']) > 21:
-            system_prompt = session['history'][0]
-            recent_messages = session['history'][-20:]
-            session['history'] = [system_prompt] + recent_messages
+        if session is None:
+            # Same path as get_session (Redis → rehydrate from DB → new)
+            session = self.get_session(platform, user_id)
         
-        # Update in memory
-        self.sessions[session_key] = session
+        with self._lock:
+            # Add message to history (deque keeps only the last MAX_HISTORY)
+            session.history.append(message)
+            session.last_active = time.time()
+            session.message_count += 1
+            self._index(session_key, session)
         
-        # Update in Redis
+        # Update in Redis — append only, no read-modify-write of the whole session
         if self.use_redis:
             try:
-                import json
-                self.redis_client.setex(
-                    f"session:{session_key}",
-                    self.session_ttl,
-                    json.dumps(session)
-                )
+                self._redis_append(session_key, session, message)
             except Exception as e:
                 logger.error(f"Redis set error: {e}")
     
+    # ------------------------------------------------------------------
+    # Redis schema
+    #   session:{key}:history  LIST of JSON messages, capped with LTRIM
+    #   session:{key}:meta     HASH (platform, user_id, prompt_version,
+    #                          created_at, last_active, message_count, ...)
+    # Both keys share the session TTL, refreshed on every append
+    # ------------------------------------------------------------------
+    
+    def _redis_keys(self, session_key: str) -> Tuple[str, str]:
+        return f"session:{session_key}:history", f"session:{session_key}:meta"
+    
+    def _redis_append(self, session_key: str, session: Session, message: Dict[str, str]):
+        """Append one message + touch metadata + refresh TTL in a single MULTI round trip"""
+        history_key, meta_key = self._redis_keys(session_key)
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.rpush(history_key, json.dumps(message, ensure_ascii=False))
+        pipe.ltrim(history_key, -MAX_HISTORY, -1)
+        # Fields only written when the session is first created in Redis
+        pipe.hsetnx(meta_key, "platform", session.platform)
+        pipe.hsetnx(meta_key, "user_id", session.user_id)
+        pipe.hsetnx(meta_key, "created_at", session.created_at)
+        pipe.hsetnx(meta_key, "tags", json.dumps(session.tags))
+        pipe.hsetnx(meta_key, "interests", json.dumps(session.interests))
+        pipe.hset(meta_key, mapping={
+            "prompt_version": session.prompt_version,
+            "last_active": session.last_active
+        })
+        pipe.hincrby(meta_key, "message_count", 1)
+        pipe.expire(history_key, self.session_ttl)
+        pipe.expire(meta_key, self.session_ttl)
+        pipe.execute()
+    
+    def _redis_load(self, session_key: str) -> Optional[Session]:
+        """Read metadata + history in one round trip"""
+        history_key, meta_key = self._redis_keys(session_key)
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.hgetall(meta_key)
+        pipe.lrange(history_key, 0, -1)
+        meta, history = pipe.execute()
+        
+        if not meta:
+            return self._redis_migrate_legacy(session_key)
+        
+        session = Session(
+            platform=meta.get("platform", ""),
+            user_id=meta.get("user_id", ""),
+            prompt_version=meta.get("prompt_version", ""),
+            created_at=float(meta.get("created_at", time.time())),
+            last_active=float(meta.get("last_active", time.time())),
+            history=deque((json.loads(item) for item in history), maxlen=MAX_HISTORY),
+            message_count=int(meta.get("message_count", 0)),
+            tags=json.loads(meta.get("tags", "[]")),
+            interests=json.loads(meta.get("interests", "[]"))
+        )
+        with self._lock:
+            self._store(session_key, session)
+        return session
+    
+    def _redis_write_full(self, session_key: str, session: Session):
+        """Write a whole session (migration / rehydration) in one MULTI round trip"""
+        history_key, meta_key = self._redis_keys(session_key)
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.delete(history_key)
+        if session.history:
+            pipe.rpush(history_key, *(json.dumps(m, ensure_ascii=False) for m in session.history))
+        pipe.hset(meta_key, mapping={
+            "platform": session.platform,
+            "user_id": session.user_id,
+            "prompt_version": session.prompt_version,
+            "created_at": session.created_at,
+            "last_active": session.last_active,
+            "message_count": session.message_count,
+            "tags": json.dumps(session.tags),
+            "interests": json.dumps(session.interests)
+        })
+        pipe.expire(history_key, self.session_ttl)
+        pipe.expire(meta_key, self.session_ttl)
+        pipe.execute()
+    
+    def _redis_migrate_legacy(self, session_key: str) -> Optional[Session]:
+        """Convert an old whole-JSON session (session:{key}) to the list/hash schema"""
+        legacy_key = f"session:{session_key}"
+        session_data = self.redis_client.get(legacy_key)
+        if not session_data:
+            return None
+        
+        session = Session.from_dict(json.loads(session_data))
+        self._redis_write_full(session_key, session)
+        self.redis_client.delete(legacy_key)
+        
+        with self._lock:
+            self._store(session_key, session)
+        return session
+    
     def get_conversation_history(self, platform: str, user_id: str) -> List[Dict[str, str]]:
-        """Get conversation history for user"""
+        """
+        Get conversation history for user, ready to send to the model
+        (system prompt re-attached here, at prompt-assembly time)
+        """
         session = self.get_session(platform, user_id)
-        return session['history']
+        prompt_version, prompt = self._get_system_prompt()
+        if session.prompt_version != prompt_version:
+            # Prompt changed since the session started — always use the current one
+            session.prompt_version = prompt_version
+        return [{"role": "system", "content": prompt}] + list(session.history)
     
     def clear_session(self, platform: str, user_id: str):
         """Clear user session"""
         session_key = self._get_session_key(platform, user_id)
         
         # Clear from memory
-        if session_key in self.sessions:
-            del self.sessions[session_key]
+        with self._lock:
+            self._remove(session_key)
         
         # Clear from Redis
         if self.use_redis:
             try:
-                self.redis_client.delete(f"session:{session_key}")
+                self.redis_client.delete(f"session:{session_key}", *self._redis_keys(session_key))
             except Exception as e:
                 logger.error(f"Redis delete error: {e}")
         
         logger.info(f"Session cleared for {session_key}")
     
     def get_active_sessions_count(self) -> int:
-        """Get count of active sessions"""
-        cutoff = time.time() - self.session_ttl
-        active = sum(1 for s in self.sessions.values() if s['last_active'] > cutoff)
-        return active
+        """Get count of active sessions (tracked minus expired-but-not-yet-swept)"""
+        with self._lock:
+            return len(self.sessions) - self._count_expired(time.time() - self.session_ttl)
+    
+    def _count_expired(self, cutoff: float) -> int:
+        """
+        Sessions past the TTL still in memory (caller holds the lock)
+        Walks only the heap entries older than `cutoff` — a subtree whose root
+        is newer can't contain older entries — so this is O(expired), not O(n)
+        """
+        heap = self._expiry_heap
+        expired = 0
+        stack = [0] if heap else []
+        while stack:
+            index = stack.pop()
+            last_active, session_key = heap[index]
+            if last_active >= cutoff:
+                continue
+            session = self.sessions.get(session_key)
+            if session is not None and session.last_active == last_active:
+                expired += 1
+            stack.extend(child for child in (2 * index + 1, 2 * index + 2) if child < len(heap))
+        return expired
     
     def get_session_stats(self) -> Dict[str, Any]:
-        """Get session statistics"""
-        total = len(self.sessions)
-        cutoff = time.time() - self.session_ttl
-        active = sum(1 for s in self.sessions.values() if s['last_active'] > cutoff)
-        
-        platforms = {}
-        for session_key, session in self.sessions.items():
-            platform = session['platform']
-            platforms[platform] = platforms.get(platform, 0) + 1
+        """Get session statistics (O(1) apart from a bounded memory sample)"""
+        with self._lock:
+            total = len(self.sessions)
+            expired = self._count_expired(time.time() - self.session_ttl)
+            platforms = {p: c for p, c in self._platform_counts.items() if c}
+            
+            # Memory per session, estimated from a bounded sample
+            sample = [session.estimate_size_bytes() for session in islice(self.sessions.values(), 200)]
+            index_size = len(self._expiry_heap)
+        avg_bytes = sum(sample) / len(sample) if sample else 0
         
         return {
             "total_sessions": total,
-            "active_sessions": active,
-            "expired_sessions": total - active,
+            "active_sessions": total - expired,
+            "expired_pending_sweep": expired,
+            "evicted_sessions": self._evicted_total,
             "by_platform": platforms,
+            "avg_session_bytes": round(avg_bytes),
+            "estimated_memory_bytes": round(avg_bytes * total),
+            "max_history": MAX_HISTORY,
+            "expiry_index_size": index_size,
+            "last_sweep": self._last_sweep,
+            "sweeper_running": bool(self._sweeper_thread and self._sweeper_thread.is_alive()),
+            "rehydration": self._get_rehydrate_stats(),
             "redis_enabled": self.use_redis
         }
     
+    def _get_rehydrate_stats(self) -> Dict[str, Any]:
+        attempts = self.rehydrate_stats["attempts"]
+        return {
+            "enabled": self.rehydrate_enabled,
+            "attempts": attempts,
+            "hits": self.rehydrate_stats["hits"],
+            "misses": self.rehydrate_stats["misses"],
+            "hit_rate_percent": round(self.rehydrate_stats["hits"] / attempts * 100, 2) if attempts else 0,
+            "avg_ms": round(self.rehydrate_stats["total_ms"] / attempts, 2) if attempts else 0,
+            "max_ms": round(self.rehydrate_stats["max_ms"], 2)
+        }
+    
+    def sweep_expired(self, batch_size: int = 500) -> int:
+        """
+        Evict expired sessions in bounded batches
+        The lock is released between batches so request threads are never
+        blocked for long
+        
+        Returns:
+            Number of sessions evicted
+        """
+        started = time.perf_counter()
+        evicted = 0
+        while True:
+            cutoff = time.time() - self.session_ttl
+            with self._lock:
+                for _ in range(batch_size):
+                    if not self._expiry_heap or self._expiry_heap[0][0] >= cutoff:
+                        break
+                    last_active, session_key = heapq.heappop(self._expiry_heap)
+                    session = self.sessions.get(session_key)
+                    # Outdated entry: session was touched (or removed) after this was indexed
+                    if session is None or session.last_active != last_active:
+                        continue
+                    self._remove(session_key)
+                    evicted += 1
+                done = not self._expiry_heap or self._expiry_heap[0][0] >= cutoff
+            if done:
+                break
+        
+        self._evicted_total += evicted
+        self._last_sweep = {
+            "at": time.time(),
+            "evicted": evicted,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 2)
+        }
+        if evicted:
+            logger.info(f"🧹 Swept {evicted} expired sessions")
+        return evicted
+    
     def cleanup_expired_sessions(self):
         """Remove expired sessions from memory"""
-        cutoff = time.time() - self.session_ttl
-        expired_keys = [
-            k for k, v in self.sessions.items()
-            if v['last_active'] < cutoff
-        ]
+        return self.sweep_expired()
+    
+    def start_sweeper(self, interval: float = None, batch_size: int = None):
+        """Start the background expiry sweeper (daemon thread, idempotent)"""
+        if self._sweeper_thread and self._sweeper_thread.is_alive():
+            return
+        interval = interval or float(os.getenv('SESSION_SWEEP_INTERVAL', 60))
+        batch_size = batch_size or int(os.getenv('SESSION_SWEEP_BATCH', 500))
+        self._sweeper_stop.clear()
         
-        for key in expired_keys:
-            del self.sessions[key]
+        def run():
+            while not self._sweeper_stop.wait(interval):
+                try:
+                    self.sweep_expired(batch_size)
+                except Exception as e:
+                    logger.error(f"❌ Session sweeper error: {e}")
         
-        if expired_keys:
-            logger.info(f"Cleaned up {len(expired_keys)} expired sessions")
+        self._sweeper_thread = threading.Thread(target=run, name="session-sweeper", daemon=True)
+        self._sweeper_thread.start()
+        logger.info(f"🧹 Session sweeper started (every {interval:.0f}s, batch {batch_size})")
+    
+    def stop_sweeper(self):
+        """Stop the background sweeper"""
+        self._sweeper_stop.set()
 
 
 # Global instance
@@ -0,0 +1,164 @@
+"""
+Keyed Work Queue - background processing for webhook events
+Per-key FIFO ordering (messages from the same user run in order),
+cross-key parallelism bounded by a semaphore, bounded total depth
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Set, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+Job = Callable[[], Awaitable[Any]]
+
+
+class KeyedWorkQueue:
+    """
+    Async work queue with per-key ordering
+
+    - Jobs with the same key run one at a time, in submit order
+    - Jobs with different keys run concurrently (up to `concurrency`)
+    - Total queued + running jobs is capped at `max_depth`; submit() returns
+      False when full so the caller can apply backpressure
+    """
+
+    def __init__(self, name: str, concurrency: int = 8, max_depth: int = 1000):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_depth = max_depth
+
+        self._pending: Dict[str, Deque[Tuple[float, Job]]] = {}
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks: Set[asyncio.Task] = set()
+        self._depth = 0
+        self._running = 0
+
+        self.stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "max_depth_seen": 0,
+            "total_wait_ms": 0.0,
+            "max_wait_ms": 0.0,
+            "total_run_ms": 0.0
+        }
+
+        logger.info(f"📥 Work queue '{name}' ready (concurrency={concurrency}, max_depth={max_depth})")
+
+    @property
+    def depth(self) -> int:
+        """Queued + running jobs"""
+        return self._depth
+
+    def has_capacity(self, count: int = 1) -> bool:
+        """Check if `count` more jobs fit under max_depth"""
+        return self._depth + count <= self.max_depth
+
+    def submit(self, key: str, job: Job, force: bool = False) -> bool:
+        """
+        Queue a job (must be called from the event loop thread)
+
+        Args:
+            key: Ordering key (e.g. platform user ID)
+            job: Zero-arg coroutine function
+            force: Accept even above max_depth — for work already acknowledged to the
+                platform (passed has_capacity at ingress), which would otherwise be lost
+
+        Returns:
+            False if the queue is full (job not accepted)
+        """
+        if self._depth >= self.max_depth and not force:
+            self.stats["rejected"] += 1
+            logger.warning(f"⚠️  Work queue '{self.name}' full ({self._depth}/{self.max_depth}), rejecting job")
+            return False
+
+        self._depth += 1
+        self.stats["submitted"] += 1
+        self.stats["max_depth_seen"] = max(self.stats["max_depth_seen"], self._depth)
+
+        queue = self._pending.get(key)
+        if queue is not None:
+            # A drainer is already running for this key — it will pick this job up in order
+            queue.append((time.monotonic(), job))
+            return True
+
+        self._pending[key] = deque([(time.monotonic(), job)])
+        task = asyncio.get_running_loop().create_task(self._drain(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def _drain(self, key: str):
+        """Run all jobs for one key sequentially"""
+        queue = self._pending[key]
+        try:
+            while queue:
+                enqueued_at, job = queue.popleft()
+                async with self._semaphore:
+                    started = time.monotonic()
+                    wait_ms = (started - enqueued_at) * 1000
+                    self.stats["total_wait_ms"] += wait_ms
+                    self.stats["max_wait_ms"] = max(self.stats["max_wait_ms"], wait_ms)
+                    self._running += 1
+                    try:
+                        await job()
+                        self.stats["completed"] += 1
+                    except Exception as e:
+                        self.stats["failed"] += 1
+                        logger.error(f"❌ Work queue '{self.name}' job failed (key={key}): {e}", exc_info=True)
+                    finally:
+                        self._running -= 1
+                        self._depth -= 1
+                        self.stats["total_run_ms"] += (time.monotonic() - started) * 1000
+        finally:
+            del self._pending[key]
+
+    async def join(self, timeout: float = None) -> bool:
+        """
+        Wait for all queued jobs to finish (used on shutdown)
+
+        Returns:
+            True if drained, False on timeout
+        """
+        if not self._tasks:
+            return True
+        done, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        if pending:
+            logger.warning(f"⚠️  Work queue '{self.name}' shutdown with {self._depth} jobs unfinished")
+        return not pending
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Queue depth / backpressure / latency statistics"""
+        finished = self.stats["completed"] + self.stats["failed"]
+        started = finished + self._running
+        return {
+            "name": self.name,
+            "depth": self._depth,
+            "running": self._running,
+            "active_keys": len(self._pending),
+            "concurrency": self.concurrency,
+            "max_depth": self.max_depth,
+            "submitted": self.stats["submitted"],
+            "completed": self.stats["completed"],
+            "failed": self.stats["failed"],
+            "rejected": self.stats["rejected"],
+            "max_depth_seen": self.stats["max_depth_seen"],
+            "avg_wait_ms": round(self.stats["total_wait_ms"] / started, 2) if started else 0,
+            "max_wait_ms": round(self.stats["max_wait_ms"], 2),
+            "avg_run_ms": round(self.stats["total_run_ms"] / finished, 2) if finished else 0
+        }
+
+
+def create_work_queue(name: str, prefix: str, concurrency: int = 8, max_depth: int = 1000) -> KeyedWorkQueue:
+    """Create queue with limits overridable via ENV ({prefix}_WORKER_CONCURRENCY / {prefix}_QUEUE_MAX_DEPTH)"""
+    return KeyedWorkQueue(
+        name,
+        concurrency=int(os.getenv(f"{prefix}_WORKER_CONCURRENCY", concurrency)),
+        max_depth=int(os.getenv(f"{prefix}_QUEUE_MAX_DEPTH", max_depth))
+    )
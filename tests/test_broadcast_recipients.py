@@ -0,0 +1,48 @@
+"""
+Test Broadcast Recipients
+ทดสอบการเลือกผู้รับ broadcast ด้วย tag index (user_tags) และการ stream เป็น chunk
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database.crud import CRUDManager
+from database.models import User
+from tests.test_record_turn import _TestDatabase
+
+
+def test_tag_filter_runs_in_sql_and_streams_chunks(tmp_path):
+    """filter tag ไม่สนตัวพิมพ์/ช่องว่าง, ไม่มี cap, และได้ทีละ chunk ของ (id, platform_user_id)"""
+    db = _TestDatabase(f"sqlite:///{tmp_path / 'broadcast.db'}")
+    crud = CRUDManager(db)
+    with db.get_session() as session:
+        session.add_all(User(platform="line", platform_user_id=f"U{n}", tags=[]) for n in range(25))
+        session.add(User(platform="facebook", platform_user_id="P1", tags=[]))
+
+    for user_id in range(1, 26, 2):
+        crud.update_user_tags(user_id, [" VIP ", "interested_mts"])
+    crud.update_user_tags(26, ["vip"])
+    crud.update_user_tags(1, ["interested_mts"])
+
+    chunks = list(crud.iter_broadcast_recipients(platform="line", target_tags=["vip"], chunk_size=5))
+    recipients = [row for chunk in chunks for row in chunk]
+
+    assert [len(chunk) for chunk in chunks] == [5, 5, 2]
+    assert recipients[0] == (3, "U2")
+    assert len(recipients) == 12
+    assert sum(len(c) for c in crud.iter_broadcast_recipients(platform="line")) == 25
+    assert crud.get_broadcast_recipients(platform="line", target_tags=["vip"], after_id=23, limit=5) == [(25, "U24")]
+
+
+def test_backfill_user_tags_from_json(tmp_path):
+    """ฐานข้อมูลเดิมที่มีแค่ User.tags ถูก backfill เข้า user_tags ครั้งเดียว"""
+    db = _TestDatabase(f"sqlite:///{tmp_path / 'backfill.db'}")
+    crud = CRUDManager(db)
+    with db.get_session() as session:
+        session.add(User(platform="line", platform_user_id="U1", tags=["VIP", "vip", "new"]))
+        session.add(User(platform="line", platform_user_id="U2", tags=None))
+
+    assert crud.backfill_user_tags() == 2
+    assert crud.backfill_user_tags() == 0
+    assert [row for chunk in crud.iter_broadcast_recipients(target_tags=["Vip"]) for row in chunk] == [(1, "U1")]
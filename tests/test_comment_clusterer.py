@@ -0,0 +1,76 @@
+"""
+Test Comment Clusterer
+ทดสอบการรวมคอมเมนต์ที่แทบเหมือนกันให้ใช้ full reply จาก LLM ร่วมกัน
+"""
+
+import sys
+import os
+import threading
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from facebook_integration.comment_clusterer import CommentClusterer, normalize_comment
+
+
+def test_normalize_strips_particles_emoji_and_repeats():
+    """"สนใจค่ะ", "สนใจคะ 😍", "สนใจจจจ" กลายเป็นข้อความเดียวกัน"""
+    assert {normalize_comment(t) for t in ["สนใจค่ะ", "สนใจ", "สนใจคะ 😍", "สนใจจจจ ค่ะ"]} == {"สนใจ"}
+    assert normalize_comment("ราคา?") == "ราคา"
+
+
+def test_similar_comments_share_one_generation_per_post_and_intent():
+    """burst ของคอมเมนต์คล้ายกันเรียก LLM ครั้งเดียว, คนละโพสต์ / คำถามต่างกันแยกกลุ่ม"""
+    clusterer = CommentClusterer(window_seconds=60)
+    calls = []
+
+    def generate(text):
+        def run():
+            calls.append(text)
+            time.sleep(0.05)
+            return f"reply:{text}"
+        return run
+
+    results = {}
+    comments = ["สนใจค่ะ", "สนใจ", "สนใจคะ", "สนใจจจ ค่ะ"]
+    threads = [
+        threading.Thread(target=lambda t=t: results.update({t: clusterer.get_or_generate("p1", "inquiry", t, generate(t))}))
+        for t in comments
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert len(set(results.values())) == 1
+
+    clusterer.get_or_generate("p1", "pricing", "ฟิลเลอร์ราคาเท่าไหร่คะ", generate("filler"))
+    clusterer.get_or_generate("p1", "pricing", "ฟิลเลอร์ราคาเท่าไรคะ", generate("filler2"))
+    clusterer.get_or_generate("p2", "inquiry", "สนใจค่ะ", generate("other post"))
+    assert calls[1:] == ["filler", "other post"]
+
+    stats = clusterer.get_stats()
+    assert stats["generated"] == 3
+    assert stats["reused"] == 4
+
+
+def test_different_treatments_are_not_clustered():
+    """คำถามราคาคนละหัตถการ (ใต้ตา / คาง) ต้องไม่ได้คำตอบของอีกคน, แต่สะกดต่างกันเล็กน้อยยังรวมกลุ่ม"""
+    clusterer = CommentClusterer(window_seconds=60)
+    calls = []
+
+    def generate(text):
+        def run():
+            calls.append(text)
+            return f"reply:{text}"
+        return run
+
+    under_eye = clusterer.get_or_generate("p1", "pricing", "ฟิลเลอร์ใต้ตาราคาเท่าไหร่คะ", generate("under_eye"))
+    chin = clusterer.get_or_generate("p1", "pricing", "ฟิลเลอร์คางราคาเท่าไหร่คะ", generate("chin"))
+    same = clusterer.get_or_generate("p1", "pricing", "ฟิลเลอร์ใต้ตา ราคาเท่าไรครับ", generate("under_eye_again"))
+    short = clusterer.get_or_generate("p1", "pricing", "ราคาคะ", generate("short"))
+
+    assert calls == ["under_eye", "chin", "short"]
+    assert under_eye != chin
+    assert same == under_eye
+    assert short == "reply:short"
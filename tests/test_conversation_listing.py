@@ -0,0 +1,57 @@
+"""
+Test Conversation Listing
+ทดสอบการดึงรายการ conversation แบบ join user ใน query เดียว + keyset pagination
+"""
+
+import sys
+import os
+from datetime import datetime, timedelta
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from sqlalchemy import event
+
+from database.crud import CRUDManager
+from database.models import User, Conversation
+from tests.test_record_turn import _TestDatabase
+
+
+def _seed(db, count=7):
+    base = datetime(2026, 1, 1, 12, 0, 0)
+    with db.get_session() as session:
+        user = User(platform="line", platform_user_id="U1", display_name="Mint")
+        session.add(user)
+        session.flush()
+        for n in range(count):
+            # Two conversations share each started_at to exercise the id tie-break
+            session.add(Conversation(user_id=user.id, platform="line", status="active",
+                                     started_at=base + timedelta(minutes=n // 2)))
+
+
+def test_keyset_pages_cover_everything_once(tmp_path):
+    """เดินทุกหน้าด้วย cursor ได้ครบ ไม่ซ้ำ เรียงใหม่สุดก่อน และ 1 query ต่อหน้า"""
+    db = _TestDatabase(f"sqlite:///{tmp_path / 'list.db'}")
+    crud = CRUDManager(db)
+    _seed(db)
+
+    statements = []
+    event.listen(db.engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    seen, cursor = [], None
+    while True:
+        page = crud.list_conversations(limit=3, cursor=cursor)
+        seen.extend(page["items"])
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+
+    assert len(statements) == 3
+    assert [c["id"] for c in seen] == [7, 6, 5, 4, 3, 2, 1]
+    assert seen[0]["display_name"] == "Mint"
+    assert crud.count_conversations(platform="line") == 7
+
+
+def test_invalid_cursor_raises(tmp_path):
+    db = _TestDatabase(f"sqlite:///{tmp_path / 'bad.db'}")
+    crud = CRUDManager(db)
+    with pytest.raises(ValueError):
+        crud.list_conversations(cursor="not-a-cursor")
@@ -0,0 +1,72 @@
+"""
+Test Event Deduplication
+ทดสอบการกรอง webhook event ที่ถูกส่งซ้ำ
+"""
+
+import sys
+import os
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from platforms.event_dedup import EventDeduplicator
+
+
+def test_duplicates_dropped_per_platform():
+    """event ID เดิมต้องถูก drop, platform ต่างกันไม่ชนกัน"""
+    dedup = EventDeduplicator(ttl_seconds=60, use_redis=False)
+
+    assert dedup.check_and_mark("line", "evt-1")
+    assert not dedup.check_and_mark("line", "evt-1")
+    assert dedup.check_and_mark("facebook", "evt-1")
+    # No ID → cannot dedup, always processed
+    assert dedup.check_and_mark("line", None)
+    assert dedup.check_and_mark("line", None)
+
+    stats = dedup.get_stats()
+    assert stats["duplicates_dropped"] == 1
+    assert stats["duplicates_by_platform"] == {"line": 1}
+
+
+def test_ttl_and_bound():
+    """ID หมดอายุแล้วต้องประมวลผลได้อีก, memory ต้องไม่เกิน max_entries"""
+    dedup = EventDeduplicator(ttl_seconds=1, max_entries=3, use_redis=False)
+    dedup.ttl_seconds = 0.05
+
+    assert dedup.check_and_mark("line", "a")
+    time.sleep(0.1)
+    assert dedup.check_and_mark("line", "a")
+
+    for i in range(10):
+        dedup.check_and_mark("line", f"id-{i}")
+    assert dedup.get_stats()["memory_entries"] == 3
+
+
+def test_messenger_webhook_dedups_before_the_capacity_check(monkeypatch):
+    """redelivery ไม่กินที่ในคิว / ไม่ทำให้ตอบ busy, และ delivery ที่ถูกปฏิเสธเพราะคิวเต็มส่งซ้ำแล้วต้องได้ประมวลผล"""
+    import asyncio
+    from platforms import event_dedup
+    from platforms.facebook_handler import FacebookHandler
+
+    monkeypatch.setattr(event_dedup, "_event_deduplicator", EventDeduplicator(ttl_seconds=60, use_redis=False))
+    handler = FacebookHandler()
+    submitted = []
+    monkeypatch.setattr(handler.work_queue, "submit", lambda key, job, force=False: submitted.append(key))
+
+    def delivery(*mids):
+        return {"object": "page", "entry": [{"messaging": [
+            {"sender": {"id": f"user-{mid}"}, "message": {"mid": mid, "text": "สนใจค่ะ"}} for mid in mids
+        ]}]}
+
+    handler.work_queue.max_depth = 2
+    assert asyncio.run(handler.handle_webhook(delivery("m1", "m2")))["messenger_events_queued"] == 2
+
+    # Queue is now full: a pure redelivery still gets its 200 and takes no slot
+    handler.work_queue._depth = 2
+    result = asyncio.run(handler.handle_webhook(delivery("m1", "m2")))
+    assert result == {"status": "ok", "messenger_events_queued": 0, "duplicates": 2}
+
+    # A new event rejected as busy is not remembered, so Meta's retry is processed
+    assert asyncio.run(handler.handle_webhook(delivery("m3")))["status"] == "busy"
+    handler.work_queue._depth = 0
+    assert asyncio.run(handler.handle_webhook(delivery("m3")))["messenger_events_queued"] == 1
+    assert submitted == ["user-m1", "user-m2", "user-m3"]
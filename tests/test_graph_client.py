@@ -0,0 +1,171 @@
+"""
+Test Graph API Client
+ทดสอบ retry / throttling / metrics ของ client ที่ใช้ร่วมกันสำหรับ Meta Graph API
+"""
+
+import sys
+import os
+import asyncio
+import json
+import threading
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from core.graph_client import GraphClient
+
+
+def make_client(handler):
+    """GraphClient ที่ส่ง request ไป MockTransport แทน graph.facebook.com"""
+    client = GraphClient(base_url="https://graph.test/v20.0")
+    client._backoff = lambda attempt: 0.01
+
+    def bind():
+        client._client = httpx.AsyncClient(base_url=client.base_url, transport=httpx.MockTransport(handler))
+        client._loop = asyncio.get_running_loop()
+
+    return client, bind
+
+
+def test_retries_throttled_request_then_succeeds():
+    """429 / error code 613 ต้อง retry แล้วได้ผลลัพธ์, usage header ถูกเก็บไว้"""
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        if len(calls) == 1:
+            return httpx.Response(429, headers={"Retry-After": "0"})
+        if len(calls) == 2:
+            return httpx.Response(400, json={"error": {"code": 613}})
+        return httpx.Response(200, json={"id": "1"}, headers={"X-App-Usage": json.dumps({"call_count": 42})})
+
+    async def run():
+        client, bind = make_client(handler)
+        bind()
+        response = await client.post("/me/messages", json={"message": {"text": "hi"}})
+        return client, response
+
+    client, response = asyncio.run(run())
+
+    assert response.status_code == 200
+    assert len(calls) == 3
+    stats = client.get_stats()
+    assert stats["endpoints"]["messages"]["retries"] == 2
+    assert stats["usage"]["x-app-usage"] == 42
+
+
+def test_post_not_retried_on_5xx_and_long_throttle_gives_up():
+    """POST ที่ได้ 5xx ไม่ส่งซ้ำ (กันข้อความซ้ำ), throttle นานเกิน max_retry_delay ไม่รอ"""
+    calls = []
+
+    def handler(request):
+        calls.append(request.method)
+        if request.method == "POST":
+            return httpx.Response(500)
+        buc = {"123": [{"call_count": 100, "estimated_time_to_regain_access": 10}]}
+        return httpx.Response(429, headers={"X-Business-Use-Case-Usage": json.dumps(buc)})
+
+    async def run():
+        client, bind = make_client(handler)
+        bind()
+        post = await client.post("/me/messages", json={})
+        get = await client.get("/12345")
+        return post, get
+
+    post, get = asyncio.run(run())
+
+    assert post.status_code == 500
+    assert get.status_code == 429
+    assert calls == ["POST", "GET"]
+
+
+def test_request_sync_from_worker_thread_uses_loop_client():
+    """worker thread เรียก request_sync แล้วใช้ pool เดียวกับ event loop"""
+    def handler(request):
+        return httpx.Response(200, json={"name": "Mint"})
+
+    async def run():
+        client, bind = make_client(handler)
+        bind()
+        result = {}
+        thread = threading.Thread(target=lambda: result.update(r=client.request_sync("GET", "/999")))
+        thread.start()
+        while thread.is_alive():
+            await asyncio.sleep(0.01)
+        return client, result["r"]
+
+    client, response = asyncio.run(run())
+
+    assert response.json()["name"] == "Mint"
+    assert client.get_stats()["endpoints"]["node"]["requests"] == 1
+
+
+def test_batcher_coalesces_and_retries_failed_items():
+    """operation ที่เข้ามาพร้อมกันรวมเป็น batch เดียว, item ที่ถูก throttle retry เฉพาะตัว"""
+    from urllib.parse import parse_qs
+    from core.graph_batcher import GraphBatcher
+
+    batches = []
+    throttled_once = set()
+
+    def handler(request):
+        form = parse_qs(request.content.decode())
+        ops = json.loads(form["batch"][0])
+        batches.append(len(ops))
+        results = []
+        for op in ops:
+            psid = op["relative_url"].split("?")[0]
+            if psid == "7" and psid not in throttled_once:
+                throttled_once.add(psid)
+                results.append({"code": 400, "body": json.dumps({"error": {"code": 613}})})
+            elif psid == "9":
+                results.append({"code": 400, "body": json.dumps({"error": {"code": 100}})})
+            else:
+                results.append({"code": 200, "body": json.dumps({"id": psid})})
+        return httpx.Response(200, json=results)
+
+    async def run():
+        client, bind = make_client(handler)
+        bind()
+        batcher = GraphBatcher(client, window=0.01, batch_size=50)
+        return batcher, await asyncio.gather(*(batcher.get(f"{n}?fields=id", "token") for n in range(60)))
+
+    batcher, results = asyncio.run(run())
+
+    assert batches[:2] == [50, 10]
+    assert batches[2:] == [1]
+    assert results[7].is_success and results[7].json() == {"id": "7"}
+    assert not results[9].is_success
+    assert sum(r.is_success for r in results) == 59
+    assert batcher.get_stats()["item_retries"] == 1
+
+
+def test_failed_batch_does_not_resend_posts():
+    """batch ล้มเหลวทั้งก้อน (5xx): GET retry ได้ แต่ POST ไม่ส่งซ้ำ (กัน DM ซ้ำ)"""
+    from urllib.parse import parse_qs
+    from core.graph_batcher import GraphBatcher
+
+    sent = []
+
+    def handler(request):
+        ops = json.loads(parse_qs(request.content.decode())["batch"][0])
+        sent.append([op["method"] for op in ops])
+        if len(sent) == 1:
+            return httpx.Response(502)
+        return httpx.Response(200, json=[{"code": 200, "body": "{}"} for _ in ops])
+
+    async def run():
+        client, bind = make_client(handler)
+        bind()
+        batcher = GraphBatcher(client, window=0.01, batch_size=50)
+        batcher.max_item_retries = 1
+        return await asyncio.gather(
+            batcher.post("me/messages", "token", {"recipient": {"id": "1"}}),
+            batcher.get("42?fields=name", "token")
+        )
+
+    post, get = asyncio.run(run())
+
+    assert sent == [["POST", "GET"], ["GET"]]
+    assert not post.is_success
+    assert get.is_success
@@ -0,0 +1,76 @@
+"""
+Test Image Variant Service
+ทดสอบ cache ของ JPEG variant (key ไม่ชนกันระหว่างไฟล์ชื่อซ้ำ) และ route /img-jpeg (ETag / 304 / preview)
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import io
+
+from PIL import Image
+
+from core import image_variant_service as image_variant_module
+from core.image_variant_service import ImageVariantService
+
+
+def _write_image(path, color, size=(600, 400)):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    Image.new("RGB", size, color).save(path)
+
+
+def _color(variant):
+    with Image.open(variant.path) as img:
+        return img.convert("RGB").getpixel((10, 10))
+
+
+def test_same_stem_and_same_name_do_not_share_a_cached_variant(tmp_path):
+    """promo.png กับ promo.jpg และไฟล์ชื่อเดียวกันคนละ directory ได้ variant ของตัวเอง"""
+    cache = tmp_path / "cache"
+    _write_image(tmp_path / "a" / "promo.png", (255, 0, 0))
+    _write_image(tmp_path / "a" / "promo.jpg", (0, 0, 255))
+    _write_image(tmp_path / "b" / "promo.png", (0, 255, 0))
+
+    service_a = ImageVariantService(source_dir=tmp_path / "a", cache_dir=cache)
+    service_b = ImageVariantService(source_dir=tmp_path / "b", cache_dir=cache)
+    png = service_a.get_variant("promo.png")
+    jpg = service_a.get_variant("promo.jpg")
+    other = service_b.get_variant("promo.png")
+
+    assert len({png.path, jpg.path, other.path}) == 3
+    assert _color(png)[0] > 200 and _color(jpg)[2] > 200 and _color(other)[1] > 200
+
+    # Rewriting the source re-renders it and removes only its own stale variant
+    _write_image(tmp_path / "a" / "promo.png", (255, 255, 0), size=(500, 400))
+    updated = service_a.get_variant("promo.png")
+    assert updated.path != png.path and not png.path.exists()
+    assert jpg.path.exists() and other.path.exists()
+
+
+def test_variant_routes_serve_etag_304_and_preview(tmp_path, monkeypatch):
+    """/img-jpeg ส่ง JPEG + ETag, If-None-Match ตรงได้ 304, preview ย่อเหลือ ≤ 240px"""
+    from fastapi.testclient import TestClient
+    import main_app
+
+    _write_image(tmp_path / "img" / "Filler.png", (200, 100, 50))
+    service = ImageVariantService(source_dir=tmp_path / "img", cache_dir=tmp_path / "cache")
+    monkeypatch.setattr(image_variant_module, "_image_variant_service", service)
+    client = TestClient(main_app.app)
+
+    response = client.get("/img-jpeg/Filler.png")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/jpeg"
+    etag = response.headers["etag"]
+
+    cached = client.get("/img-jpeg/Filler.png", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+
+    preview = client.get("/img-jpeg/preview/Filler.png")
+    assert preview.status_code == 200
+    assert preview.headers["etag"] != etag
+    with Image.open(io.BytesIO(preview.content)) as img:
+        assert max(img.size) <= 240
+
+    assert client.get("/img-jpeg/Missing.png").status_code == 404
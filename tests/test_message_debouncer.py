@@ -0,0 +1,62 @@
+"""
+Test Message Debouncer
+ทดสอบการรวมข้อความหลาย bubble ของ user เดียวกันเป็น turn เดียว
+"""
+
+import sys
+import os
+import asyncio
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from platforms.message_debouncer import MessageDebouncer
+
+
+def test_merges_bubbles_per_user():
+    """bubble ที่พิมพ์ติดกันของ user เดียวกันรวมเป็น turn เดียว, user อื่นไม่ถูกรวม"""
+    async def run():
+        turns = []
+        debouncer = MessageDebouncer("test", lambda key, items: turns.append((key, items)), window=0.05, max_wait=1)
+        for text in ("สวัสดีค่ะ", "อยากถาม", "ฟิลเลอร์ราคาเท่าไหร่"):
+            debouncer.add("A", text)
+            debouncer.add("B", text.upper())
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.2)
+        return debouncer, turns
+
+    debouncer, turns = asyncio.run(run())
+
+    assert ("A", ["สวัสดีค่ะ", "อยากถาม", "ฟิลเลอร์ราคาเท่าไหร่"]) in turns
+    assert len(turns) == 2
+    stats = debouncer.get_stats()
+    assert stats["llm_calls_saved"] == 4
+    assert stats["pending_turns"] == 0
+
+
+def test_max_wait_and_manual_flush():
+    """พิมพ์ไม่หยุดก็ต้องได้ flush ภายใน max_wait และ flush() ส่งของค้างทันที"""
+    async def run():
+        turns = []
+        debouncer = MessageDebouncer("test", lambda key, items: turns.append(items), window=0.05, max_wait=0.12)
+        for n in range(8):
+            debouncer.add("A", n)
+            await asyncio.sleep(0.03)
+        debouncer.add("A", "last")
+        debouncer.flush("A")
+        return turns
+
+    turns = asyncio.run(run())
+
+    assert len(turns) >= 2
+    assert turns[-1][-1] == "last"
+    assert [item for turn in turns for item in turn] == list(range(8)) + ["last"]
+
+
+def test_window_zero_disables_merging():
+    """window=0 ส่งทุกข้อความทันที"""
+    turns = []
+    debouncer = MessageDebouncer("test", lambda key, items: turns.append(items), window=0)
+    debouncer.add("A", 1)
+    debouncer.add("A", 2)
+
+    assert turns == [[1], [2]]
+    assert debouncer.get_stats()["llm_calls_saved"] == 0
@@ -0,0 +1,121 @@
+"""
+Test Write-Behind Message Writer
+ทดสอบการรวม batch, การสร้าง/ใช้ user + conversation เดิม และการ retry เมื่อเขียน DB ไม่สำเร็จ
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy.exc import OperationalError
+
+from database import message_writer as message_writer_module
+from database.message_writer import MessageWriter
+from database.models import User, Conversation, Message
+from tests.test_record_turn import _TestDatabase
+
+
+class _FlakyDatabase(_TestDatabase):
+    """Write sessions fail ('database is locked') the first `failures` times"""
+
+    def __init__(self, url, failures):
+        super().__init__(url)
+        self.failures = failures
+
+    def get_session(self):
+        if self.failures:
+            self.failures -= 1
+            raise OperationalError("INSERT", {}, Exception("database is locked"))
+        return super().get_session()
+
+
+def test_batches_per_user_and_reuses_user_and_conversation(tmp_path):
+    """ข้อความหลาย user เขียนใน batch เดียว, user/conversation เดิมถูกใช้ต่อ และตัวนับตรงกับ record_turn"""
+    db = _TestDatabase(f"sqlite:///{tmp_path / 'writer.db'}")
+    writer = MessageWriter(batch_size=100, flush_interval=0.05, db_manager=db)
+
+    writer.enqueue("line", "U1", "user", "สวัสดีค่ะ", display_name="Mint")
+    writer.enqueue("line", "U1", "bot", "สวัสดีค่ะ มีอะไรให้ช่วยคะ", metadata={"cache_hit": True})
+    writer.enqueue("facebook", "P1", "user", "ราคาเท่าไหร่", display_name="Ploy")
+    assert writer.flush()
+
+    writer.enqueue("line", "U1", "user", "ขอบคุณค่ะ")
+    assert writer.flush()
+
+    with db.get_session() as session:
+        users = {u.platform_user_id: u for u in session.query(User)}
+        conversations = session.query(Conversation).all()
+        messages = session.query(Message).order_by(Message.id).all()
+        assert users["U1"].display_name == "Mint"
+        assert users["U1"].total_messages == 3
+        assert len(conversations) == 2
+        assert sorted(c.messages_count for c in conversations) == [1, 3]
+        assert [m.role for m in messages if m.conversation_id == messages[0].conversation_id] == ["user", "assistant", "user"]
+        assert messages[1].message_metadata == {"cache_hit": True}
+
+    stats = writer.get_stats()
+    assert stats["written"] == 4
+    assert stats["batches"] == 2
+
+
+def test_new_user_profile_is_fetched_outside_the_transaction(tmp_path, monkeypatch):
+    """profile ของ user ใหม่ถูกดึงตอนไม่มี connection เปิดค้าง (ไม่ถือ write lock ระหว่างรอ API)"""
+    db = _TestDatabase(f"sqlite:///{tmp_path / 'profile.db'}")
+    open_connections = []
+
+    def lookup(platform, platform_user_id):
+        open_connections.append(db.engine.pool.checkedout())
+        return {"display_name": "From API", "profile_pic": "https://img.test/p.jpg"}
+
+    monkeypatch.setattr(message_writer_module, "_lookup_profile", lookup)
+    writer = MessageWriter(flush_interval=0.05, db_manager=db)
+    writer.enqueue("line", "U9", "user", "hi")
+    writer.enqueue("line", "U9", "user", "hello again")
+    assert writer.flush()
+
+    assert open_connections == [0]
+    with db.get_session() as session:
+        user = session.query(User).one()
+        assert (user.display_name, user.profile_pic_url) == ("From API", "https://img.test/p.jpg")
+
+
+def test_failed_batch_is_retried_then_given_up(tmp_path):
+    """'database is locked' ชั่วคราวไม่ทำข้อความหาย, แต่ล้มเหลวเกิน max_retries จะเลิก"""
+    db = _FlakyDatabase(f"sqlite:///{tmp_path / 'flaky.db'}", failures=2)
+    writer = MessageWriter(flush_interval=0.05, db_manager=db)
+    writer.enqueue("line", "U1", "user", "จองคิวค่ะ", display_name="Mint")
+    assert writer.flush()
+
+    with db.get_session() as session:
+        assert session.query(Message).count() == 1
+    assert writer.get_stats()["retried"] == 2
+    assert writer.get_stats()["failed"] == 0
+
+    db.failures = 10
+    writer = MessageWriter(flush_interval=0.05, db_manager=db)
+    writer.max_retries = 1
+    writer.enqueue("line", "U1", "user", "lost", display_name="Mint")
+    assert writer.flush()
+    assert writer.get_stats()["failed"] == 1
+
+
+def test_poison_record_only_fails_its_own_user(tmp_path):
+    """record ที่เขียนไม่ได้ (content=None) ล้มเฉพาะ turn ของ user นั้น, ข้อความ user อื่นใน batch เดียวกันถูกบันทึกครั้งเดียว"""
+    db = _TestDatabase(f"sqlite:///{tmp_path / 'poison.db'}")
+    writer = MessageWriter(batch_size=100, flush_interval=0.05, db_manager=db)
+    writer.max_retries = 1
+
+    writer.enqueue("line", "U1", "user", "จองคิวพรุ่งนี้ค่ะ", display_name="Mint")
+    writer.enqueue("line", "BAD", "user", None, display_name="Broken")
+    writer.enqueue("facebook", "P1", "user", "ราคาเท่าไหร่", display_name="Ploy")
+    assert writer.flush()
+
+    with db.get_session() as session:
+        assert sorted(m.content for m in session.query(Message)) == ["จองคิวพรุ่งนี้ค่ะ", "ราคาเท่าไหร่"]
+        assert {u.platform_user_id for u in session.query(User)} == {"U1", "P1"}
+        assert session.query(Conversation).count() == 2
+
+    stats = writer.get_stats()
+    assert stats["written"] == 2
+    assert stats["retried"] == 1
+    assert stats["failed"] == 1
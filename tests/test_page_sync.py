@@ -0,0 +1,152 @@
+"""
+Test Incremental Page Sync
+ทดสอบการซิงก์โพสต์แบบ incremental: hash เปลี่ยน, ETag/304, full walk ตามรอบ, resume cursor หลังล้มกลางทาง และ dirty re-apply
+"""
+
+import sys
+import os
+import types
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from facebook_integration import page_sync as page_sync_module
+from facebook_integration.fb_scraper import FacebookPageScraper
+from facebook_integration.page_sync import PageSyncEngine
+
+
+def post(post_id, message, updated="2026-01-15T10:00:00+0000"):
+    return {"id": post_id, "message": message, "created_time": updated, "updated_time": updated,
+            "image_url": "", "post_url": f"https://fb.test/{post_id}", "type": "promotion"}
+
+
+class _ScriptedScraper(FacebookPageScraper):
+    """Serves scripted Graph pages (a dict, or an exception to raise) instead of calling Graph"""
+
+    def __init__(self, pages):
+        super().__init__(access_token="token", page_id="page")
+        self.pages = list(pages)
+        self.calls = []
+        self.saved = {}
+        self.fail_saves = 0
+
+    def fetch_posts_page(self, since=None, after=None, etag=None, limit=25):
+        self.calls.append({"since": since, "after": after, "etag": etag})
+        page = self.pages.pop(0)
+        if isinstance(page, Exception):
+            raise page
+        return {"posts": [], "next_cursor": None, "etag": None, "not_modified": False, **page}
+
+    def save_to_file(self, posts, filename="fb_posts.json"):
+        if self.fail_saves:
+            self.fail_saves -= 1
+            raise OSError("disk full")
+        self.saved[filename] = posts
+
+
+@pytest.fixture
+def make_engine(tmp_path, monkeypatch):
+    monkeypatch.setattr(page_sync_module, "DATA_DIR", tmp_path)
+    rag = types.SimpleNamespace(updates=[])
+    rag.update_from_facebook = rag.updates.append
+    monkeypatch.setitem(sys.modules, "core.rag_service", types.SimpleNamespace(_rag_instance=rag))
+    monkeypatch.delitem(sys.modules, "core.ai_service", raising=False)
+
+    def make(pages):
+        scraper = _ScriptedScraper(pages)
+        return PageSyncEngine(scraper=scraper, interval_minutes=1, state_path=tmp_path / "state.json"), scraper, rag
+    return make
+
+
+def test_only_changed_posts_are_pushed_and_304_is_a_no_op(make_engine):
+    """โพสต์ที่ hash ไม่เปลี่ยนไม่ถูก push ซ้ำ, 304 ใช้ ETag เดิมและไม่ apply อะไร"""
+    engine, scraper, rag = make_engine([
+        {"posts": [post("1", "โปรฟิลเลอร์ 9,900 บาท"), post("2", "รีวิวลูกค้า")], "etag": "e1"},
+        {"not_modified": True},
+        {"posts": [post("1", "โปรฟิลเลอร์ 8,900 บาท", "2026-01-16T10:00:00+0000"), post("2", "รีวิวลูกค้า")], "etag": "e2"},
+        {"posts": [post("1", "โปรฟิลเลอร์ 8,900 บาท", "2026-01-16T10:00:00+0000"), post("2", "รีวิวลูกค้า (แก้ไข)")]},
+    ])
+
+    assert [p["id"] for p in engine.sync_once()] == ["1", "2"]
+    assert engine.sync_once() == []
+    changed = engine.sync_once()
+
+    assert [p["id"] for p in changed] == ["1"]
+    assert scraper.calls[1]["etag"] == "e1"
+    assert scraper.calls[2]["since"] == engine.state["last_updated_time"] - 86400 - 1
+    assert [[p["id"] for p in update] for update in rag.updates] == [["1", "2"], ["1"]]
+    assert engine.get_stats()["not_modified"] == 1
+    assert "8,900" in (page_sync_module.DATA_DIR / "text" / "FacebookPromotions.txt").read_text(encoding="utf-8")
+
+    # since= filters on created_time: the periodic full walk is what catches an edited older post
+    engine.state["last_full_sync"] -= engine.full_sync_interval
+    assert [p["id"] for p in engine.sync_once()] == ["2"]
+    assert scraper.calls[3] == {"since": None, "after": None, "etag": None}
+    assert [p["id"] for p in rag.updates[-1]] == ["2"]
+    assert engine.get_stats()["full_walks"] == 2
+
+
+def test_resumes_cursor_after_mid_walk_failure(make_engine):
+    """ล้มที่หน้า 2: รอบถัดไปเริ่มจาก cursor เดิม (query since เดิม) และ apply โพสต์จากทั้งสองหน้า"""
+    engine, scraper, rag = make_engine([
+        {"posts": [post("3", "โปรใหม่ ลด 50%")], "next_cursor": "c2", "etag": "e1"},
+        RuntimeError("Graph 500"),
+        {"posts": [post("2", "โปรเก่า ราคาพิเศษ")]},
+    ])
+
+    assert engine.sync_once() == []
+    assert engine.state["cursor"] == "c2"
+    assert engine.state["dirty"]
+    assert rag.updates == []
+
+    # A fresh engine (restart) resumes from the persisted state
+    engine = PageSyncEngine(scraper=scraper, interval_minutes=1, state_path=engine.state_path)
+    changed = engine.sync_once()
+
+    assert scraper.calls[-1] == {"since": scraper.calls[0]["since"], "after": "c2", "etag": None}
+    assert [p["id"] for p in changed] == ["2"]
+    assert {p["id"] for p in scraper.saved["fb_posts.json"]} == {"2", "3"}
+    assert engine.state["cursor"] is None
+    assert not engine.state["dirty"]
+    # Post "3" was stored by the failed walk but must still reach the RAG index
+    assert [sorted(p["id"] for p in update) for update in rag.updates] == [["2", "3"]]
+    assert engine.state["pending_ids"] == []
+
+
+def test_dirty_changes_are_applied_on_the_next_sync(make_engine):
+    """apply ล้มหลังบันทึกโพสต์ที่เปลี่ยนแล้ว: รอบถัดไป (แม้ได้ 304) ต้อง apply ให้ครบ"""
+    engine, scraper, rag = make_engine([
+        {"posts": [post("5", "โปรวันเกิด ฟรีทรีทเมนต์")], "etag": "e1"},
+        {"not_modified": True},
+    ])
+    scraper.fail_saves = 1
+
+    assert engine.sync_once() == []
+    assert engine.state["dirty"]
+    assert rag.updates == []
+
+    assert engine.sync_once() == []
+    assert [p["id"] for p in scraper.saved["fb_posts.json"]] == ["5"]
+    assert not engine.state["dirty"]
+    assert [[p["id"] for p in update] for update in rag.updates] == [["5"]]
+    assert "hash" not in rag.updates[0][0]
+
+
+def test_pending_posts_wait_for_a_successful_rag_update(make_engine):
+    """RAG update ล้ม: pending_ids ยังอยู่ และถูก push ในรอบถัดไปแม้ Graph ตอบ 304"""
+    engine, scraper, rag = make_engine([
+        {"posts": [post("6", "โปรเดือนนี้")], "etag": "e1"},
+        {"not_modified": True},
+    ])
+
+    def failing_update(posts):
+        raise RuntimeError("chroma unavailable")
+    rag.update_from_facebook = failing_update
+
+    assert [p["id"] for p in engine.sync_once()] == ["6"]
+    assert engine.state["pending_ids"] == ["6"]
+
+    rag.update_from_facebook = rag.updates.append
+    assert engine.sync_once() == []
+    assert [[p["id"] for p in update] for update in rag.updates] == [["6"]]
+    assert engine.get_stats()["pending_rag_posts"] == 0
@@ -0,0 +1,69 @@
+"""
+Test Rate Limiter
+ทดสอบ sliding window แบบ bucket (in-memory) ของ rate limiter
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ['RATE_LIMIT_REDIS'] = 'false'
+
+from facebook_integration import rate_limiter as rate_limiter_module
+from facebook_integration.rate_limiter import RateLimiter
+
+
+def test_limit_and_atomic_acquire():
+    """ครบ limit แล้วต้องถูกบล็อก, try_acquire ไม่นับเกิน limit"""
+    limiter = RateLimiter(limit_per_day=3)
+
+    assert [limiter.try_acquire("u1") for _ in range(4)] == [True, True, True, False]
+    assert not limiter.can_reply("u1")
+    assert limiter.get_remaining_replies("u1") == 0
+    assert limiter.can_reply("u2")
+
+    limiter.reset_user("u1")
+    assert limiter.get_remaining_replies("u1") == 3
+
+
+def test_window_slides_and_stats_are_incremental(monkeypatch):
+    """hit เก่ากว่า 24 ชม. หลุดจาก window ทั้งของ user และ stats รวม"""
+    now = [1_700_000_000.0]
+    monkeypatch.setattr(rate_limiter_module.time, "time", lambda: now[0])
+    limiter = RateLimiter(limit_per_day=2)
+
+    limiter.record_reply("a")
+    limiter.record_reply("b")
+    now[0] += 3600 * 12
+    limiter.record_reply("a")
+
+    stats = limiter.get_stats()
+    assert stats["active_users_24h"] == 2
+    assert stats["total_replies_24h"] == 3
+    assert not limiter.can_reply("a")
+
+    # First hits expire, the one 12h later is still inside the window
+    now[0] += 3600 * 13
+    stats = limiter.get_stats()
+    assert stats["active_users_24h"] == 1
+    assert stats["total_replies_24h"] == 1
+    assert limiter.get_remaining_replies("a") == 1
+    assert limiter.get_remaining_replies("b") == 2
+
+
+def test_release_only_counts_a_slot_that_was_given_back(monkeypatch):
+    """release คืน slot ที่ acquire ไว้, แต่ถ้าไม่มี hit เหลือใน window (ไม่เคย acquire / หมดอายุแล้ว) stats ต้องไม่ลด"""
+    now = [1_700_000_000.0]
+    monkeypatch.setattr(rate_limiter_module.time, "time", lambda: now[0])
+    limiter = RateLimiter(limit_per_day=1)
+
+    assert limiter.try_acquire("u1")
+    assert not limiter.try_acquire("u1")
+    assert limiter.release("u1")
+    assert limiter.try_acquire("u1")
+    assert limiter.stats["allowed"] == 1
+
+    assert not limiter.release("never-acquired")
+    now[0] += 3600 * 25
+    assert not limiter.release("u1")
+    assert limiter.stats["allowed"] == 1
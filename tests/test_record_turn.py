@@ -0,0 +1,73 @@
+"""
+Test CRUDManager.record_turn
+ทดสอบการบันทึก 1 turn (ข้อความ user + bot) ใน transaction เดียว และจำนวน statement ต่อ turn
+"""
+
+import sys
+import os
+from contextlib import contextmanager
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+
+from database.connection import create_database_engine
+from database.crud import CRUDManager
+from database.models import Base, User, Conversation, Message
+
+
+class _TestDatabase:
+    """Minimal stand-in for DatabaseManager bound to a temporary SQLite file"""
+
+    def __init__(self, url):
+        self.engine = create_database_engine(url)
+        Base.metadata.create_all(bind=self.engine)
+        self._session_factory = sessionmaker(bind=self.engine, expire_on_commit=False)
+
+    @contextmanager
+    def get_session(self):
+        session = self._session_factory()
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+
+def test_record_turn_upserts_and_counts(tmp_path):
+    """turn แรกสร้าง user + conversation, turn ถัดไปใช้ของเดิมและนับข้อความต่อ"""
+    db = _TestDatabase(f"sqlite:///{tmp_path / 'turn.db'}")
+    crud = CRUDManager(db)
+
+    first = crud.record_turn("line", "U1", "สวัสดีค่ะ", "สวัสดีค่ะ มีอะไรให้ช่วยคะ", display_name="Mint")
+    second = crud.record_turn("line", "U1", "ราคาฟิลเลอร์", "CC แรก 12,900 ค่ะ", metadata={"cache_hit": True})
+    crud.record_turn("line", "U1", "ติดตาม (Follow)", None)
+
+    assert first["user_id"] == second["user_id"]
+    assert first["conversation_id"] == second["conversation_id"]
+
+    with db.get_session() as session:
+        user = session.query(User).one()
+        conversation = session.query(Conversation).one()
+        messages = session.query(Message).order_by(Message.id).all()
+        assert user.display_name == "Mint"
+        assert user.total_messages == 5
+        assert conversation.messages_count == 5
+        assert [m.role for m in messages] == ["user", "assistant", "user", "assistant", "user"]
+        assert messages[3].message_metadata == {"cache_hit": True}
+
+
+def test_record_turn_round_trips(tmp_path):
+    """turn ของ user เดิม: upsert user + update conversation + insert messages = 3 statement"""
+    db = _TestDatabase(f"sqlite:///{tmp_path / 'trips.db'}")
+    crud = CRUDManager(db)
+    crud.record_turn("facebook", "P1", "hi", "hello")
+
+    statements = []
+    event.listen(db.engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    crud.record_turn("facebook", "P1", "price?", "12,900")
+
+    assert len(statements) == 3
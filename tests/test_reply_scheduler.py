@@ -0,0 +1,140 @@
+"""
+Test Priority Reply Scheduler
+ทดสอบลำดับตาม intent priority, aging และการ downgrade เมื่อคิวล้น
+"""
+
+import sys
+import os
+import asyncio
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from facebook_integration.reply_scheduler import PriorityReplyScheduler
+
+
+def test_high_priority_first_and_low_priority_degraded_under_load():
+    """booking (10) ถูกตอบก่อน praise (2) ที่มาก่อน, praise ช่วงคิวยาวได้ template แทน LLM"""
+    handled = []
+
+    def job(name):
+        async def run(degraded):
+            handled.append((name, degraded))
+        return run
+
+    async def run():
+        scheduler = PriorityReplyScheduler(workers=1, max_depth=100, degrade_depth=2)
+        # Hold the single worker until everything is queued
+        gate = asyncio.Event()
+
+        async def blocker(degraded):
+            await gate.wait()
+
+        await scheduler.submit(10, "high", blocker)
+        await asyncio.sleep(0)
+        for n in range(3):
+            await scheduler.submit(2, "low", job(f"praise{n}"))
+        await scheduler.submit(10, "high", job("booking"))
+        gate.set()
+        await scheduler.join(timeout=1)
+        return scheduler
+
+    scheduler = asyncio.run(run())
+
+    assert handled[0] == ("booking", False)
+    assert [name for name, _ in handled[1:]] == ["praise0", "praise1", "praise2"]
+    assert [degraded for _, degraded in handled[1:]] == [True, False, False]
+    stats = scheduler.get_stats()["classes"]
+    assert stats["low"]["degraded"] == 1
+    assert stats["high"]["completed"] == 2
+
+
+def test_aging_lets_old_low_priority_work_overtake():
+    """praise ที่รอนานพอจะได้ลำดับก่อน booking ที่เพิ่งเข้ามา (กัน starvation)"""
+    handled = []
+
+    def job(name):
+        async def run(degraded):
+            handled.append(name)
+        return run
+
+    async def run():
+        # 1000 points per second: a 50 ms wait outweighs the 8-point gap
+        scheduler = PriorityReplyScheduler(workers=1, aging_per_minute=60000)
+        gate = asyncio.Event()
+
+        async def blocker(degraded):
+            await gate.wait()
+
+        await scheduler.submit(10, "high", blocker)
+        await asyncio.sleep(0)
+        await scheduler.submit(2, "low", job("old praise"))
+        await asyncio.sleep(0.05)
+        await scheduler.submit(10, "high", job("new booking"))
+        gate.set()
+        await scheduler.join(timeout=1)
+
+    asyncio.run(run())
+
+    assert handled == ["old praise", "new booking"]
+
+
+def test_drops_low_priority_when_full():
+    """คิวเต็ม: งาน priority ต่ำถูก drop, งาน high ยังรับได้"""
+    async def noop(degraded):
+        await asyncio.sleep(10)
+
+    async def run():
+        scheduler = PriorityReplyScheduler(workers=1, max_depth=2, degrade_depth=1)
+        results = [await scheduler.submit(2, "low", noop) for _ in range(4)]
+        results.append(await scheduler.submit(10, "high", noop))
+        await scheduler.join(timeout=0.01)
+        return scheduler, results
+
+    scheduler, results = asyncio.run(run())
+
+    assert results == [True, True, False, False, True]
+    assert scheduler.get_stats()["classes"]["low"]["dropped"] == 2
+
+
+def test_comment_burst_cannot_bypass_rate_limit():
+    """คอมเมนต์รัวๆ จาก user เดียว: slot ถูกจองตอน submit จึงตอบได้ไม่เกิน limit, งานที่ถูก drop คืน slot"""
+    os.environ['RATE_LIMIT_REDIS'] = 'false'
+    from facebook_integration.comment_webhook import FacebookCommentWebhook
+    from facebook_integration.rate_limiter import RateLimiter
+
+    webhook = FacebookCommentWebhook()
+    webhook.auto_reply_enabled = True
+    webhook.rate_limiter = RateLimiter(limit_per_day=2, name="test_burst", use_redis=False)
+    sent = []
+
+    async def reply(comment_id, message):
+        sent.append(comment_id)
+        return True
+
+    webhook._reply_to_comment = reply
+    webhook._send_dm = lambda user_psid, message: asyncio.sleep(0, result=True)
+    webhook._log_to_database = lambda data: None
+    webhook.auto_reply_engine.generate_replies = lambda **kwargs: ("ทักแชทนะคะ", None)
+
+    def comment(n, user="burst_user"):
+        return {
+            "item": "comment", "verb": "add", "post_id": "post_1",
+            "comment_id": f"burst_{user}_{n}_{os.getpid()}",
+            "from": {"id": user, "name": "Mint"}, "message": "ราคาเท่าไหร่คะ"
+        }
+
+    async def run():
+        webhook.reply_scheduler = PriorityReplyScheduler(workers=1, max_depth=100)
+        for n in range(5):
+            await webhook._handle_comment(comment(n))
+        await webhook.reply_scheduler.join(timeout=5)
+
+        # Overloaded queue: the dropped comment must not consume the user's budget
+        webhook.reply_scheduler = PriorityReplyScheduler(workers=1)
+        webhook.reply_scheduler.max_depth = 0
+        await webhook._handle_comment(comment(0, user="dropped_user"))
+
+    asyncio.run(run())
+
+    assert len(sent) == 2
+    assert webhook.rate_limiter.get_remaining_replies("burst_user") == 0
+    assert webhook.rate_limiter.get_remaining_replies("dropped_user") == 2
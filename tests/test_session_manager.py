@@ -0,0 +1,51 @@
+"""
+Test Session Manager
+ทดสอบ session แบบ compact (ไม่เก็บ system prompt ซ้ำ) และการ expire session
+"""
+
+import sys
+import os
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from platforms.session_manager import SessionManager, MAX_HISTORY
+
+
+def test_history_bounded_and_prompt_reattached():
+    """history เก็บแค่ MAX_HISTORY ข้อความ, system prompt ถูกแนบตอนประกอบ prompt เท่านั้น"""
+    manager = SessionManager(use_redis=False)
+
+    for i in range(MAX_HISTORY + 5):
+        manager.update_session("line", "U1", {"role": "user", "content": f"msg {i}"})
+
+    session = manager.get_session("line", "U1")
+    assert len(session.history) == MAX_HISTORY
+    assert all(m["role"] != "system" for m in session.history)
+    assert session.message_count == MAX_HISTORY + 5
+
+    history = manager.get_conversation_history("line", "U1")
+    assert history[0]["role"] == "system"
+    assert history[-1]["content"] == f"msg {MAX_HISTORY + 4}"
+    assert len(history) == MAX_HISTORY + 1
+
+
+def test_sweeper_evicts_only_expired():
+    """sweeper ลบเฉพาะ session ที่หมดอายุ, สถิติอัปเดตแบบ incremental"""
+    manager = SessionManager(use_redis=False)
+
+    for i in range(50):
+        manager.update_session("facebook", f"U{i}", {"role": "user", "content": "hi"})
+    manager.session_ttl = 0.05
+    time.sleep(0.1)
+    manager.update_session("line", "fresh", {"role": "user", "content": "hi"})
+
+    # Before the sweep: expired sessions are tracked but not counted as active
+    assert manager.get_active_sessions_count() == 1
+    assert manager.get_session_stats()["expired_pending_sweep"] == 50
+
+    assert manager.sweep_expired(batch_size=7) == 50
+
+    stats = manager.get_session_stats()
+    assert stats["total_sessions"] == 1
+    assert stats["by_platform"] == {"line": 1}
+    assert stats["evicted_sessions"] == 50
@@ -0,0 +1,39 @@
+"""
+Test Startup Warm-up
+ทดสอบว่า warm-up ตั้ง ready เสมอ (degraded) แม้ขั้นตอนเสริมหลังสร้าง handler ล้มเหลว
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asyncio
+
+import main_app
+
+
+def test_failing_optional_step_still_marks_the_app_ready(monkeypatch):
+    """set_handlers ล้ม: /ready ต้องไม่ค้าง 503 ตลอดอายุ process แต่รายงาน degraded"""
+    monkeypatch.setattr(main_app, "startup_state", {
+        "ready": False, "degraded": False, "started_at": None, "total_seconds": None, "components": {}
+    })
+    for name in ("line_handler", "fb_comment_handler", "fb_messenger_handler", "instagram_handler"):
+        monkeypatch.setattr(main_app, name, None)
+    for loader in ("_load_ai_service", "_init_database", "_load_session_store", "_load_event_dedup",
+                   "_import_line_sdk", "_create_line_handler", "_create_fb_comment_handler",
+                   "_create_fb_messenger_handler", "_create_instagram_handler"):
+        monkeypatch.setattr(main_app, loader, lambda: object())
+
+    def broken_registry(**handlers):
+        raise RuntimeError("registry exploded")
+    monkeypatch.setattr(main_app, "set_handlers", broken_registry)
+    monkeypatch.setattr(main_app, "_start_stats_rollup", lambda: None)
+    monkeypatch.setattr(main_app, "_backfill_user_tags", lambda: None)
+
+    asyncio.run(main_app.warm_up())
+
+    state = main_app.startup_state
+    assert state["ready"] and state["degraded"]
+    assert state["components"]["handler_registry"]["ok"] is False
+    assert state["components"]["stats_rollup"]["ok"] is True
+    assert asyncio.run(main_app.readiness_check())["status"] == "degraded"
@@ -0,0 +1,110 @@
+"""
+Test Vision Service
+ทดสอบการเตรียมภาพ (ย่อขนาด / JPEG) และ analysis cache ที่จับภาพ forward ซ้ำที่ถูกบีบอัดใหม่ได้
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import base64
+import io
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image, ImageDraw
+
+from core.vision_service import VisionService
+
+
+def _promo_image(size=(2000, 1500)) -> Image.Image:
+    img = Image.new("RGB", size, (240, 220, 200))
+    draw = ImageDraw.Draw(img)
+    width, height = size
+    for i in range(8):
+        x = i * width // 8
+        draw.rectangle([x, 0, x + width // 16, height], fill=(30 * i, 80, 255 - 30 * i))
+    draw.ellipse([width // 4, height // 4, width * 3 // 4, height * 3 // 4], fill=(200, 30, 60))
+    return img
+
+
+def _encode(img: Image.Image, fmt: str, **kwargs) -> bytes:
+    buf = io.BytesIO()
+    img.save(buf, format=fmt, **kwargs)
+    return buf.getvalue()
+
+
+class _FakeCompletions:
+    def __init__(self):
+        self.calls = 0
+
+    def create(self, **kwargs):
+        self.calls += 1
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content='{"name": "Filler", "price": "4,999"}'))],
+            usage=SimpleNamespace(prompt_tokens=900, completion_tokens=40)
+        )
+
+
+@pytest.fixture
+def vision(monkeypatch):
+    monkeypatch.setenv("TYPHOON_API_KEY", "test-key")
+    service = VisionService()
+    service.client = SimpleNamespace(chat=SimpleNamespace(completions=_FakeCompletions()))
+    return service
+
+
+def test_prepare_image_downsizes_to_max_side(vision):
+    """ภาพ banner 4000x1000 ถูกย่อเหลือด้านยาว 1024px เป็น JPEG และ image tokens ลดลง"""
+    photo = Image.merge("RGB", [Image.effect_noise((4000, 1000), 40 + 10 * i) for i in range(3)])
+    original = _encode(photo, "PNG")
+    prep = vision.prepare_image(image_bytes=original)
+
+    with Image.open(io.BytesIO(base64.b64decode(prep["base64"]))) as img:
+        assert img.format == "JPEG"
+        assert max(img.size) == vision.max_image_side
+    assert prep["bytes_after"] < prep["bytes_before"]
+    assert prep["tokens_after"] < prep["tokens_before"]
+    assert len(prep["image_key"]) == 16
+
+
+def test_recompressed_forward_hits_the_analysis_cache(vision):
+    """ภาพเดิมที่ถูกย่อ + บีบอัด JPEG ใหม่ (forward ผ่าน LINE) ใช้ผลวิเคราะห์เดิม ไม่เรียกโมเดลซ้ำ"""
+    original = _promo_image()
+    forwarded = original.resize((800, 600))
+
+    first = vision.analyze_promotion_image(image_bytes=_encode(original, "PNG"))
+    second = vision.analyze_promotion_image(image_bytes=_encode(forwarded, "JPEG", quality=60))
+
+    assert first["success"] and first["cache_hit"] is False
+    assert second["cache_hit"] is True
+    assert second["promotion"] == first["promotion"]
+    assert vision.client.chat.completions.calls == 1
+
+    # A different image must not reuse the analysis
+    other = Image.new("RGB", (1200, 900), (20, 20, 20))
+    ImageDraw.Draw(other).rectangle([0, 0, 600, 450], fill=(250, 250, 250))
+    third = vision.analyze_promotion_image(image_bytes=_encode(other, "PNG"))
+    assert third["cache_hit"] is False
+    assert vision.client.chat.completions.calls == 2
+
+
+def test_exact_content_keys_never_match_by_distance(vision):
+    """key แบบ exact-content ("sha256-..." เมื่อไม่มี Pillow / "url-...") hit ได้เฉพาะ key ที่ตรงกันทุกตัว"""
+    vision._set_cached_analysis("promotion", "sha256-" + "0" * 64, {"promotion": "a"})
+    assert vision._get_cached_analysis("promotion", "sha256-" + "0" * 63 + "1") is None
+    assert vision._get_cached_analysis("promotion", "sha256-" + "0" * 64) == {"promotion": "a"}
+
+
+def test_skin_photos_are_never_matched_to_a_look_alike(vision):
+    """ภาพผิวของลูกค้าอีกคนที่ dHash ใกล้เคียงกันต้องไม่ได้ผลวิเคราะห์ของคนแรก (ใช้ได้เฉพาะ bytes ตรงกัน)"""
+    photo = _promo_image()
+    look_alike = _encode(photo.resize((800, 600)), "JPEG", quality=60)
+
+    first = vision.analyze_skin_image(image_bytes=_encode(photo, "PNG"))
+    second = vision.analyze_skin_image(image_bytes=look_alike)
+    again = vision.analyze_skin_image(image_bytes=look_alike)
+
+    assert first["cache_hit"] is False and second["cache_hit"] is False
+    assert again["cache_hit"] is True
+    assert vision.client.chat.completions.calls == 2
@@ -0,0 +1,130 @@
+"""
+Test Keyed Work Queue
+ทดสอบลำดับงานต่อ user และ backpressure ของคิว webhook
+"""
+
+import sys
+import os
+import asyncio
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from platforms.work_queue import KeyedWorkQueue
+
+
+def test_per_key_order_and_parallelism():
+    """งานของ user เดียวกันต้องเรียงลำดับ, ต่าง user ทำขนานกันได้"""
+    async def run():
+        queue = KeyedWorkQueue("test", concurrency=4, max_depth=100)
+        log = []
+
+        def make_job(key, n):
+            async def job():
+                await asyncio.sleep(0.01 * (3 - n))
+                log.append((key, n))
+            return job
+
+        for n in range(3):
+            for key in ("A", "B"):
+                assert queue.submit(key, make_job(key, n))
+
+        assert await queue.join(timeout=5)
+        return queue, log
+
+    queue, log = asyncio.run(run())
+
+    assert [n for key, n in log if key == "A"] == [0, 1, 2]
+    assert [n for key, n in log if key == "B"] == [0, 1, 2]
+    stats = queue.get_stats()
+    assert stats["completed"] == 6
+    assert stats["depth"] == 0
+    assert stats["active_keys"] == 0
+
+
+def test_backpressure_and_failures():
+    """คิวเต็มต้อง reject, งานที่ error ไม่ทำให้งานถัดไปหยุด"""
+    async def run():
+        queue = KeyedWorkQueue("test", concurrency=1, max_depth=2)
+
+        async def boom():
+            raise RuntimeError("boom")
+
+        async def ok():
+            pass
+
+        assert queue.submit("A", boom)
+        assert queue.submit("A", ok)
+        assert not queue.has_capacity()
+        assert not queue.submit("A", ok)
+        # Already-acknowledged work (e.g. a debounced flush) is never dropped
+        assert queue.submit("B", ok, force=True)
+
+        await queue.join(timeout=5)
+        return queue
+
+    stats = asyncio.run(run()).get_stats()
+    assert stats["failed"] == 1
+    assert stats["completed"] == 2
+    assert stats["rejected"] == 1
+
+
+def test_line_webhook_honours_max_depth(monkeypatch):
+    """LINE เช็ค capacity ครั้งเดียวต่อ delivery (รวม turn ที่ debounce ค้างอยู่), submit ตรงไม่ใช้ force และ delivery ที่ถูกปฏิเสธส่งซ้ำได้"""
+    import base64
+    import hashlib
+    import hmac
+    import json
+
+    import pytest
+    from fastapi import HTTPException
+    from platforms import event_dedup
+    from platforms.event_dedup import EventDeduplicator
+    from platforms.line_handler import LineHandler
+
+    monkeypatch.setenv("LINE_CHANNEL_ACCESS_TOKEN", "token")
+    monkeypatch.setenv("LINE_CHANNEL_SECRET", "secret")
+    monkeypatch.setattr(event_dedup, "_event_deduplicator", EventDeduplicator(ttl_seconds=60, use_redis=False))
+    handler = LineHandler()
+    handler.work_queue.max_depth = 2
+    submitted = []
+
+    def submit(key, job, force=False):
+        submitted.append((key, force))
+        handler.work_queue._depth += 1
+        return True
+    monkeypatch.setattr(handler.work_queue, "submit", submit)
+
+    def event(event_id, user, text=None):
+        base = {"webhookEventId": event_id, "timestamp": 1700000000000, "mode": "active",
+                "source": {"type": "user", "userId": user}, "replyToken": f"rt-{event_id}",
+                "deliveryContext": {"isRedelivery": False}}
+        if text is None:
+            return {**base, "type": "follow", "follow": {"isUnblocked": False}}
+        return {**base, "type": "message", "message": {"id": f"m-{event_id}", "type": "text", "text": text, "quoteToken": "q"}}
+
+    class _Request:
+        def __init__(self, *events):
+            self.body_bytes = json.dumps({"destination": "bot", "events": list(events)}).encode()
+            signature = base64.b64encode(hmac.new(b"secret", self.body_bytes, hashlib.sha256).digest()).decode()
+            self.headers = {"X-Line-Signature": signature}
+
+        async def body(self):
+            return self.body_bytes
+
+    async def run():
+        assert (await handler.handle_webhook(_Request(event("e1", "U1"), event("e2", "U2"))))["queued"] == 2
+
+        # Queue full: the text delivery is refused and forgotten, so LINE's retry is processed
+        with pytest.raises(HTTPException) as busy:
+            await handler.handle_webhook(_Request(event("e3", "U3", "สนใจค่ะ")))
+        assert busy.value.status_code == 503
+        handler.work_queue._depth = 0
+        assert (await handler.handle_webhook(_Request(event("e3", "U3", "สนใจค่ะ"))))["queued"] == 1
+        assert handler.debouncer.pending_turns == 1
+
+        # The buffered turn reserves its slot: 2 new events + 1 pending turn > max_depth
+        with pytest.raises(HTTPException):
+            await handler.handle_webhook(_Request(event("e4", "U4"), event("e5", "U5")))
+        handler.debouncer.flush("U3")
+
+    asyncio.run(run())
+    assert submitted == [("U1", False), ("U2", False), ("U3", True)]